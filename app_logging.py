@@ -0,0 +1,272 @@
+"""
+このファイルは、アプリ全体のログ出力（JSON Lines・非同期書き込み・ローテーション）を設定するファイルです。
+- リクエストを処理するスレッドはログをキューに積むだけで、ファイルへの書き込みは専用スレッドが行う
+- ファイルは1行1 JSON（logs/app.jsonl）。サイズ・日付のどちらかで切り替え、古いものは BACKUP_COUNT 世代まで残す
+- 質問・回答のログは user_message_event / answer_event で作る決まった形（event 名とキー）で出す
+- パスはプロジェクトからの相対パス（/ 区切り）に直して出す（マシンごとの絶対パスを残さない）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import logging
+import datetime
+import threading
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import constants as ct
+
+
+# ログに出す文字列から取り除く、プロジェクトの絶対パス（/ と \ の両方の表記）
+_ROOT = str(Path(__file__).resolve().parent)
+_ROOT_PREFIXES = tuple({_ROOT + os.sep, _ROOT.replace("\\", "/") + "/", _ROOT.replace("/", "\\") + "\\"})
+# 他の環境（Windows など）で作られた data/ 配下の絶対パス
+_FOREIGN_DATA_PATH = re.compile(r"(?:[A-Za-z]:)?[\\/](?:[^\\/\s'\"]+[\\/])*?(data[\\/][^'\"\n]*)")
+
+# 標準の LogRecord 属性（extra= で渡された項目と区別するため）
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "session_id"}
+
+_setup_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_listener_started = False
+_queue_handler: Optional[QueueHandler] = None
+
+
+############################################################
+# 相対パス化
+############################################################
+def rel_path(path: Any) -> str:
+    """プロジェクト配下のパスを「data/...」のような / 区切りの相対パスにする"""
+    s = str(path)
+    for prefix in _ROOT_PREFIXES:
+        if s.startswith(prefix):
+            s = s[len(prefix):]
+            break
+    m = _FOREIGN_DATA_PATH.fullmatch(s)
+    if m:
+        s = m.group(1)
+    s = s.replace("\\", "/")
+    return s[2:] if s.startswith("./") else s
+
+
+def _scrub(value: Any) -> Any:
+    """dict / list をたどって、文字列中のプロジェクトの絶対パスを取り除く"""
+    if isinstance(value, str):
+        for prefix in _ROOT_PREFIXES:
+            if prefix in value:
+                value = value.replace(prefix, "")
+        return value
+    if isinstance(value, dict):
+        return {str(k): _scrub(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_scrub(v) for v in value]
+    return value
+
+
+############################################################
+# イベント（質問・回答）の形
+############################################################
+def user_message_event(message: str, mode: str) -> Dict[str, Any]:
+    """利用者の質問。{"event": "user_message", "mode", "message"}"""
+    return {"event": "user_message", "mode": mode, "message": message}
+
+
+def _content_sources(content: Dict[str, Any]) -> List[str]:
+    """画面表示用の content から参照元のパスを取り出す"""
+    sources: List[str] = []
+    if content.get("main_file_path"):
+        sources.append(content["main_file_path"])
+    for sub in content.get("sub_choices") or []:
+        if isinstance(sub, dict) and sub.get("source"):
+            sources.append(sub["source"])
+    sources.extend(s for s in content.get("file_info_list") or [] if isinstance(s, str))
+    return [rel_path(s) for s in sources]
+
+
+def answer_event(content: Any, mode: str, *, route: str, trace_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    回答。{"event": "answer", "mode", "route", "answer", "sources", "trace_id"}
+    route は回答の経路（rag / roster_table / roster_query / fallback）。
+    """
+    if isinstance(content, dict):
+        answer = content.get("answer") or content.get("main_message") or ""
+        sources = _content_sources(content)
+    else:
+        answer, sources = str(content or ""), []
+    return {
+        "event": "answer",
+        "mode": mode,
+        "route": route,
+        "answer": answer,
+        "sources": sources,
+        "trace_id": trace_id,
+    }
+
+
+############################################################
+# フォーマッタ・ハンドラ
+############################################################
+class JsonFormatter(logging.Formatter):
+    """
+    1レコード = 1行の JSON。共通キーは ts / level / logger / event（と session_id）。
+    メッセージが dict ならその中身をそのまま展開し（event が無ければ "log"）、文字列なら message に入れる。
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        session_id = getattr(record, "session_id", None)
+        if session_id:
+            out["session_id"] = session_id
+        if isinstance(record.msg, dict):
+            out["event"] = record.msg.get("event", "log")
+            out.update({k: v for k, v in record.msg.items() if k != "event"})
+        else:
+            out["event"] = "log"
+            out["message"] = record.getMessage()
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in out:
+                out[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(_scrub(out), ensure_ascii=False, default=str)
+
+
+class SizeAndTimeRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    日付（when）とサイズ（max_bytes）のどちらかを超えたら切り替える。
+    同じ期間内にサイズで複数回切り替えたときは、末尾に .001 .002 ... を付けて上書きしない
+    （名前順 = 古い順になるので、世代数を超えた分は古いものから消える）。
+    """
+
+    def __init__(self, filename: str, *, max_bytes: int = 0, **kwargs: Any) -> None:
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if super().shouldRollover(record):
+            return 1
+        if self.max_bytes > 0 and self.stream is not None and self.stream.tell() >= self.max_bytes:
+            return 1
+        return 0
+
+    def rotation_filename(self, default_name: str) -> str:
+        name, n = default_name, 0
+        while os.path.exists(name):
+            n += 1
+            name = f"{default_name}.{n:03d}"
+        return super().rotation_filename(name)
+
+
+class _SessionFilter(logging.Filter):
+    """Streamlit のセッションから出たログに session_id を付ける（ログを出したスレッドで実行される）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "session_id"):
+            try:
+                from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+                ctx = get_script_run_ctx(suppress_warning=True)
+                record.session_id = ctx.session_id if ctx else None
+            except Exception:
+                record.session_id = None
+        return True
+
+
+class _StructuredQueueHandler(QueueHandler):
+    """
+    標準の QueueHandler は積む前にメッセージを文字列へ整形するため、dict のメッセージを残したまま積む。
+    整形（JSON 化）は書き込みスレッド側で行う。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        else:
+            record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+############################################################
+# 設定
+############################################################
+def setup_logging() -> Optional[QueueListener]:
+    """
+    ルートロガーにキュー経由のハンドラを設定する（何度呼んでも1回だけ設定される）。
+    書き込み先: logs/app.jsonl（JSON Lines、ローテーションあり）と標準出力（テキスト）。
+    """
+    global _listener, _listener_started, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        log_dir = Path(getattr(ct, "LOG_DIR_PATH", "./logs"))
+        log_dir.mkdir(parents=True, exist_ok=True)
+        file_handler = SizeAndTimeRotatingFileHandler(
+            str(log_dir / getattr(ct, "LOG_JSON_FILE", "app.jsonl")),
+            max_bytes=getattr(ct, "LOG_MAX_BYTES", 10 * 1024 * 1024),
+            when=getattr(ct, "LOG_ROTATE_WHEN", "midnight"),
+            backupCount=getattr(ct, "LOG_BACKUP_COUNT", 14),
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(JsonFormatter())
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+
+        log_queue: queue.Queue = queue.Queue(-1)
+        queue_handler = _StructuredQueueHandler(log_queue)
+        queue_handler.addFilter(_SessionFilter())
+
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(queue_handler)
+        root.setLevel(getattr(logging, str(getattr(ct, "LOG_LEVEL", "INFO")).upper(), logging.INFO))
+
+        _queue_handler = queue_handler
+        _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        _listener.start()
+        _listener_started = True
+        # 終了時にキューに残ったログを書き切る（設定し直しても登録は1つ）
+        atexit.unregister(shutdown_logging)
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def shutdown_logging() -> None:
+    """
+    キューに残ったログを書き切って書き込みスレッドを止め、ルートロガーからハンドラを外す。
+    このあと setup_logging() を呼べば設定し直される（同じプロセスでの再起動）。
+    """
+    global _listener, _listener_started, _queue_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _queue_handler = None
+        if _listener is not None:
+            if _listener_started:
+                _listener.stop()
+                _listener_started = False
+            for h in _listener.handlers:
+                h.close()
+            _listener = None
@@ -0,0 +1,5 @@
+"""
+オフラインのベンチマーク（OpenAI を呼ばずに各段の処理時間を計測する）。
+リポジトリのルートで実行します:
+    python -m benchmarks.run_benchmarks --scales 1,4 --out bench.json
+"""
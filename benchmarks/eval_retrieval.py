@@ -0,0 +1,259 @@
+"""
+検索の精度と速度を、設定（検索方式 × チャンクサイズ）ごとに比べる評価ツールです。
+正解ラベル付きの質問集（retrieval_queries.json: 質問 → 正解のファイル）で
+recall@k・MRR・1質問あたりの検索時間を計測します。埋め込みは benchmarks.fakes のローカル版を使い、
+OpenAI には接続しません（dense の精度は本番の埋め込みとは異なる。設定どうしの相対比較に使う）。
+
+    recall@k : 上位 k チャンクの出典に含まれた正解ファイルの割合（質問ごとの平均）
+    MRR      : 最初に正解ファイルのチャンクが現れた順位の逆数（質問ごとの平均）
+
+現在の設定（constants の CHUNK_SIZE / CHUNK_OVERLAP / TOP_K、ハイブリッド）を基準にし、
+「基準より速く、recall@k・MRR が下がらない」設定に candidate の印を付けます。
+
+使い方:
+    python -m benchmarks.eval_retrieval --chunk-sizes 300:30,500:50,1000:100 --out eval.json
+    python -m benchmarks.eval_retrieval --embed-latency 0.2   # 埋め込みAPIの往復も含めた速度で比べる
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import constants as ct  # noqa: E402
+from benchmarks.run_benchmarks import _git_commit, _latency_stats, _timed  # noqa: E402
+
+
+DEFAULT_QUERY_FILE = Path(__file__).with_name("retrieval_queries.json")
+RETRIEVERS = ("dense", "bm25", "hybrid")
+
+
+############################################################
+# 質問集
+############################################################
+def _norm_path(path: str) -> str:
+    return unicodedata.normalize("NFC", Path(path).as_posix())
+
+
+def load_queries(path: Path, data_dir: Path) -> List[Dict[str, Any]]:
+    """質問集を読み、正解ファイルが data/ に無いものは警告して外す"""
+    items = json.loads(path.read_text(encoding="utf-8"))
+    queries = []
+    for item in items:
+        relevant = {_norm_path(p) for p in item["relevant"]}
+        missing = [p for p in relevant if not (data_dir / p).exists()]
+        for p in missing:
+            print(f"warning: 正解ファイルが見つかりません: {p}（{item['query']}）", file=sys.stderr)
+        relevant -= set(missing)
+        if relevant:
+            queries.append({"query": item["query"], "relevant": relevant})
+    return queries
+
+
+############################################################
+# 評価指標
+############################################################
+def score_ranking(sources: Sequence[str], relevant: set, ks: Sequence[int]) -> Dict[str, float]:
+    """
+    sources は検索結果（チャンク）の出典を順位順に並べたもの。
+    同じファイルのチャンクが複数あっても、正解ファイルは1回だけ数える。
+    """
+    out: Dict[str, float] = {}
+    for k in ks:
+        out[f"recall@{k}"] = len(relevant & set(sources[:k])) / len(relevant)
+    rank = next((i for i, s in enumerate(sources, 1) if s in relevant), None)
+    out["mrr"] = 1.0 / rank if rank else 0.0
+    return out
+
+
+############################################################
+# 設定ごとの検索器
+############################################################
+@contextmanager
+def _chunk_params(size: int, overlap: int):
+    """initialize._split_docs が読む定数を一時的に差し替える"""
+    saved = (getattr(ct, "CHUNK_SIZE", 500), getattr(ct, "CHUNK_OVERLAP", 50))
+    ct.CHUNK_SIZE, ct.CHUNK_OVERLAP = size, overlap
+    try:
+        yield
+    finally:
+        ct.CHUNK_SIZE, ct.CHUNK_OVERLAP = saved
+
+
+def build_retrievers(docs, size: int, overlap: int, k: int, embeddings) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """本番（initialize）と同じ部品で dense / bm25 / hybrid を組み立てる"""
+    import initialize
+    import retrieval
+    import sparse_index
+    from langchain_community.vectorstores import Chroma
+
+    with _chunk_params(size, overlap):
+        chunks, split_sec = _timed(lambda: initialize._split_docs(docs))
+
+    candidates = max(k, getattr(ct, "HYBRID_CANDIDATES", 10))
+    vectordb = Chroma(collection_name=f"eval_{size}_{overlap}", embedding_function=embeddings)
+    _, embed_sec = _timed(lambda: vectordb.add_documents(chunks))
+    index, sparse_sec = _timed(lambda: sparse_index.SparseIndex.build(chunks))
+
+    dense = retrieval.DenseRetriever(vectorstore=vectordb, k=candidates)
+    bm25 = sparse_index.SparseRetriever(index=index, k=candidates)
+    retrievers = {
+        "dense": dense,
+        "bm25": bm25,
+        "hybrid": retrieval.HybridRetriever(
+            dense=dense,
+            sparse=bm25,
+            k=k,
+            dense_weight=getattr(ct, "HYBRID_DENSE_WEIGHT", 1.0),
+            sparse_weight=getattr(ct, "HYBRID_SPARSE_WEIGHT", 1.0),
+            rrf_k=getattr(ct, "RRF_K", 60),
+        ),
+    }
+    build = {"chunks": len(chunks), "split_sec": split_sec, "embed_sec": embed_sec, "sparse_build_sec": sparse_sec}
+    return retrievers, build
+
+
+def evaluate(retriever, queries, data_dir: Path, ks: Sequence[int], repeat: int) -> Dict[str, Any]:
+    retriever.invoke(queries[0]["query"])  # 初回のみの準備コストを除く
+    top = max(ks)
+    latencies: List[float] = []
+    totals: Dict[str, float] = {}
+    per_query = []
+    for q in queries:
+        docs = []
+        for _ in range(repeat):
+            docs, sec = _timed(lambda: retriever.invoke(q["query"], k=top))
+            latencies.append(sec)
+        sources = [_norm_path(os.path.relpath(d.metadata.get("source", ""), data_dir)) for d in docs[:top]]
+        scores = score_ranking(sources, q["relevant"], ks)
+        for name, v in scores.items():
+            totals[name] = totals.get(name, 0.0) + v
+        per_query.append({"query": q["query"], **scores})
+    metrics = {name: v / len(queries) for name, v in totals.items()}
+    return {"metrics": metrics, "latency": _latency_stats(latencies), "per_query": per_query}
+
+
+############################################################
+# 比較
+############################################################
+def _parse_chunk_sizes(text: str) -> List[Tuple[int, int]]:
+    """「300:30,500:50」→ [(300, 30), (500, 50)]（重なりを省くとサイズの 1/10）"""
+    out = []
+    for part in (p.strip() for p in text.split(",")):
+        if part:
+            size, _, overlap = part.partition(":")
+            out.append((int(size), int(overlap) if overlap else int(size) // 10))
+    return out
+
+
+def mark_candidates(rows: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]], k: int) -> None:
+    """基準より p50 が速く、recall@k と MRR が基準以上の設定に candidate=True を付ける"""
+    if baseline is None:
+        return
+    base_m, base_p50 = baseline["metrics"], baseline["latency"]["p50_ms"]
+    for row in rows:
+        m = row["metrics"]
+        row["candidate"] = (
+            row is not baseline
+            and row["latency"]["p50_ms"] < base_p50
+            and m[f"recall@{k}"] >= base_m[f"recall@{k}"]
+            and m["mrr"] >= base_m["mrr"]
+        )
+
+
+def _print_table(rows: List[Dict[str, Any]], ks: Sequence[int]) -> None:
+    head = ["retriever", "chunk", "n_chunks"] + [f"R@{k}" for k in ks] + ["MRR", "p50_ms", "p95_ms", ""]
+    print("\t".join(head), file=sys.stderr)
+    for row in rows:
+        m, lat = row["metrics"], row["latency"]
+        mark = "*baseline" if row.get("baseline") else ("candidate" if row.get("candidate") else "")
+        cells = [row["retriever"], f"{row['chunk_size']}/{row['chunk_overlap']}", str(row["chunks"])]
+        cells += [f"{m[f'recall@{k}']:.3f}" for k in ks]
+        cells += [f"{m['mrr']:.3f}", f"{lat['p50_ms']:.1f}", f"{lat['p95_ms']:.1f}", mark]
+        print("\t".join(cells), file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    size, overlap = getattr(ct, "CHUNK_SIZE", 500), getattr(ct, "CHUNK_OVERLAP", 50)
+    top_k = getattr(ct, "TOP_K", 5)
+    ap.add_argument("--data", default=str(ROOT / getattr(ct, "DATA_DIR", "data")), help="評価するコーパス")
+    ap.add_argument("--queries", default=str(DEFAULT_QUERY_FILE), help="正解ラベル付きの質問集（JSON）")
+    ap.add_argument("--chunk-sizes", default=f"300:30,{size}:{overlap},1000:100", help="サイズ:重なり（カンマ区切り）")
+    ap.add_argument("--retrievers", default=",".join(RETRIEVERS), help="dense / bm25 / hybrid（カンマ区切り）")
+    ap.add_argument("--k", default=f"1,3,{top_k}", help="recall@k の k（カンマ区切り。最大値が検索件数）")
+    ap.add_argument("--repeat", type=int, default=3, help="1質問あたりの検索回数（時間の計測用）")
+    ap.add_argument("--embed-latency", type=float, default=0.0, help="埋め込みAPI 1回あたりの待ち（秒）")
+    ap.add_argument("--embed-dim", type=int, default=256)
+    ap.add_argument("--out", default=None, help="結果の JSON（既定は標準出力）")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("chromadb").setLevel(logging.CRITICAL)
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark-offline")
+
+    from benchmarks import fakes
+    import loaders
+
+    data_dir = Path(args.data)
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    queries = load_queries(Path(args.queries), data_dir)
+    if not queries:
+        print("評価できる質問がありません", file=sys.stderr)
+        return 1
+    names = [r for r in (s.strip() for s in args.retrievers.split(",")) if r]
+    unknown = set(names) - set(RETRIEVERS)
+    if unknown:
+        ap.error(f"unknown retriever: {', '.join(sorted(unknown))}")
+
+    embeddings = fakes.HashingEmbeddings(dim=args.embed_dim, latency_sec=args.embed_latency)
+    docs = [d for r in loaders.load_files(loaders.list_files(str(data_dir))) for d in r.docs]
+
+    rows: List[Dict[str, Any]] = []
+    baseline = None
+    for size_i, overlap_i in _parse_chunk_sizes(args.chunk_sizes):
+        retrievers, build = build_retrievers(docs, size_i, overlap_i, max(ks), embeddings)
+        for name in names:
+            result = evaluate(retrievers[name], queries, data_dir, ks, args.repeat)
+            row = {"retriever": name, "chunk_size": size_i, "chunk_overlap": overlap_i, **build, **result}
+            if name == "hybrid" and (size_i, overlap_i) == (size, overlap):
+                row["baseline"] = True
+                baseline = row
+            rows.append(row)
+    mark_candidates(rows, baseline, top_k if top_k in ks else max(ks))
+    _print_table(rows, ks)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "queries": len(queries),
+            "params": {k: v for k, v in vars(args).items() if k != "out"},
+        },
+        "results": rows,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+ベンチマーク用の決定的なフェイク（LLM・埋め込み）です。ネットワークには一切アクセスしません。
+- HashingEmbeddings: 文字 n-gram をハッシュで次元に割り当てた埋め込み（似た文章は近いベクトルになる）
+- FakeChatModel: 入力から決まる応答を、指定した待ち時間つきで返すチャットモデル
+install() でアプリ側（utils._get_llm / initialize._make_embeddings）に差し込みます。
+"""
+
+from __future__ import annotations
+
+import time
+import math
+import asyncio
+import hashlib
+import threading
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import sparse_index
+
+
+############################################################
+# 埋め込み
+############################################################
+class HashingEmbeddings(Embeddings):
+    """
+    sparse_index.tokenize と同じ文字 n-gram を dim 次元にハッシュして L2 正規化する。
+    1回の呼び出しごとに latency_sec、1テキストごとに per_text_sec だけ待つ（API の往復を模擬）。
+    """
+
+    def __init__(
+        self,
+        dim: int = 256,
+        *,
+        latency_sec: float = 0.0,
+        per_text_sec: float = 0.0,
+        model: str = "fake-hashing-embedding",
+    ) -> None:
+        self.dim = dim
+        self.latency_sec = latency_sec
+        self.per_text_sec = per_text_sec
+        self.model = model
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        vec = [0.0] * self.dim
+        for tok in sparse_index.tokenize(text):
+            h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += -1.0 if (h >> 63) & 1 else 1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def _wait(self, n: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.texts += n
+        delay = self.latency_sec + self.per_text_sec * n
+        if delay:
+            time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._wait(len(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._wait(1)
+        return self._vector(text)
+
+
+############################################################
+# チャットモデル
+############################################################
+class FakeChatModel(BaseChatModel):
+    """
+    最後のメッセージから決まる応答を返す。
+    latency_sec は最初のトークンまでの待ち時間、per_token_sec はトークンごとの生成時間。
+    usage_metadata も文字数ベースで付ける（トークン集計の確認用）。
+    """
+
+    latency_sec: float = 0.0
+    per_token_sec: float = 0.0
+    reply_chars: int = 200
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        last = str(messages[-1].content) if messages else ""
+        digest = hashlib.sha1(last.encode("utf-8")).hexdigest()[:8]
+        body = f"（ベンチマーク応答 {digest}）" + last.replace("\n", " ")
+        return body[: self.reply_chars]
+
+    def _message(self, messages: List[BaseMessage], text: str) -> AIMessage:
+        n_in = sum(len(str(m.content)) for m in messages)
+        return AIMessage(
+            content=text,
+            usage_metadata={"input_tokens": n_in, "output_tokens": len(text), "total_tokens": n_in + len(text)},
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = self._reply(messages)
+        time.sleep(self.latency_sec + self.per_token_sec * len(text))
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = self._reply(messages)
+        await asyncio.sleep(self.latency_sec + self.per_token_sec * len(text))
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_sec)
+        text = self._reply(messages)
+        for ch in text:
+            if self.per_token_sec:
+                time.sleep(self.per_token_sec)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=ch))
+        # 最後に使用量だけのチャンクを返す（OpenAI の stream_usage と同じ形）
+        usage = self._message(messages, text).usage_metadata
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+############################################################
+# アプリへの差し込み
+############################################################
+def install(llm: Optional[FakeChatModel] = None, embeddings: Optional[Embeddings] = None):
+    """
+    utils._get_llm と initialize._make_embeddings をフェイクに置き換える。
+    Returns:
+        (llm, embeddings)
+    """
+    import initialize
+    import utils
+
+    llm = llm or FakeChatModel()
+    embeddings = embeddings or HashingEmbeddings()
+    utils._get_llm = lambda: llm
+    initialize._make_embeddings = lambda: embeddings
+    return llm, embeddings
@@ -0,0 +1,157 @@
+"""
+アプリのモジュールの import にかかる時間を `python -X importtime` で計測し、JSON で出力します。
+毎回新しいプロセスで import するため、起動直後（キャッシュの無い状態）の時間になります。
+
+計測する対象:
+    first_frame  タイトルとチャット入力欄を描画するまでに main.py が読むもの（streamlit + constants）
+    app          main.py が初期化の前に読むアプリのモジュール一式
+    <module>     モジュール単体（constants / utils / initialize など）
+
+あわせて、重い依存（chromadb / openai / langchain_community のローダーなど。DEFERRED）が
+import の時点で読み込まれていないか（最初に使うときまで遅らせられているか）を deferred_ok で確認します。
+
+使い方:
+    python -m benchmarks.import_time --repeat 5 --out import_time.json
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from benchmarks.run_benchmarks import _git_commit  # noqa: E402
+
+
+TARGETS = {
+    "first_frame": "import streamlit, constants",
+    "app": "import app_logging, utils, initialize, components, roster, roster_query",
+    "constants": "import constants",
+    "app_logging": "import app_logging",
+    "utils": "import utils",
+    "initialize": "import initialize",
+    "components": "import components",
+    "loaders": "import loaders",
+    "roster": "import roster",
+}
+
+# 最初に使うときまで読み込まない（import しただけでは読み込まれないはずの）依存
+DEFERRED = ("chromadb", "openai", "langchain_openai", "langchain_community.document_loaders", "fitz", "docx2txt")
+
+
+############################################################
+# 計測
+############################################################
+def _parse_importtime(stderr: str) -> List[Tuple[int, float, float, str]]:
+    """「import time: self | cumulative | name」の行を (深さ, self_ms, cumulative_ms, name) にする"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, int(self_us) / 1000, int(cum_us) / 1000, name.strip()))
+    return rows
+
+
+def run_once(statement: str) -> Dict[str, Any]:
+    """新しいプロセスで statement を実行し、import の時間・その内訳・読み込まれた重い依存を返す"""
+    probe = f"{statement}\nimport sys, json\nprint(json.dumps([m for m in {DEFERRED!r} if m in sys.modules]))"
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "benchmark-offline")
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=300,
+    )
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"import failed: {statement}\n{proc.stderr[-2000:]}")
+    rows = _parse_importtime(proc.stderr)
+    return {
+        "import_ms": sum(cum for depth, _, cum, _ in rows if depth == 0),
+        "process_ms": wall * 1000,
+        # 対象のモジュールが直接 import したもの（何が重いかの内訳）
+        "children": {name: cum for depth, _, cum, name in rows if depth == 1},
+        "loaded_deferred": json.loads(proc.stdout.strip().splitlines()[-1]),
+    }
+
+
+def measure(name: str, statement: str, repeat: int, top: int) -> Dict[str, Any]:
+    run_once(statement)  # .pyc の作成など初回だけのコストを除く
+    runs = [run_once(statement) for _ in range(repeat)]
+    # 直接 import したものの内訳（中央値の大きい順）
+    names = {n for r in runs for n in r["children"]}
+    breakdown = sorted(
+        ((n, statistics.median(r["children"].get(n, 0.0) for r in runs)) for n in names),
+        key=lambda x: -x[1],
+    )[:top]
+    loaded = sorted({m for r in runs for m in r["loaded_deferred"]})
+    return {
+        "target": name,
+        "statement": statement,
+        "import_ms_p50": statistics.median(r["import_ms"] for r in runs),
+        "import_ms_min": min(r["import_ms"] for r in runs),
+        "process_ms_p50": statistics.median(r["process_ms"] for r in runs),
+        "slowest": [{"module": n, "cumulative_ms": round(ms, 1)} for n, ms in breakdown],
+        "loaded_deferred": loaded,
+        "deferred_ok": not loaded,
+    }
+
+
+def _print_table(rows: List[Dict[str, Any]]) -> None:
+    print("\t".join(["target", "import_p50_ms", "process_p50_ms", "deferred_ok", "slowest"]), file=sys.stderr)
+    for row in rows:
+        slowest = ", ".join(f"{s['module']}={s['cumulative_ms']:.0f}" for s in row["slowest"][:3])
+        cells = [row["target"], f"{row['import_ms_p50']:.0f}", f"{row['process_ms_p50']:.0f}",
+                 "yes" if row["deferred_ok"] else "NO: " + ",".join(row["loaded_deferred"]), slowest]
+        print("\t".join(cells), file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--targets", default=",".join(TARGETS), help="計測する対象（カンマ区切り）")
+    ap.add_argument("--repeat", type=int, default=5, help="対象ごとの計測回数（中央値を出す）")
+    ap.add_argument("--top", type=int, default=10, help="内訳に出す import の数")
+    ap.add_argument("--out", default=None, help="結果の JSON（既定は標準出力）")
+    args = ap.parse_args(argv)
+
+    names = [t for t in (s.strip() for s in args.targets.split(",")) if t]
+    unknown = set(names) - set(TARGETS)
+    if unknown:
+        ap.error(f"unknown target: {', '.join(sorted(unknown))}")
+
+    rows = [measure(name, TARGETS[name], args.repeat, args.top) for name in names]
+    _print_table(rows)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k != "out"},
+        },
+        "results": rows,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+同梱の data/ コーパス（と、それを複製して大きくしたもの）で各段の処理時間を計測し、JSON で出力します。
+LLM・埋め込みは benchmarks.fakes のフェイクに差し替えるため、OpenAI には接続しません。
+
+計測する段:
+    load      ファイル読み込み（loaders.load_files。解析結果のキャッシュが空の状態 / load_cached はキャッシュから）
+    split     チャンク分割
+    embed     埋め込み + Chroma への書き込み（ingest.sync_vectorstore、初回同期）
+    sparse    キーワード索引の構築・保存 / mmap での読み込み
+    retrieve  ハイブリッド検索（1クエリごとの p50 / p95）
+    context   参考情報の組み立て（context_packer.pack_context）
+    answer    回答取得まで（aget_llm_response。逐次実行と同時実行）
+
+使い方:
+    python -m benchmarks.run_benchmarks --scales 1,4 --llm-latency 0.3 --out bench.json
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import constants as ct  # noqa: E402
+
+
+# 検索・回答の計測に使う質問（data/ の内容に合わせたもの）
+DEFAULT_QUERIES = [
+    "社員の育成方針に関するMTGの議事録",
+    "株主優待の内容を教えて",
+    "環境への取り組みについて",
+    "EcoTee Creator の使い方",
+    "代行出荷サービスの料金",
+    "会社の所在地と設立年",
+    "コンプライアンスで禁止されていること",
+    "採用に関する会議で決まったこと",
+    "デザインの入稿ルール",
+    "お客様情報の取り扱い",
+]
+
+
+############################################################
+# 計測ユーティリティ
+############################################################
+def _timed(fn: Callable[[], Any]) -> Tuple[Any, float]:
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+
+def _latency_stats(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))] * 1000
+
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+############################################################
+# コーパスの複製
+############################################################
+def make_corpus(src: Path, dest: Path, scale: int) -> Path:
+    """src を scale 個複製した dest/copy_<i>/ を作る（scale=1 なら1組だけ）"""
+    shutil.rmtree(dest, ignore_errors=True)
+    for i in range(scale):
+        shutil.copytree(src, dest / f"copy_{i}")
+    return dest
+
+
+def _tag_replicas(chunks, corpus: Path) -> None:
+    """
+    複製ごとにチャンク本文へ印を付ける。
+    同じ本文は埋め込みキャッシュ・重複除去でまとめられ、規模を大きくした意味がなくなるため。
+    """
+    for c in chunks:
+        rel = Path(os.path.relpath(c.metadata.get("source", ""), corpus))
+        replica = rel.parts[0] if rel.parts else ""
+        if replica and replica != "copy_0":
+            c.page_content = f"[{replica}] {c.page_content}"
+
+
+############################################################
+# 計測本体
+############################################################
+def bench_scale(args, scale: int, workdir: Path, queries: List[str]) -> List[Dict[str, Any]]:
+    from benchmarks import fakes
+    import context_packer
+    import embedding_cache
+    import ingest
+    import initialize
+    import loaders
+    import retrieval
+    import sparse_index
+    import utils
+    from langchain_community.vectorstores import Chroma
+
+    results: List[Dict[str, Any]] = []
+
+    def record(stage: str, **fields) -> None:
+        row = {"stage": stage, "scale": scale, **fields}
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+
+    llm = fakes.FakeChatModel(latency_sec=args.llm_latency, per_token_sec=args.llm_token_latency)
+    embeddings = fakes.HashingEmbeddings(
+        dim=args.embed_dim, latency_sec=args.embed_latency, per_text_sec=args.embed_text_latency
+    )
+    fakes.install(llm, embeddings)
+
+    corpus = make_corpus(Path(args.data), workdir / f"corpus_x{scale}", scale)
+    store = workdir / f"store_x{scale}"
+    shutil.rmtree(store, ignore_errors=True)
+    store.mkdir(parents=True)
+
+    # load / split
+    files = loaders.list_files(str(corpus))
+    parsed_dir = str(store / "parsed_docs")
+    loaded, sec = _timed(lambda: loaders.load_files(files, cache_dir=parsed_dir))
+    docs = [d for r in loaded for d in r.docs]
+    record("load", seconds=sec, files=len(files), docs=len(docs))
+    # 2回目は解析結果のキャッシュ（doc_cache）から読む
+    _, sec = _timed(lambda: loaders.load_files(files, cache_dir=parsed_dir))
+    record("load_cached", seconds=sec, files=len(files))
+
+    chunks, sec = _timed(lambda: initialize._split_docs(docs))
+    _tag_replicas(chunks, corpus)
+    record("split", seconds=sec, chunks=len(chunks))
+
+    # embed（キャッシュは空の状態から）
+    by_source: Dict[str, list] = {}
+    for c in chunks:
+        by_source.setdefault(c.metadata.get("source"), []).append(c)
+    cached = embedding_cache.CachedEmbeddings(embeddings, path=str(store / "embeddings.sqlite"))
+    vectordb = Chroma(
+        collection_name=f"bench_x{scale}",
+        embedding_function=cached,
+        persist_directory=str(store / "chroma"),
+    )
+    calls_before = embeddings.calls
+    stats, sec = _timed(lambda: ingest.sync_vectorstore(
+        vectordb,
+        topdir=str(corpus),
+        manifest_dir=str(store / "chroma"),
+        chunks_for=lambda paths: {p: by_source.get(p, []) for p in paths},
+        extensions=loaders.SUPPORTED,
+    ))
+    record("embed", seconds=sec, chunks=len(chunks), api_calls=embeddings.calls - calls_before,
+           chunks_per_sec=len(chunks) / sec if sec else None, **stats)
+
+    # sparse
+    index, sec = _timed(lambda: sparse_index.SparseIndex.build(chunks))
+    record("sparse_build", seconds=sec, vocab=len(index.vocab), chunks=len(index))
+    _, sec = _timed(lambda: index.save(str(store / "sparse"), "bench"))
+    record("sparse_save", seconds=sec)
+    opened, sec = _timed(lambda: sparse_index.SparseIndex.load(str(store / "sparse"), "bench"))
+    record("sparse_open", seconds=sec, ok=opened is not None)
+
+    # retrieve
+    candidates = max(getattr(ct, "TOP_K", 5), getattr(ct, "HYBRID_CANDIDATES", 10))
+    retriever = retrieval.HybridRetriever(
+        dense=retrieval.DenseRetriever(vectorstore=vectordb, k=candidates),
+        sparse=sparse_index.SparseRetriever(index=opened or index, k=candidates),
+        k=getattr(ct, "TOP_K", 5),
+    )
+    retriever.invoke(queries[0])  # 初回のみの準備コストを除く
+    samples: List[float] = []
+    retrieved: List[list] = []
+    for _ in range(args.repeat):
+        for q in queries:
+            docs_q, sec = _timed(lambda: retriever.invoke(q))
+            samples.append(sec)
+            retrieved.append(docs_q)
+    record("retrieve", **_latency_stats(samples))
+
+    # context（トークン数の数え方の準備は初回だけなので除く）
+    context_packer.count_tokens("")
+    samples = [_timed(lambda: context_packer.pack_context(d))[1] for d in retrieved]
+    record("context", **_latency_stats(samples))
+
+    # answer（逐次）
+    async def one(q: str) -> float:
+        t0 = time.perf_counter()
+        await utils.aget_llm_response(q, mode=ct.ANSWER_MODE_2, llm=llm, retriever=retriever, history=[])
+        return time.perf_counter() - t0
+
+    samples = [utils.run_sync(one(q)) for q in queries]
+    record("answer", llm_latency_sec=args.llm_latency, **_latency_stats(samples))
+
+    # answer（同時実行: 1プロセスで何件さばけるか）
+    async def burst() -> List[float]:
+        qs = [queries[i % len(queries)] for i in range(args.concurrency)]
+        return await asyncio.gather(*(one(q) for q in qs))
+
+    (lat, sec) = _timed(lambda: utils.run_sync(burst()))
+    record("answer_concurrent", concurrency=args.concurrency, seconds=sec,
+           questions_per_sec=args.concurrency / sec if sec else None, **_latency_stats(lat))
+    return results
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data", default=str(ROOT / getattr(ct, "DATA_DIR", "data")), help="元にするコーパス")
+    ap.add_argument("--scales", default="1,4", help="コーパスの複製数（カンマ区切り）")
+    ap.add_argument("--repeat", type=int, default=3, help="検索の計測で質問集を繰り返す回数")
+    ap.add_argument("--concurrency", type=int, default=16, help="同時実行の計測で投げる質問数")
+    ap.add_argument("--llm-latency", type=float, default=0.3, help="LLM の応答待ち（秒）")
+    ap.add_argument("--llm-token-latency", type=float, default=0.0, help="LLM の1トークンごとの生成時間（秒）")
+    ap.add_argument("--embed-latency", type=float, default=0.05, help="埋め込みAPI 1回あたりの待ち（秒）")
+    ap.add_argument("--embed-text-latency", type=float, default=0.0, help="埋め込み 1テキストあたりの待ち（秒）")
+    ap.add_argument("--embed-dim", type=int, default=256)
+    ap.add_argument("--workdir", default=None, help="作業ディレクトリ（既定は一時ディレクトリ）")
+    ap.add_argument("--out", default=None, help="結果の JSON（既定は標準出力）")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("chromadb").setLevel(logging.CRITICAL)
+    # OpenAI のキーが無くてもアプリのモジュールを読み込めるようにする（実際には呼ばない）
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark-offline")
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="rag-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for scale in scales:
+            results += bench_scale(args, scale, workdir, DEFAULT_QUERIES)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "workdir")},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+このファイルは、プロンプトに載せる会話履歴を一定量に抑える処理を定義するファイルです。
+- 直近 N 往復はそのまま、かつトークン上限以内で載せる
+- それより古いやりとりは要約に畳み込み、1通のシステムメッセージとして先頭に置く
+- 要約の更新は回答の後にバックグラウンドで行い、次の質問の待ち時間には含めない
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import logging
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+import constants as ct
+import context_packer
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+def _message_tokens(m: BaseMessage) -> int:
+    return context_packer.count_tokens(str(getattr(m, "content", m)))
+
+
+class ChatMemory:
+    """
+    1セッション分の要約状態。会話そのものは st.session_state.chat_history（Human/AI の交互）に置き、
+    ここでは「先頭から何件を要約に畳み込んだか」と要約文だけを持つ。
+    """
+
+    def __init__(self, max_turns: Optional[int] = None, max_tokens: Optional[int] = None) -> None:
+        self.max_turns = max_turns or getattr(ct, "HISTORY_MAX_TURNS", 6)
+        self.max_tokens = max_tokens or getattr(ct, "HISTORY_MAX_TOKENS", 1500)
+        self.summary = ""
+        self.folded = 0
+        self._pending: Optional[Future] = None
+        self._pending_upto = 0
+
+    # ------------------------------------------------------------
+    # 内部処理
+    # ------------------------------------------------------------
+    def _adopt(self) -> None:
+        """バックグラウンドの要約が終わっていれば取り込む（終わっていなければ待たない）"""
+        if self._pending is None or not self._pending.done():
+            return
+        try:
+            summary = self._pending.result()
+            if summary:
+                self.summary = summary
+                self.folded = self._pending_upto
+        except Exception as e:
+            logger.warning(f"history summary failed: {type(e).__name__}: {e}")
+        self._pending = None
+
+    def _window_start(self, messages: Sequence[BaseMessage]) -> int:
+        """そのまま載せる範囲の先頭位置（直近 max_turns 往復、かつ max_tokens 以内。最低1往復）"""
+        start = max(0, len(messages) - 2 * self.max_turns)
+        tokens = sum(_message_tokens(m) for m in messages[start:])
+        while start < len(messages) - 2 and tokens > self.max_tokens:
+            tokens -= sum(_message_tokens(m) for m in messages[start:start + 2])
+            start += 2
+        return start
+
+    # ------------------------------------------------------------
+    # 公開インターフェース
+    # ------------------------------------------------------------
+    def build(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        """プロンプトの MessagesPlaceholder("chat_history") に渡す履歴を返す"""
+        self._adopt()
+        if not messages or len(messages) < self.folded:
+            # 履歴が外からリセットされた
+            self.summary, self.folded = "", 0
+        window = list(messages[self._window_start(messages):])
+        if not self.summary:
+            return window
+        return [SystemMessage(content=f"これまでの会話の要約:\n{self.summary}")] + window
+
+    def schedule_summary(
+        self,
+        messages: Sequence[BaseMessage],
+        summarize: Callable[[str, List[BaseMessage]], Awaitable[str]],
+        submit: Callable[[Awaitable[str]], Future],
+    ) -> None:
+        """
+        窓から外れたのにまだ要約に入っていないやりとりがあれば、要約の更新を投げておく。
+        summarize(これまでの要約, 追加するメッセージ) は新しい要約を返すコルーチン、
+        submit はそれをバックグラウンドで実行して Future を返す関数。
+        """
+        self._adopt()
+        start = self._window_start(messages)
+        if self._pending is not None or start <= self.folded:
+            return
+        self._pending = submit(summarize(self.summary, list(messages[self.folded:start])))
+        self._pending_upto = start
+
+    def compact(self, messages: List[Any]) -> None:
+        """要約に畳み込み済みのメッセージを履歴から捨てる（セッションのメモリも一定に保つ）"""
+        self._adopt()
+        if self._pending is None and self.folded:
+            del messages[:self.folded]
+            self.folded = 0
@@ -204,10 +204,11 @@ def display_conversation_log():
                             st.info(file_info, icon=icon)
 
 
-def display_search_llm_response(llm_response):
+def display_search_llm_response(llm_response, render_answer: bool = True):
     """
     「社内文書検索」モードにおけるLLMレスポンスを表示
     ※ 'context' が無いケースでも 'source_documents' / 'sources' をフォールバック
+    ※ 回答本文をストリーミングで表示済みなら render_answer=False
     """
     # --- 本文抽出（answer/result/output_text/text/content の順で拾う）---
     text = None
@@ -243,7 +244,7 @@ def display_search_llm_response(llm_response):
     # ソースがなければ、従来の「該当なし」扱いに準ずる
     sources = _coerce_sources(raw_ctx)
     if not sources:
-        if text:
+        if text and render_answer:
             st.markdown(text)
         st.markdown(ct.NO_DOC_MATCH_MESSAGE)
         return {
@@ -257,7 +258,7 @@ def display_search_llm_response(llm_response):
     main_page_number = sources[0]["page"]
     main_message = "入力内容に関する情報は、以下のファイルに含まれている可能性があります。"
 
-    if text:
+    if text and render_answer:
         st.markdown(text)
     st.markdown(main_message)
 
@@ -300,10 +301,11 @@ def display_search_llm_response(llm_response):
     return content
 
 
-def display_contact_llm_response(llm_response):
+def display_contact_llm_response(llm_response, render_answer: bool = True):
     """
     「社内問い合わせ」モードにおけるLLMレスポンスを表示
     ※ 'context' が無いケースでも 'source_documents' / 'sources' をフォールバック
+    ※ 回答本文をストリーミングで表示済みなら render_answer=False
     """
     # 本文
     if isinstance(llm_response, dict):
@@ -319,7 +321,8 @@ def display_contact_llm_response(llm_response):
     if not answer:
         answer = "（回答テキストを抽出できませんでした）"
 
-    st.markdown(answer)
+    if render_answer:
+        st.markdown(answer)
 
     # 参照情報の抽出
     if isinstance(llm_response, dict):
@@ -363,6 +366,57 @@ def display_contact_llm_response(llm_response):
     return content
 
 
+def _span_rows(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """トレースの区間を表の行にする（開始順）"""
+    rows = []
+    for sp in sorted(record.get("spans", []), key=lambda x: x.get("start_ms", 0)):
+        row = {"段": sp["name"], "開始(ms)": sp.get("start_ms"), "時間(ms)": sp.get("ms")}
+        if sp.get("parent"):
+            row["親"] = sp["parent"]
+        for key in ("chunks", "chunks_out", "prompt_tokens", "completion_tokens", "cache_hit", "cancelled", "error"):
+            if key in sp:
+                row[key] = sp[key]
+        rows.append(row)
+    return rows
+
+
+def display_trace_panel(traces: List[Dict[str, Any]], build_trace: Dict[str, Any] | None = None):
+    """
+    サイドバー用: 直近リクエストの処理時間の内訳（tracing の記録）を表示
+    """
+    if not traces and not build_trace:
+        st.caption("まだ記録がありません。質問を送信すると、段ごとの処理時間がここに表示されます。")
+        return
+
+    if traces:
+        last = traces[-1]
+        tokens = last.get("tokens", {})
+        st.markdown(f"**直近のリクエスト: {last.get('total_ms', 0):,.0f} ms**")
+        st.caption(
+            f"参考情報 {last.get('chunks', 0)} 件 / "
+            f"トークン 入力 {tokens.get('prompt_tokens', 0):,}・出力 {tokens.get('completion_tokens', 0):,}"
+            + (f" / 代替経路: {', '.join(last['fallbacks'])}" if last.get("fallbacks") else "")
+        )
+        st.dataframe(_span_rows(last), use_container_width=True, hide_index=True)
+
+        history = []
+        for rec in reversed(traces):
+            row = {"時刻": rec.get("started_at", "")[-8:], "合計(ms)": rec.get("total_ms")}
+            stages: Dict[str, float] = {}
+            for sp in rec.get("spans", []):
+                if not sp.get("parent"):
+                    stages[sp["name"]] = stages.get(sp["name"], 0.0) + sp.get("ms", 0.0)
+            row.update({k: round(v, 1) for k, v in stages.items()})
+            row["tokens"] = sum(rec.get("tokens", {}).values())
+            history.append(row)
+        with st.expander(f"このセッションの履歴（{len(traces)} 件）"):
+            st.dataframe(history, use_container_width=True, hide_index=True)
+
+    if build_trace:
+        with st.expander(f"インデックス構築: {build_trace.get('total_ms', 0):,.0f} ms"):
+            st.dataframe(_span_rows(build_trace), use_container_width=True, hide_index=True)
+
+
 # ==========================================
 # タイトル直下の案内表示（初期画面ヒント）
 # ==========================================
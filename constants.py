@@ -5,12 +5,17 @@
 ############################################################
 # ライブラリの読み込み
 ############################################################
-from langchain_community.document_loaders import (
-    PyMuPDFLoader,        # PDF 用（pymupdf が必要）
-    Docx2txtLoader,       # DOCX 用（docx2txt が必要）
-    TextLoader,           # TXT 用
-)
-from langchain_community.document_loaders.csv_loader import CSVLoader
+import importlib
+
+
+def _lazy_loader(module: str, name: str, **kwargs):
+    """
+    ローダーのクラスを最初に使うときに import する（constants は全モジュールから読まれるため、
+    langchain_community などの重い依存を起動時に読み込まない）。
+    """
+    def make(path):
+        return getattr(importlib.import_module(module), name)(path, **kwargs)
+    return make
 
 ############################################################
 # 共通変数の定義
@@ -21,6 +26,8 @@ APP_NAME = "社内情報特化型生成AI検索アプリ"
 ANSWER_MODE_1 = "社内文書検索"
 ANSWER_MODE_2 = "社内問い合わせ"
 CHAT_INPUT_HELPER_TEXT = "こちらからメッセージを送信してください。"
+# チャット入力欄を重い import・初期化より先に描画する（False なら初期化・会話ログの表示の後に描画）
+LAZY_STARTUP = True
 DOC_SOURCE_ICON = ":material/description: "
 LINK_SOURCE_ICON = ":material/link: "
 WARNING_ICON = ":material/warning:"
@@ -31,6 +38,12 @@ SPINNER_TEXT = "回答生成中..."
 LOG_DIR_PATH = "./logs"
 LOGGER_NAME = "ApplicationLog"
 LOG_FILE = "application.log"
+# JSON Lines のログ（app_logging）。サイズ・日付のどちらかで切り替え、BACKUP_COUNT 世代まで残す
+LOG_JSON_FILE = "app.jsonl"
+LOG_LEVEL = "INFO"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = "midnight"
+LOG_BACKUP_COUNT = 14
 APP_BOOT_MESSAGE = "アプリが起動されました。"
 
 # LLM設定系
@@ -46,10 +59,10 @@ STAFF_CSV = r"data/社員について/社員名簿.csv"
 
 # 拡張子マップ（課題5のTXT取り込みに対応 / 文字コードは自動判定）
 SUPPORTED_EXTENSIONS = {
-    ".pdf":  PyMuPDFLoader,
-    ".docx": Docx2txtLoader,
-    ".csv":  lambda path: CSVLoader(path, encoding="utf-8"),  # 必要なら 'utf-8-sig' に変更可
-    ".txt":  lambda path: TextLoader(path, encoding="utf-8", autodetect_encoding=True),
+    ".pdf":  _lazy_loader("langchain_community.document_loaders", "PyMuPDFLoader"),    # pymupdf が必要
+    ".docx": _lazy_loader("langchain_community.document_loaders", "Docx2txtLoader"),   # docx2txt が必要
+    ".csv":  _lazy_loader("langchain_community.document_loaders.csv_loader", "CSVLoader", encoding="utf-8"),  # 必要なら 'utf-8-sig' に変更可
+    ".txt":  _lazy_loader("langchain_community.document_loaders", "TextLoader", encoding="utf-8", autodetect_encoding=True),
 }
 
 WEB_URL_LOAD_TARGETS = [
@@ -65,6 +78,7 @@ FOLDER_KEYWORDS = ("顧客","営業","マーケ","マーケティング","教育
 
 # プロンプトテンプレート
 SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT = "会話履歴と最新の入力をもとに、会話履歴なしでも理解できる独立した入力テキストを生成してください。"
+SYSTEM_PROMPT_SUMMARIZE_HISTORY = "これまでの要約と、その後の会話を統合し、後続の質問を理解するのに必要な事実・条件・話題を400字以内の日本語で要約してください。要約文のみを出力してください。"
 
 # 修正: 関連がある場合は文脈に基づいて回答する（空文字を返さない）
 SYSTEM_PROMPT_DOC_SEARCH = """
@@ -110,3 +124,102 @@ DISP_ANSWER_ERROR_MESSAGE = "回答表示に失敗しました。"
 # ベクターストア・Web取り込みフラグ
 CHROMA_DIR = "./chroma_store"
 ENABLE_WEB_SCRAPE = False
+
+# 共有インデックス：data/ の変更チェック間隔（秒）。この間の rerun では走査しない
+CORPUS_RECHECK_SEC = 30
+
+# 文書読み込みの並列化：対象ファイルがこの数以上ならプロセスプールを使う
+LOADER_PARALLEL_MIN_FILES = 64
+# 並列読み込みのワーカー数（None ならCPU数）
+LOADER_MAX_WORKERS = None
+
+# 解析結果のキャッシュ（doc_cache）：ファイル内容のハッシュ + ローダーの版ごとに、ページの本文とメタデータを保存
+DOC_CACHE_ENABLED = True
+DOC_CACHE_DIR = "./.cache/parsed_docs"
+
+# 埋め込みキャッシュ（SQLite）：モデル名+テキストのハッシュをキーに保存
+EMBEDDING_CACHE_PATH = "./.cache/embeddings.sqlite"
+EMBEDDING_CACHE_MAX_ENTRIES = 50_000
+
+# 埋め込みジョブ：バッチサイズ・同時実行数・レート制限時の再試行
+EMBED_BATCH_SIZE = 64
+EMBED_MAX_CONCURRENCY = 2
+EMBED_MAX_ATTEMPTS = 8
+EMBED_BACKOFF_BASE_SEC = 1.0
+EMBED_BACKOFF_MAX_SEC = 60.0
+# 埋め込みが途中で止まったインデックスを再構築（再開）するまでの間隔（秒）
+INDEX_RESUME_INTERVAL_SEC = 60
+
+# 質問の言い換え（独立質問の生成）を省略する判定
+# 履歴を参照していそうな語（指示語・省略表現）。含まず十分な長さがあれば言い換えない
+CONDENSE_CONTEXT_MARKERS = (
+    "この", "その", "あの", "これ", "それ", "あれ", "こちら", "そちら",
+    "上記", "前述", "先ほど", "さっき", "さきほど", "前の", "同じ", "続き",
+    "他に", "ほかに", "もっと", "さらに", "詳しく", "例えば",
+)
+CONDENSE_MIN_SELF_CONTAINED_CHARS = 12
+
+# ハイブリッド検索（Chroma + BM25 を RRF で統合）
+# 各リトリーバから取る候補数（統合後に TOP_K 件へ絞る）
+HYBRID_CANDIDATES = 10
+HYBRID_DENSE_WEIGHT = 1.0
+HYBRID_SPARSE_WEIGHT = 1.0
+RRF_K = 60
+
+# キーワード検索（文字 n-gram + BM25 の疎行列索引）
+SPARSE_NGRAM_RANGE = (2, 3)
+SPARSE_BM25_K1 = 1.5
+SPARSE_BM25_B = 0.75
+
+# キーワード索引の保存先（他のキャッシュと同じく .cache 配下。起動時は mmap で開く）
+SPARSE_INDEX_DIR = "./.cache/sparse_index"
+
+# HYDE を検索と同時に投機実行するか。
+#   False（既定）: 検索（dense + BM25）が0件・時間切れのときだけ HYDE を生成する
+#   True: 0件のときの待ち時間が LLM 1回分短くなる代わりに、毎回 LLM を1回余分に呼ぶ
+#         （検索が返れば取り消すが、生成の料金・レート制限の枠はほぼ毎回消費する）
+HYDE_SPECULATIVE = False
+
+# 検索（回答生成の前まで）の締め切りと段ごとの持ち時間（秒）
+# 時間切れの段は取り消し、それまでに集まった参考情報で回答へ進む。None なら無制限
+RETRIEVAL_DEADLINE_SEC = 6.0
+RETRIEVAL_STAGE_BUDGETS = {
+    "condense": 3.0,  # 履歴を踏まえた言い換え（LLM）
+    "dense": 2.0,     # Chroma のベクトル検索（クエリの埋め込みを含む）
+    "sparse": 0.5,    # キーワード索引
+    "hyde": 3.0,      # HYDE の仮想文書生成（LLM）
+}
+
+# ベクトル検索の関連度スコア（0〜1）の下限。None なら足切りしない
+# （呼び出しごとに retriever.invoke(query, score_threshold=...) で上書き可能）
+RETRIEVAL_SCORE_THRESHOLD = None
+
+# 回答用プロンプトに載せる参考情報
+CONTEXT_MAX_TOKENS = 3000          # 参考情報全体のトークン上限
+CONTEXT_NEAR_DUP_THRESHOLD = 0.8   # 文字 3-gram のこの割合以上が既出なら重複として除く
+CONTEXT_MIN_OVERLAP_CHARS = 10     # 隣接チャンクとみなす重なりの最小文字数
+CONTEXT_MIN_PARTIAL_TOKENS = 100   # 上限に入りきらないチャンクを切り詰めて載せる最小の余り
+
+# プロンプトに載せる会話履歴（超えた分は要約に畳み込む）
+HISTORY_MAX_TURNS = 6       # そのまま載せる直近の往復数
+HISTORY_MAX_TOKENS = 1500   # そのまま載せる履歴のトークン上限（最低1往復は載せる）
+
+# 社員名簿への質問（人数・絞り込み・集計）を LLM を使わずに表から答える
+ROSTER_QUERY_ENABLED = True
+# これらの語を含む質問は文書の内容を尋ねているとみなし、名簿では答えない（RAG に回す）
+ROSTER_QUERY_STOPWORDS = (
+    "方針", "制度", "規定", "規則", "ルール", "手続き", "申請", "方法", "議事録", "資料",
+    "育成", "研修", "評価", "福利厚生", "とは", "なぜ", "どうして", "目標", "施策", "戦略",
+)
+
+# 頻出質問のウォームキャッシュ（tools/warm_up.py がログから作り、アプリは読むだけ）
+WARM_CACHE_ENABLED = True
+WARM_CACHE_PATH = "./.cache/warm_cache.json"
+WARM_CACHE_SERVE_ANSWERS = True   # False なら事前計算の回答は使わず、検索結果だけ使う
+WARM_CACHE_TOP_N = 50             # 事前計算する質問数（多い順）
+WARM_CACHE_MIN_COUNT = 2          # これ未満しか聞かれていない質問は対象外
+
+# リクエストごとの処理時間・トークン数の記録（tracing）
+TRACE_ENABLED = True
+TRACE_HISTORY_SIZE = 20        # セッションに残す直近のリクエスト数（サイドバー表示用）
+TRACE_PANEL_ENABLED = True     # サイドバーに「処理時間の内訳」の表示切替を出す
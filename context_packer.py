@@ -0,0 +1,229 @@
+"""
+このファイルは、検索結果を回答用プロンプトの「参考情報」にまとめる処理を定義するファイルです。
+- 完全一致・ほぼ同一の文章（PDF と Word の同じ議事録など）を除く
+- 同じファイル・ページで隣り合うチャンク（CHUNK_OVERLAP 分の重なりあり）を1つにつなぐ
+- 関連度の高い順に、トークン数の上限まで詰める（tiktoken で数える）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import re
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Any, Callable, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.documents import Document
+
+import constants as ct
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+_SPACES = re.compile(r"\s+")
+
+
+############################################################
+# トークン数
+############################################################
+_ENCODING = None
+_ENCODING_LOCK = threading.Lock()
+
+
+def _approx_tokens(text: str) -> int:
+    # 日本語はおおむね1文字1トークン以下のため、文字数で多めに見積もる
+    return len(text)
+
+
+def _get_counter() -> Callable[[str], int]:
+    """
+    モデルに合った tiktoken のエンコーディングで数える関数を返す。
+    エンコーディング表を取得できない環境（オフラインなど）では文字数で代用する。
+    """
+    global _ENCODING
+    with _ENCODING_LOCK:
+        if _ENCODING is None:
+            try:
+                import tiktoken
+
+                try:
+                    enc = tiktoken.encoding_for_model(getattr(ct, "MODEL", "gpt-4o-mini"))
+                except KeyError:
+                    enc = tiktoken.get_encoding("cl100k_base")
+                _ENCODING = lambda text: len(enc.encode(text, disallowed_special=()))
+            except Exception as e:
+                logger.warning(f"tiktoken unavailable; counting characters instead: {type(e).__name__}: {e}")
+                _ENCODING = _approx_tokens
+        return _ENCODING
+
+
+def count_tokens(text: str) -> int:
+    return _get_counter()(text or "")
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """末尾を削って max_tokens 以下にする（二分探索なので tiktoken の decode に依存しない）"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+############################################################
+# 重複除去
+############################################################
+def _normalize(text: str) -> str:
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text or "")).strip().lower()
+
+
+def _shingles(text: str, n: int = 3) -> Set[str]:
+    t = text.replace(" ", "")
+    if len(t) <= n:
+        return {t} if t else set()
+    return {t[i:i + n] for i in range(len(t) - n + 1)}
+
+
+def _dedupe(docs: Sequence[Document], threshold: float) -> List[Document]:
+    """
+    関連度順に見て、既に採用した文章と
+    - 正規化後の本文が完全一致
+    - 文字 3-gram の大半（threshold 以上）が既出の1件に含まれる
+    ものを落とす。
+    """
+    kept: List[Document] = []
+    seen_hashes: Set[str] = set()
+    kept_shingles: List[Set[str]] = []
+    for d in docs:
+        norm = _normalize(d.page_content)
+        if not norm:
+            continue
+        h = hashlib.sha1(norm.encode("utf-8")).hexdigest()
+        if h in seen_hashes:
+            continue
+        sh = _shingles(norm)
+        if sh and any(len(sh & other) / len(sh) >= threshold for other in kept_shingles):
+            continue
+        seen_hashes.add(h)
+        kept_shingles.append(sh)
+        kept.append(d)
+    return kept
+
+
+############################################################
+# 隣接チャンクの結合
+############################################################
+def _group_key(d: Document) -> Tuple[Any, Any]:
+    meta = d.metadata or {}
+    return meta.get("source"), meta.get("page")
+
+
+def _overlap(a: str, b: str, min_chars: int) -> int:
+    """a の末尾と b の先頭が重なる文字数（min_chars 未満なら 0）"""
+    for n in range(min(len(a), len(b)), min_chars - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _merge_neighbors(docs: Sequence[Document], min_chars: int, max_overlap: int) -> List[Document]:
+    """
+    同じ source / page のチャンクで、一方の末尾と他方の先頭が重なるものをつなぐ。
+    つないだ結果は、元のうち関連度が高い方の位置に置く。
+    """
+    merged: List[Optional[Document]] = list(docs)
+    changed = True
+    while changed:
+        changed = False
+        for i, a in enumerate(merged):
+            if a is None:
+                continue
+            for j, b in enumerate(merged):
+                if i == j or b is None or _group_key(a) != _group_key(b):
+                    continue
+                n = _overlap(a.page_content[-max_overlap:], b.page_content[:max_overlap], min_chars)
+                if not n:
+                    continue
+                doc = Document(page_content=a.page_content + b.page_content[n:], metadata=dict(a.metadata or {}))
+                keep, drop = (i, j) if i < j else (j, i)
+                merged[keep], merged[drop] = doc, None
+                changed = True
+                break
+            if changed:
+                break
+    return [d for d in merged if d is not None]
+
+
+############################################################
+# 参考情報の組み立て
+############################################################
+def _label(d: Document) -> str:
+    meta = d.metadata or {}
+    source = meta.get("source") or "（不明）"
+    page = meta.get("page")
+    if page is not None and str(source).lower().endswith(".pdf"):
+        try:
+            return f"{source}（ページNo.{int(page) + 1}）"
+        except (TypeError, ValueError):
+            pass
+    return str(source)
+
+
+def _block(d: Document) -> str:
+    return f"[出典: {_label(d)}]\n{d.page_content}"
+
+
+def pack_context(
+    docs: Sequence[Any],
+    *,
+    max_tokens: Optional[int] = None,
+    near_dup_threshold: Optional[float] = None,
+) -> List[Document]:
+    """
+    検索結果（関連度順）を、重複除去・隣接結合したうえでトークン上限まで詰める。
+    返す Document は source / page などのメタデータを保ったまま（画面の参照元表示にそのまま使える）。
+    """
+    max_tokens = max_tokens or getattr(ct, "CONTEXT_MAX_TOKENS", 3000)
+    threshold = near_dup_threshold or getattr(ct, "CONTEXT_NEAR_DUP_THRESHOLD", 0.8)
+    min_overlap = getattr(ct, "CONTEXT_MIN_OVERLAP_CHARS", 10)
+    max_overlap = max(getattr(ct, "CHUNK_OVERLAP", 50) * 2, min_overlap)
+    min_partial = getattr(ct, "CONTEXT_MIN_PARTIAL_TOKENS", 100)
+
+    items = [
+        d if isinstance(d, Document) else Document(page_content=getattr(d, "page_content", str(d)), metadata=getattr(d, "metadata", None) or {})
+        for d in docs or []
+    ]
+    items = _merge_neighbors(_dedupe(items, threshold), min_overlap, max_overlap)
+
+    packed: List[Document] = []
+    used = 0
+    sep = count_tokens("\n\n")
+    for d in items:
+        cost = count_tokens(_block(d)) + (sep if packed else 0)
+        if used + cost <= max_tokens:
+            packed.append(d)
+            used += cost
+            continue
+        # 入りきらない場合、十分な余りがあれば末尾を削って入れ、そこで打ち切る
+        room = max_tokens - used - (sep if packed else 0) - count_tokens(_block(Document(page_content="", metadata=d.metadata)))
+        if room >= min_partial:
+            packed.append(Document(page_content=_truncate_to_tokens(d.page_content, room), metadata=dict(d.metadata or {})))
+            used = max_tokens
+        break
+
+    logger.debug(f"context packed: {len(docs or [])} docs -> {len(packed)} blocks, {used} tokens")
+    return packed
+
+
+def format_context(docs: Sequence[Document]) -> str:
+    """pack_context の結果をプロンプト用の文字列にする（各ブロックの先頭に出典を付ける）"""
+    return "\n\n".join(_block(d) for d in docs)
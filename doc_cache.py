@@ -0,0 +1,186 @@
+"""
+このファイルは、ファイルを解析した結果（ページごとの本文とメタデータ）を保存して使い回すキャッシュのファイルです。
+- 解析結果は「ファイル内容の SHA-256 + ローダーの版」ごとに1つの JSON Lines（1行 = 1 Document）
+- 中身が変わっていないファイルは PyMuPDF / docx2txt で解析し直さず、保存した結果を読むだけにする
+- パス → (サイズ, 更新時刻, SHA-256) の索引を持ち、サイズ・更新時刻が同じならハッシュ計算も省く
+- ローダー（langchain-community / pymupdf / docx2txt）の版が変わると別のキーになり、解析し直す
+（loaders から使う。子プロセスでも import されるため、streamlit などの重い依存はここでは読み込まない）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import functools
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+
+import constants as ct
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# 保存形式を変えたら上げる（古いキャッシュは自動で使われなくなる）
+CACHE_VERSION = 1
+INDEX_FILE = "index.json"
+
+# 拡張子ごとに、解析結果を左右するパッケージ
+_LOADER_PACKAGES = {
+    ".pdf": ("langchain-community", "pymupdf"),
+    ".docx": ("langchain-community", "docx2txt"),
+}
+# メタデータのうち、読み込んだときのパスが入る項目（同じ内容のファイルが別の場所にあっても使い回せるよう、読み出し時に置き換える）
+_PATH_KEYS = ("source", "file_path")
+
+
+@functools.lru_cache(maxsize=None)
+def loader_version(ext: str) -> str:
+    """拡張子ごとのローダーの版（保存形式 + 関係するパッケージの版から作る短いハッシュ）"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    versions = []
+    for name in _LOADER_PACKAGES.get(ext, ("langchain-community",)):
+        try:
+            versions.append(f"{name}={version(name)}")
+        except PackageNotFoundError:
+            versions.append(f"{name}=?")
+    return hashlib.sha1(repr((CACHE_VERSION, ext, versions)).encode("utf-8")).hexdigest()[:12]
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    """一時ファイルに書いてから置き換える（並列に書かれても、読み手が書きかけを読まない）"""
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+############################################################
+# キャッシュ本体
+############################################################
+class DocCache:
+    """
+    解析結果のキャッシュ。get で引き、外れたら解析して put し、最後に save で索引を書き出す。
+    1回の読み込み（loaders.load_files）ごとに開いて使う（スレッド間で共有しない）。
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._opened_at = time.time()
+        self._index: Dict[str, dict] = {}
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        try:
+            data = json.loads((self.root / INDEX_FILE).read_text(encoding="utf-8"))
+            if data.get("version") == CACHE_VERSION:
+                self._index = data.get("files", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"parsed-doc cache index unreadable; ignored: {type(e).__name__}: {e}")
+
+    @classmethod
+    def open(cls, root: Optional[str] = None) -> Optional["DocCache"]:
+        """DOC_CACHE_ENABLED=False・ディレクトリを作れない場合は None（キャッシュなしで読む）"""
+        if not getattr(ct, "DOC_CACHE_ENABLED", True):
+            return None
+        try:
+            return cls(root or getattr(ct, "DOC_CACHE_DIR", "./.cache/parsed_docs"))
+        except OSError as e:
+            logger.warning(f"parsed-doc cache unavailable: {type(e).__name__}: {e}")
+            return None
+
+    def _digest(self, path: str) -> str:
+        """ファイル内容の SHA-256（サイズ・更新時刻が索引と同じなら計算しない）"""
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._index.get(key)
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return entry["sha256"]
+        sha = _sha256(path)
+        self._index[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha}
+        self._dirty = True
+        return sha
+
+    def _blob(self, path: str) -> Path:
+        ext = os.path.splitext(path)[1].lower()
+        return self.root / f"{self._digest(path)}-{loader_version(ext)}.jsonl"
+
+    def get(self, path: str) -> Optional[List[Document]]:
+        """保存済みの解析結果（無い・読めない場合は None）"""
+        try:
+            blob = self._blob(path)
+            with blob.open(encoding="utf-8") as f:
+                docs = []
+                for line in f:
+                    item = json.loads(line)
+                    metadata = item.get("metadata") or {}
+                    for k in _PATH_KEYS:
+                        if k in metadata:
+                            metadata[k] = path
+                    docs.append(Document(page_content=item.get("page_content", ""), metadata=metadata))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning(f"parsed-doc cache read failed: {path} ({type(e).__name__}: {e})")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return docs
+
+    def put(self, path: str, docs: List[Document]) -> None:
+        """解析結果を保存する（失敗しても読み込み自体には影響させない）"""
+        try:
+            lines = [
+                json.dumps({"page_content": d.page_content, "metadata": d.metadata}, ensure_ascii=False, default=str)
+                for d in docs
+            ]
+            _write_atomic(self._blob(path), "".join(line + "\n" for line in lines))
+        except Exception as e:
+            logger.warning(f"parsed-doc cache write failed: {path} ({type(e).__name__}: {e})")
+
+    def save(self) -> None:
+        """
+        索引を書き出し、消えたファイルの索引と、どの索引からも指されない解析結果（内容が変わった・
+        ローダーの版が変わったもの）を消す（今回開いた後に作られたものは、他のプロセスが書いたものかもしれないので残す）。
+        """
+        try:
+            for key in [k for k in self._index if not os.path.exists(k)]:
+                del self._index[key]
+                self._dirty = True
+            if self._dirty:
+                payload = {"version": CACHE_VERSION, "files": self._index}
+                _write_atomic(self.root / INDEX_FILE, json.dumps(payload, ensure_ascii=False))
+                self._dirty = False
+            live = {
+                f"{e['sha256']}-{loader_version(os.path.splitext(k)[1].lower())}.jsonl" for k, e in self._index.items()
+            }
+            for blob in self.root.glob("*.jsonl"):
+                if blob.name not in live and blob.stat().st_mtime < self._opened_at:
+                    blob.unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"parsed-doc cache save failed: {type(e).__name__}: {e}")
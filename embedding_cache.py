@@ -0,0 +1,155 @@
+"""
+このファイルは、埋め込みベクトルのディスクキャッシュ（SQLite）を定義するファイルです。
+キーは「モデル名 + テキストのハッシュ」で、同じテキストは二度と埋め込みAPIに送りません。
+件数が上限を超えたら最終利用時刻の古いものから削除します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+import constants as ct
+import tracing
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# SQLite の 1 文で渡すプレースホルダ数の上限（古い SQLite の 999 を下回る値）
+_SQL_BATCH = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    任意の Embeddings をラップし、結果を SQLite に保存する。
+    Chroma には通常の Embeddings として渡せる（チャンクもクエリもキャッシュ対象）。
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        *,
+        path: Optional[str] = None,
+        model_name: Optional[str] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        self.max_entries = max_entries or getattr(ct, "EMBEDDING_CACHE_MAX_ENTRIES", 50_000)
+        self.path = Path(path or getattr(ct, "EMBEDDING_CACHE_PATH", "./.cache/embeddings.sqlite"))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    # ------------------------------------------------------------
+    # キー・直列化
+    # ------------------------------------------------------------
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _pack(vec: List[float]) -> bytes:
+        return array("f", vec).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[float]:
+        a = array("f")
+        a.frombytes(blob)
+        return a.tolist()
+
+    # ------------------------------------------------------------
+    # SQLite 操作
+    # ------------------------------------------------------------
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH):
+                part = keys[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", part
+                ).fetchall()
+                for k, blob in rows:
+                    found[k] = self._unpack(blob)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used=? WHERE key IN ({','.join('?' * len(rows))})",
+                        [now, *[k for k, _ in rows]],
+                    )
+            self._conn.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings(key, vec, last_used) VALUES (?, ?, ?)",
+                [(k, self._pack(v), now) for k, v in items.items()],
+            )
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self) -> None:
+        """上限超過時は 9 割まで古い順に削除（毎回1件ずつ消すより書き込みが少ない）"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_entries:
+            return
+        drop = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (drop,),
+        )
+        logger.info(f"embedding cache evicted: {drop} entries")
+
+    # ------------------------------------------------------------
+    # Embeddings インターフェース
+    # ------------------------------------------------------------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        # 未キャッシュのテキストだけ（重複を除いて）埋め込む
+        missing: Dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in found and k not in missing:
+                missing[k] = t
+        if missing:
+            with tracing.span("embed_documents", texts=len(missing)):
+                vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._store(fresh)
+            found.update(fresh)
+        logger.debug(f"embedding cache: hit={len(texts) - len(missing)} miss={len(missing)}")
+        return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        with tracing.span("embed_query") as sp:
+            key = self._key(text)
+            found = self._lookup([key])
+            sp.set(cache_hit=key in found)
+            if key in found:
+                return found[key]
+            vec = self.underlying.embed_query(text)
+            self._store({key: vec})
+            return vec
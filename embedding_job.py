@@ -0,0 +1,201 @@
+"""
+このファイルは、チャンクを一定サイズのバッチに分けて埋め込み、Chroma に書き込むジョブを定義するファイルです。
+- 同時実行数を制限し、レート制限（429）では待ち時間を適応的に伸ばして再試行
+- バッチ単位で Chroma にコミットし、完了したバッチをチェックポイントに記録
+- 途中で落ちても、次回は未完了のバッチから再開
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+import constants as ct
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+CHECKPOINT_FILE = "embedding_job.json"
+
+
+class EmbeddingJobError(RuntimeError):
+    """再試行しても埋め込めないバッチが残ったときの例外（完了分はコミット済み）"""
+
+
+############################################################
+# レート制限判定・適応バックオフ
+############################################################
+def _is_rate_limited(e: Exception) -> bool:
+    if type(e).__name__ == "RateLimitError":
+        return True
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status == 429
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """レスポンスの Retry-After ヘッダ（秒）があれば返す"""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _AdaptiveBackoff:
+    """
+    全ワーカーで共有する待ち時間。429 のたびに倍増し、成功すると半減する。
+    （ワーカーごとに独立して待つと、解除直後に一斉に再送して再び 429 になるため）
+    """
+
+    def __init__(self, base: float, maximum: float) -> None:
+        self.base = base
+        self.maximum = maximum
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+    def on_rate_limited(self, hint: Optional[float]) -> float:
+        with self._lock:
+            self.delay = min(self.maximum, max(self.base, self.delay * 2, hint or 0.0))
+            return self.delay
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.delay = self.delay / 2 if self.delay > self.base else 0.0
+
+    def current(self) -> float:
+        with self._lock:
+            return self.delay
+
+
+############################################################
+# チェックポイント
+############################################################
+def _job_key(ids: List[str], batch_size: int) -> str:
+    h = hashlib.sha1(str(batch_size).encode("utf-8"))
+    for i in ids:
+        h.update(i.encode("utf-8") + b"\n")
+    return h.hexdigest()
+
+
+def _load_checkpoint(path: Path, key: str) -> Set[int]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return set()
+    return set(data.get("done", [])) if data.get("job") == key else set()
+
+
+def _save_checkpoint(path: Path, key: str, done: Set[int]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"job": key, "done": sorted(done)}), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+############################################################
+# ジョブ本体
+############################################################
+def run_embedding_job(
+    vectordb,
+    items: List[Tuple[str, Document]],
+    checkpoint_dir: str,
+    *,
+    batch_size: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    (チャンクID, Document) の列を vectordb.add_texts でバッチごとに書き込む。
+    埋め込みは vectordb の埋め込み（embedding_function）で行い、同じ ID は上書きされる。
+
+    Returns:
+        {"batches": n, "skipped": n, "committed": n}
+    Raises:
+        EmbeddingJobError: 再試行上限に達したバッチがあるとき（完了バッチは保存済み）
+    """
+    batch_size = batch_size or getattr(ct, "EMBED_BATCH_SIZE", 64)
+    max_concurrency = max_concurrency or getattr(ct, "EMBED_MAX_CONCURRENCY", 2)
+    max_attempts = getattr(ct, "EMBED_MAX_ATTEMPTS", 8)
+    backoff = _AdaptiveBackoff(
+        getattr(ct, "EMBED_BACKOFF_BASE_SEC", 1.0),
+        getattr(ct, "EMBED_BACKOFF_MAX_SEC", 60.0),
+    )
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    ckpt_path = Path(checkpoint_dir) / CHECKPOINT_FILE
+    key = _job_key([i for i, _ in items], batch_size)
+    done = _load_checkpoint(ckpt_path, key)
+
+    # 対象が変わってチェックポイントが合わない場合も、書き込み済みのチャンクは送らない
+    try:
+        todo_ids = [i for n, b in enumerate(batches) if n not in done for i, _ in b]
+        existing = set(vectordb.get(ids=todo_ids, include=[]).get("ids", [])) if todo_ids else set()
+    except Exception:
+        existing = set()
+    for n, b in enumerate(batches):
+        if n in done or not existing:
+            continue
+        rest = [(i, d) for i, d in b if i not in existing]
+        if rest:
+            batches[n] = rest
+        else:
+            done.add(n)
+    if done:
+        logger.info(f"embedding job resumed: {len(done)}/{len(batches)} batches already committed")
+
+    state_lock = threading.Lock()
+    stats = {"batches": len(batches), "skipped": len(done), "committed": 0}
+
+    def _run_batch(n: int) -> None:
+        batch = batches[n]
+        ids = [i for i, _ in batch]
+        texts = [d.page_content for _, d in batch]
+        metadatas = [d.metadata or {} for _, d in batch]
+        for attempt in range(1, max_attempts + 1):
+            wait = backoff.current()
+            if wait:
+                time.sleep(wait * (0.5 + random.random() / 2))
+            try:
+                # 埋め込み → upsert。埋め込みが 429 で失敗した場合は何も書かれていない
+                vectordb.add_texts(texts, metadatas=metadatas, ids=ids)
+                break
+            except Exception as e:
+                if not _is_rate_limited(e) or attempt == max_attempts:
+                    raise
+                delay = backoff.on_rate_limited(_retry_after(e))
+                logger.warning(f"embedding batch {n} rate limited (attempt {attempt}); backoff {delay:.1f}s")
+        backoff.on_success()
+
+        with state_lock:
+            # 書けたバッチだけチェックポイントに載せる
+            done.add(n)
+            stats["committed"] += 1
+            _save_checkpoint(ckpt_path, key, done)
+
+    pending = [n for n in range(len(batches)) if n not in done]
+    errors: List[str] = []
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = {pool.submit(_run_batch, n): n for n in pending}
+        for f in as_completed(futures):
+            try:
+                f.result()
+            except Exception as e:
+                errors.append(f"batch {futures[f]}: {type(e).__name__}: {e}")
+
+    if errors:
+        raise EmbeddingJobError(
+            f"{len(errors)}/{len(batches)} embedding batches failed; rerun to resume. first: {errors[0]}"
+        )
+    ckpt_path.unlink(missing_ok=True)
+    return stats
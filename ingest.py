@@ -0,0 +1,215 @@
+"""
+このファイルは、ベクターストア（Chroma）への差分取り込みを行うファイルです。
+ファイルごとのハッシュ・更新時刻・チャンクIDをマニフェストに記録し、
+追加・変更されたファイルだけを再分割・再埋め込みし、削除されたファイルのベクトルを消します。
+埋め込み自体は embedding_job のバッチジョブ（チェックポイント付き）で行います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+import constants as ct
+import embedding_job
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+MANIFEST_FILE = "ingest_manifest.json"
+MANIFEST_VERSION = 1
+
+
+############################################################
+# マニフェスト
+############################################################
+def file_sha256(path: str) -> str:
+    """ファイル内容の SHA-256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(manifest_dir: str) -> Dict[str, dict]:
+    """マニフェストを読み込む（無い・壊れている・版が違う場合は空）"""
+    p = Path(manifest_dir) / MANIFEST_FILE
+    try:
+        data = json.loads(p.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"manifest unreadable; ignored: {type(e).__name__}: {e}")
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("files", {})
+
+
+def save_manifest(manifest_dir: str, files: Dict[str, dict]) -> None:
+    """マニフェストを書き込む（一時ファイル経由で置き換え、途中終了で壊さない）"""
+    p = Path(manifest_dir) / MANIFEST_FILE
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(
+        json.dumps({"version": MANIFEST_VERSION, "files": files}, ensure_ascii=False, indent=1),
+        encoding="utf-8",
+    )
+    os.replace(tmp, p)
+
+
+def chunk_ids_for(rel_path: str, sha256: str, n: int) -> List[str]:
+    """パスと内容から決まる決定的なチャンクID"""
+    path_key = hashlib.sha1(rel_path.encode("utf-8")).hexdigest()[:12]
+    return [f"{path_key}-{sha256[:16]}-{i}" for i in range(n)]
+
+
+def scan_files(topdir: str, extensions) -> Dict[str, os.stat_result]:
+    """取り込み対象ファイル（相対パス → stat）"""
+    out: Dict[str, os.stat_result] = {}
+    for root, _, files in os.walk(topdir):
+        for f in files:
+            if os.path.splitext(f)[1].lower() not in extensions:
+                continue
+            p = os.path.join(root, f)
+            try:
+                out[os.path.relpath(p, topdir)] = os.stat(p)
+            except OSError:
+                continue
+    return out
+
+
+############################################################
+# 差分同期
+############################################################
+def _adopt_legacy_store(vectordb, topdir: str, files: Dict[str, os.stat_result]) -> Dict[str, dict]:
+    """
+    マニフェスト導入前に作られたストアから、source メタデータを手掛かりに
+    既存ベクトルをマニフェストへ取り込む（再埋め込みを避ける）
+    """
+    try:
+        got = vectordb.get(include=["metadatas"])
+    except Exception as e:
+        logger.warning(f"legacy store scan failed: {type(e).__name__}: {e}")
+        return {}
+    by_source: Dict[str, List[str]] = {}
+    for _id, meta in zip(got.get("ids", []), got.get("metadatas", [])):
+        src = (meta or {}).get("source")
+        if src:
+            by_source.setdefault(os.path.normcase(os.path.abspath(src)), []).append(_id)
+
+    adopted: Dict[str, dict] = {}
+    for rel, stat in files.items():
+        ids = by_source.get(os.path.normcase(os.path.abspath(os.path.join(topdir, rel))))
+        if not ids:
+            continue
+        adopted[rel] = {
+            "sha256": file_sha256(os.path.join(topdir, rel)),
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "chunk_ids": ids,
+        }
+    logger.info(f"legacy store adopted: {len(adopted)} files")
+    return adopted
+
+
+def sync_vectorstore(
+    vectordb,
+    topdir: str,
+    manifest_dir: str,
+    chunks_for: Callable[[List[str]], Dict[str, List[Document]]],
+    extensions,
+) -> Dict[str, int]:
+    """
+    data/ とベクターストアを差分同期する。
+    chunks_for(絶対パスのリスト) は、埋め込みが必要なファイルの分割済みチャンクを {絶対パス: チャンク} で返す関数
+    （まとめて渡すので、呼び出し側は並列読み込み・解析結果のキャッシュをそのまま使える）。
+
+    Returns:
+        {"added": n, "changed": n, "removed": n, "unchanged": n}
+    """
+    files = scan_files(topdir, extensions)
+    try:
+        stored_ids = set(vectordb.get(include=[]).get("ids", []))
+    except Exception:
+        stored_ids = set()
+
+    manifest = load_manifest(manifest_dir)
+    if not manifest and stored_ids:
+        manifest = _adopt_legacy_store(vectordb, topdir, files)
+
+    stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    new_manifest: Dict[str, dict] = {}
+    pending: Dict[str, dict] = {}
+    items: List[Tuple[str, Document]] = []
+
+    # 1) 削除されたファイル（ベクトルは最後にまとめて消す）
+    stats["removed"] = sum(1 for rel in manifest if rel not in files)
+
+    # 2) 追加・変更されたファイル（まず対象を決め、チャンクはまとめて取得する）
+    todo: List[Tuple[str, str, str, os.stat_result]] = []
+    for rel in sorted(files):
+        stat = files[rel]
+        abs_path = os.path.join(topdir, rel)
+        entry = manifest.get(rel)
+
+        # サイズと更新時刻が同じならハッシュ計算も省く
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            sha = entry["sha256"]
+        else:
+            try:
+                sha = file_sha256(abs_path)
+            except OSError as e:
+                logger.warning(f"hash failed: {rel} ({type(e).__name__}: {e})")
+                continue
+
+        if entry and entry.get("sha256") == sha and set(entry.get("chunk_ids", [])) <= stored_ids:
+            new_manifest[rel] = {**entry, "mtime": stat.st_mtime, "size": stat.st_size}
+            stats["unchanged"] += 1
+            continue
+
+        todo.append((rel, abs_path, sha, stat))
+
+    chunks_by_path = chunks_for([abs_path for _, abs_path, _, _ in todo]) if todo else {}
+    for rel, abs_path, sha, stat in todo:
+        chunks = chunks_by_path.get(abs_path) or []
+        if not chunks:
+            # 読み込み失敗・空ファイルは記録せず、次回再試行する
+            continue
+        ids = chunk_ids_for(rel, sha, len(chunks))
+        pending[rel] = {"sha256": sha, "mtime": stat.st_mtime, "size": stat.st_size, "chunk_ids": ids}
+        items.extend(zip(ids, chunks))
+        stats["changed" if rel in manifest else "added"] += 1
+
+    # 3) 追加・変更分をバッチ埋め込み（失敗時は完了したファイルだけ記録して再送出）
+    if items:
+        try:
+            embedding_job.run_embedding_job(vectordb, items, manifest_dir)
+        except embedding_job.EmbeddingJobError:
+            stored_ids = set(vectordb.get(include=[]).get("ids", []))
+            for rel, entry in pending.items():
+                if set(entry["chunk_ids"]) <= stored_ids:
+                    new_manifest[rel] = entry
+                elif rel in manifest:
+                    new_manifest[rel] = manifest[rel]
+            save_manifest(manifest_dir, new_manifest)
+            raise
+    new_manifest.update(pending)
+
+    # 4) マニフェストに残らないベクトル（削除・変更前の版・孤児）を消す
+    kept_ids = {i for entry in new_manifest.values() for i in entry["chunk_ids"]}
+    stale_ids = sorted(stored_ids - kept_ids)
+    if stale_ids:
+        vectordb.delete(ids=stale_ids)
+
+    save_manifest(manifest_dir, new_manifest)
+    return stats
@@ -2,26 +2,35 @@
 """
 RAGの初期化：データ読み込み→分割→ベクタDB作成→retriever格納
 Chroma失敗や文書0件でもBM25に自動フォールバックして必ず動く
+インデックスはプロセス全体で1つだけ構築し、全セッションで読み取り専用に共有する
 """
 
 from __future__ import annotations
 import os
+import time
+import hashlib
 import logging
+import threading
+import dataclasses
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Any, List, Optional
 
 import streamlit as st
 from dotenv import load_dotenv
 
 from langchain_core.documents import Document
 from langchain_text_splitters import CharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_community.retrievers import BM25Retriever
-from langchain_community.document_loaders import TextLoader, PyMuPDFLoader, Docx2txtLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
+# Chroma（chromadb）と OpenAIEmbeddings（openai）は重いため、索引を作るときに読み込む（_build_index_stages / _make_embeddings）
 
 import constants as ct
+import embedding_cache
+import embedding_job
+import ingest
+import loaders
+import retrieval
+import sparse_index
+import tracing
 
 load_dotenv()
 logger = logging.getLogger(ct.LOGGER_NAME)
@@ -29,31 +38,24 @@ logger = logging.getLogger(ct.LOGGER_NAME)
 # ─────────────────────────────────────────────────────────────
 # ユーティリティ
 # ─────────────────────────────────────────────────────────────
-SUPPORTED = {
-    ".txt":  lambda p: TextLoader(p, encoding="utf-8", autodetect_encoding=True),
-    ".pdf":  PyMuPDFLoader,
-    ".docx": Docx2txtLoader,
-    ".csv":  lambda p: CSVLoader(p, encoding="utf-8"),
-}
-
-def _safe_load_file(path: str) -> List[Document]:
-    ext = os.path.splitext(path)[1].lower()
-    loader_fn = SUPPORTED.get(ext)
-    if not loader_fn:
-        return []
-    try:
-        loader = loader_fn(path) if callable(loader_fn) else loader_fn(path)  # type: ignore
-        return loader.load()
-    except Exception as e:
-        logger.warning(f"load failed: {path} ({type(e).__name__}: {e})")
-        return []
+SUPPORTED = loaders.SUPPORTED
+
+def _make_embeddings() -> Any:
+    """
+    ベクタDBで使う埋め込み（APIキーは.envから）。openai はここで初めて読み込む。
+    ベンチマーク（benchmarks.fakes.install）はこの関数を差し替えてオフラインで動かす。
+    """
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings()
 
 def _walk_and_load(topdir: str) -> List[Document]:
+    """data/ 配下を（ファイル数が多ければ並列で）読み込む。順序はパス順で決定的"""
+    results = loaders.load_files(loaders.list_files(topdir))
+    loaders.log_load_report(results)
     docs: List[Document] = []
-    for root, _, files in os.walk(topdir):
-        for f in files:
-            p = os.path.join(root, f)
-            docs.extend(_safe_load_file(p))
+    for r in results:
+        docs.extend(r.docs)
     return docs
 
 def _split_docs(docs: List[Document]) -> List[Document]:
@@ -67,83 +69,281 @@ def _split_docs(docs: List[Document]) -> List[Document]:
     return splitter.split_documents(docs)
 
 # ─────────────────────────────────────────────────────────────
-# メイン初期化
+# コーパスの指紋（変更検知）
 # ─────────────────────────────────────────────────────────────
-def initialize() -> None:
-    """Retrievers を session_state に必ずセットする"""
-    st.session_state.setdefault("retriever", None)
-    st.session_state.setdefault("bm25_retriever", None)
+# 直近の指紋計算結果（プロセス全体で共有）
+_fingerprint_lock = threading.Lock()
+_last_fingerprint: dict = {"at": 0.0, "top": None, "value": None}
+
+
+def _corpus_fingerprint(topdir: str) -> str:
+    """対象ファイルのパス・サイズ・更新時刻から指紋を作る（中身は読まない）"""
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(topdir):
+        dirs.sort()
+        for f in sorted(files):
+            p = os.path.join(root, f)
+            if os.path.splitext(f)[1].lower() not in SUPPORTED:
+                continue
+            try:
+                stat = os.stat(p)
+            except OSError:
+                continue
+            h.update(f"{os.path.relpath(p, topdir)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _current_fingerprint(topdir: str) -> str:
+    """
+    指紋を返す。CORPUS_RECHECK_SEC 以内の再実行では前回値を使い回し、
+    Streamlit の rerun ごとに data/ を走査しないようにする。
+    """
+    interval = getattr(ct, "CORPUS_RECHECK_SEC", 30)
+    now = time.monotonic()
+    with _fingerprint_lock:
+        if (
+            _last_fingerprint["value"] is not None
+            and _last_fingerprint["top"] == topdir
+            and now - _last_fingerprint["at"] < interval
+        ):
+            return _last_fingerprint["value"]
+        value = _corpus_fingerprint(topdir)
+        _last_fingerprint.update(at=now, top=topdir, value=value)
+        return value
+
+
+# ─────────────────────────────────────────────────────────────
+# 共有インデックス
+# ─────────────────────────────────────────────────────────────
+@dataclass(frozen=True)
+class RagIndex:
+    """全セッションで共有する読み取り専用のインデックス"""
+    fingerprint: str
+    retriever: Any
+    bm25_retriever: Optional[Any]
+    chunk_count: int
+    # 埋め込みジョブが途中で止まった（レート制限など）場合 False。一定時間後に再開する
+    complete: bool = True
+    built_at: float = 0.0
+    # 構築時の段ごとの処理時間（tracing の記録）
+    build_trace: Optional[dict] = None
+
+
+def _sparse_signature(fingerprint: str) -> str:
+    """キーワード索引の作り直しが必要かを判定する署名（コーパス + 分割・索引の設定）"""
+    params = (
+        fingerprint,
+        getattr(ct, "CHUNK_SIZE", 500),
+        getattr(ct, "CHUNK_OVERLAP", 50),
+        getattr(ct, "SPARSE_NGRAM_RANGE", (2, 3)),
+        getattr(ct, "SPARSE_BM25_K1", 1.5),
+        getattr(ct, "SPARSE_BM25_B", 0.75),
+    )
+    return hashlib.sha1(repr(params).encode("utf-8")).hexdigest()
 
-    top = Path(getattr(ct, "RAG_TOP_FOLDER_PATH", "./data")).resolve()
-    chroma_dir = Path(getattr(ct, "CHROMA_DIR", "./chroma_store")).resolve()
-    chroma_dir.mkdir(parents=True, exist_ok=True)
+
+def _chunk_ids(top: str, chroma_path: Path, chunks: List[Document]) -> List[str]:
+    """
+    チャンクごとの ID（Chroma と同じもの）。マニフェストに無いファイルは「相対パス#連番」。
+    チャンクはファイルごとに分割順で並んでいる前提。
+    """
+    manifest = ingest.load_manifest(str(chroma_path))
+    ids: List[str] = []
+    seen: dict = {}
+    for c in chunks:
+        src = c.metadata.get("source") or ""
+        rel = os.path.relpath(src, top) if src else ""
+        n = seen.get(rel, 0)
+        seen[rel] = n + 1
+        known = manifest.get(rel, {}).get("chunk_ids", [])
+        ids.append(known[n] if n < len(known) else f"{rel}#{n}")
+    return ids
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _build_rag_index(top: str, chroma_dir: str, fingerprint: str) -> RagIndex:
+    """
+    データ読み込み→分割→Chroma→BM25 を実行して RagIndex を作る。
+    fingerprint が変わったときだけ再実行される（max_entries=1 で古い索引は破棄）。
+    段ごとの処理時間はトレースとしてログに出し、RagIndex.build_trace にも残す。
+    """
+    trace = tracing.Trace("initialize", top=os.path.basename(top))
+    with tracing.activate(trace):
+        index = _build_index_stages(top, chroma_dir, fingerprint)
+    trace.set(chunks=index.chunk_count, complete=index.complete)
+    return dataclasses.replace(index, build_trace=tracing.emit(trace))
+
+
+def _build_index_stages(top: str, chroma_dir: str, fingerprint: str) -> RagIndex:
+    chroma_path = Path(chroma_dir)
+    chroma_path.mkdir(parents=True, exist_ok=True)
     Path(getattr(ct, "LOG_DIR_PATH", "./logs")).mkdir(parents=True, exist_ok=True)
 
     logger.info(f"RAG init start: top={top}")
 
-    # 1) ドキュメント読み込み
-    docs = _walk_and_load(str(top))
-    if not docs:
-        logger.warning("no documents loaded; will rely on BM25 fallback")
+    # 0) 保存済みのキーワード索引が今のコーパスと一致すれば、読み込み・分割を丸ごと省く
+    sparse_dir = getattr(ct, "SPARSE_INDEX_DIR", "./.cache/sparse_index")
+    signature = _sparse_signature(fingerprint)
+    with tracing.span("sparse_open") as sp:
+        saved_sparse = sparse_index.SparseIndex.load(sparse_dir, signature)
+        sp.set(hit=saved_sparse is not None)
+    chunks_by_source: dict = {}
+    if saved_sparse is not None:
+        logger.info(f"sparse index opened (mmap): chunks={len(saved_sparse)}")
+        docs, chunks = [], []
     else:
-        logger.info(f"documents loaded: {len(docs)}")
+        # 1) ドキュメント読み込み
+        with tracing.span("load") as sp:
+            docs = _walk_and_load(top)
+            sp.set(docs=len(docs))
+        if not docs:
+            logger.warning("no documents loaded; will rely on BM25 fallback")
+        else:
+            logger.info(f"documents loaded: {len(docs)}")
+
+        # 2) 分割
+        with tracing.span("split") as sp:
+            chunks = _split_docs(docs)
+            sp.set(chunks=len(chunks))
+        logger.info(f"split into chunks: {len(chunks)}")
+        for c in chunks:
+            chunks_by_source.setdefault(c.metadata.get("source"), []).append(c)
 
-    # 2) 分割
-    chunks = _split_docs(docs)
-    logger.info(f"split into chunks: {len(chunks)}")
+    def _chunks_for(paths: List[str]) -> dict:
+        # 読み込み済みならそれを使い、省略した場合は埋め込みが必要なファイルだけまとめて読む
+        #   （並列読み込み・解析結果のキャッシュを通すので、Chroma の作り直しでも PDF/DOCX を解析し直さない）
+        missing = [p for p in paths if p not in chunks_by_source]
+        if missing and saved_sparse is not None:
+            with tracing.span("load_for_chroma", files=len(missing)):
+                results = loaders.load_files(missing)
+                loaders.log_load_report(results)
+                for c in _split_docs([d for r in results for d in r.docs]):
+                    chunks_by_source.setdefault(c.metadata.get("source"), []).append(c)
+        return {p: chunks_by_source.get(p, []) for p in paths}
 
-    # 3) ベクタDB（Chroma）作成 or ロード
-    retriever = None
+    # 3) ベクタDB（Chroma）をロードし、マニフェストで data/ と差分同期
+    top_k = getattr(ct, "TOP_K", 5)
+    candidates = max(top_k, getattr(ct, "HYBRID_CANDIDATES", 10))
+    dense = None
+    complete = True
     try:
-        embeddings = OpenAIEmbeddings()  # APIキーは.envから
-        if len(list(chroma_dir.glob("*"))) == 0 and chunks:
-            # まだ永続化がない → 新規作成
-            vectordb = Chroma.from_documents(
-                documents=chunks,
-                embedding=embeddings,
-                persist_directory=str(chroma_dir),
-            )
-            vectordb.persist()
-            logger.info("chroma built & persisted")
-        else:
-            # 既存をロード（空でも例外ではないので下でBM25保険）
-            vectordb = Chroma(
-                embedding_function=embeddings,
-                persist_directory=str(chroma_dir),
+        from langchain_community.vectorstores import Chroma
+
+        # 同一テキストはディスクキャッシュから返す
+        embeddings = embedding_cache.CachedEmbeddings(_make_embeddings())
+        vectordb = Chroma(
+            embedding_function=embeddings,
+            persist_directory=str(chroma_path),
+        )
+        try:
+            with tracing.span("chroma_sync") as sp:
+                stats = ingest.sync_vectorstore(
+                    vectordb,
+                    topdir=top,
+                    manifest_dir=str(chroma_path),
+                    chunks_for=_chunks_for,
+                    extensions=SUPPORTED,
+                )
+                sp.set(**stats)
+            logger.info(
+                "chroma synced: added={added} changed={changed} removed={removed} unchanged={unchanged}".format(**stats)
             )
-            logger.info("chroma loaded")
+        except embedding_job.EmbeddingJobError as e:
+            # 完了したバッチはコミット済み → 部分的なストアで動かし、後で続きから再開
+            complete = False
+            tracing.fallback("chroma_partial")
+            logger.warning(f"chroma partially synced: {e}")
 
-        # retriever 生成
-        retriever = vectordb.as_retriever(search_kwargs={"k": getattr(ct, "TOP_K", 5)})
+        # retriever 生成（ハイブリッド統合用に TOP_K より深めに取る）
+        #   k / filter / score_threshold は呼び出しごとに渡す（共有インスタンスの設定は書き換えない）
+        dense = retrieval.DenseRetriever(
+            vectorstore=vectordb,
+            k=candidates,
+            score_threshold=getattr(ct, "RETRIEVAL_SCORE_THRESHOLD", None),
+        )
 
     except Exception as e:
         logger.warning(f"chroma error: {type(e).__name__}: {e}")
-        retriever = None
+        tracing.fallback("chroma_error")
+        dense = None
 
-    # 4) BM25 フォールバック（文書0件やChroma失敗時）
+    # 4) BM25（ハイブリッド検索のキーワード側。Chroma失敗時は単独で使う）
+    #    日本語は空白で分かち書きされないため、文字 n-gram の疎行列索引を使う
     bm25 = None
     try:
-        if chunks:
-            bm25 = BM25Retriever.from_documents(chunks)
-        elif docs:
-            bm25 = BM25Retriever.from_documents(docs)
-        if bm25:
-            bm25.k = getattr(ct, "TOP_K", 5)
+        index = saved_sparse
+        if index is None and (chunks or docs):
+            base = chunks or docs
+            with tracing.span("sparse_build", chunks=len(base)):
+                index = sparse_index.SparseIndex.build(base, _chunk_ids(top, chroma_path, base))
+                index.save(sparse_dir, signature)
+            logger.info(f"sparse index built & saved: vocab={len(index.vocab)}")
+        if index is not None:
+            bm25 = sparse_index.SparseRetriever(index=index, k=candidates)
             logger.info("bm25 ready")
     except Exception as e:
         logger.warning(f"bm25 error: {type(e).__name__}: {e}")
+        tracing.fallback("bm25_error")
 
     # 5) 最終確定（必ず retriever を入れる）
-    if retriever is not None:
-        st.session_state["retriever"] = retriever
-        logger.info("retriever set: chroma")
-    elif bm25 is not None:
-        st.session_state["retriever"] = bm25
-        st.session_state["bm25_retriever"] = bm25
-        logger.warning("retriever set: bm25 fallback")
+    if dense is not None or bm25 is not None:
+        # dense と BM25 を同時に検索し RRF で統合（片方しか無ければその結果だけ）
+        retriever = retrieval.HybridRetriever(
+            dense=dense,
+            sparse=bm25,
+            k=top_k,
+            dense_weight=getattr(ct, "HYBRID_DENSE_WEIGHT", 1.0),
+            sparse_weight=getattr(ct, "HYBRID_SPARSE_WEIGHT", 1.0),
+            rrf_k=getattr(ct, "RRF_K", 60),
+        )
+        if dense is not None and bm25 is not None:
+            logger.info("retriever set: hybrid (chroma + bm25)")
+        elif dense is not None:
+            logger.info("retriever set: chroma")
+        else:
+            tracing.fallback("bm25_only")
+            logger.warning("retriever set: bm25 fallback")
     else:
-        # 最後の保険（空でもクラッシュしないようにNoneで終わるよりマシ）
-        st.session_state["retriever"] = BM25Retriever.from_documents([Document(page_content="")])
-        logger.error("no documents available; set empty bm25 to avoid crash")
+        # 最後の保険（空でもクラッシュしないようにNoneで終わるよりマシ。常に0件を返す）
+        retriever = retrieval.HybridRetriever(k=top_k)
+        tracing.fallback("empty_retriever")
+        logger.error("no documents available; set empty retriever to avoid crash")
 
     logger.info("RAG init done")
+    return RagIndex(
+        fingerprint=fingerprint,
+        retriever=retriever,
+        bm25_retriever=bm25,
+        chunk_count=len(bm25.index) if bm25 is not None else len(chunks),
+        complete=complete,
+        built_at=time.monotonic(),
+    )
+
+
+def get_rag_index() -> RagIndex:
+    """現在のコーパスに対応する共有インデックスを返す（未構築なら構築する）"""
+    top = str(Path(getattr(ct, "RAG_TOP_FOLDER_PATH", "./data")).resolve())
+    chroma_dir = str(Path(getattr(ct, "CHROMA_DIR", "./chroma_store")).resolve())
+    fingerprint = _current_fingerprint(top)
+    index = _build_rag_index(top, chroma_dir, fingerprint)
+    if not index.complete and time.monotonic() - index.built_at > getattr(ct, "INDEX_RESUME_INTERVAL_SEC", 60):
+        # 途中で止まった埋め込みジョブをチェックポイントから再開
+        _build_rag_index.clear()
+        index = _build_rag_index(top, chroma_dir, fingerprint)
+    return index
+
+
+# ─────────────────────────────────────────────────────────────
+# メイン初期化
+# ─────────────────────────────────────────────────────────────
+def initialize() -> None:
+    """
+    Retrievers を session_state に必ずセットする。
+    実体はプロセス共有の RagIndex で、セッションには参照だけを置く。
+    """
+    index = get_rag_index()
+    st.session_state["retriever"] = index.retriever
+    st.session_state["bm25_retriever"] = index.bm25_retriever
+    st.session_state["index_build_trace"] = index.build_trace
+    # ウォームキャッシュ（warm_cache）が現在のコーパス向けかを判定するため
+    st.session_state["index_fingerprint"] = index.fingerprint
@@ -0,0 +1,137 @@
+"""
+このファイルは、data/ 配下のファイルを Document に読み込む処理をまとめたファイルです。
+PDF の解析は CPU ボトルネックのため、ファイル数が多いときはプロセスプールで並列に読み込みます。
+内容が変わっていないファイルは解析し直さず、doc_cache に保存した解析結果を読みます。
+（子プロセスで import されるため、streamlit などの重い依存はここでは読み込まない）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from langchain_core.documents import Document
+
+import constants as ct
+import doc_cache
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# 拡張子 → ローダー（constants で定義。langchain_community のローダーは最初に解析するときに読み込まれるため、
+# 解析結果がすべてキャッシュ（doc_cache）にあれば読み込まれない）
+SUPPORTED = ct.SUPPORTED_EXTENSIONS
+
+
+class LoadResult(NamedTuple):
+    """1ファイル分の読み込み結果"""
+    path: str
+    docs: List[Document]
+    seconds: float
+    error: Optional[str]
+
+
+############################################################
+# 1ファイルの読み込み（例外はファイル単位で閉じ込める）
+############################################################
+def load_file(path: str) -> LoadResult:
+    started = time.perf_counter()
+    ext = os.path.splitext(path)[1].lower()
+    loader_fn = SUPPORTED.get(ext)
+    if not loader_fn:
+        return LoadResult(path, [], 0.0, None)
+    try:
+        docs = loader_fn(path).load()
+        return LoadResult(path, docs, time.perf_counter() - started, None)
+    except Exception as e:
+        return LoadResult(path, [], time.perf_counter() - started, f"{type(e).__name__}: {e}")
+
+
+############################################################
+# 複数ファイルの読み込み
+############################################################
+def _resolve_workers(n_files: int) -> int:
+    """LOADER_MAX_WORKERS（None ならCPU数）と対象ファイル数から並列度を決める"""
+    if n_files < getattr(ct, "LOADER_PARALLEL_MIN_FILES", 64):
+        return 1
+    workers = getattr(ct, "LOADER_MAX_WORKERS", None) or os.cpu_count() or 1
+    return max(1, min(int(workers), n_files))
+
+
+def _parse_files(paths: List[str]) -> List[LoadResult]:
+    """
+    パスの順序どおりに結果を返す（並列でも決定的）。
+    プロセスプールが使えない環境では逐次読み込みに切り替える。
+    """
+    workers = _resolve_workers(len(paths))
+    if workers > 1:
+        try:
+            # Streamlit はスレッドを持つため fork ではなく spawn を使う
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                return list(pool.map(load_file, paths, chunksize=1))
+        except Exception as e:
+            logger.warning(f"parallel load unavailable; falling back to serial: {type(e).__name__}: {e}")
+    return [load_file(p) for p in paths]
+
+
+def load_files(paths: List[str], *, use_cache: bool = True, cache_dir: Optional[str] = None) -> List[LoadResult]:
+    """
+    パスの順序どおりに結果を返す。
+    解析結果のキャッシュ（doc_cache）にあるファイルはそれを読み、無いものだけ解析して保存する
+    （読み込みに失敗したファイルは保存しない）。
+    use_cache=False ならキャッシュを使わずにすべて解析する。
+    """
+    cache = doc_cache.DocCache.open(cache_dir) if use_cache else None
+    if cache is None:
+        return _parse_files(paths)
+
+    results: List[Optional[LoadResult]] = [None] * len(paths)
+    misses: List[int] = []
+    for i, path in enumerate(paths):
+        started = time.perf_counter()
+        docs = cache.get(path) if os.path.splitext(path)[1].lower() in SUPPORTED else None
+        if docs is None:
+            misses.append(i)
+        else:
+            results[i] = LoadResult(path, docs, time.perf_counter() - started, None)
+
+    for i, r in zip(misses, _parse_files([paths[i] for i in misses])):
+        results[i] = r
+        if r.error is None and os.path.splitext(r.path)[1].lower() in SUPPORTED:
+            cache.put(r.path, r.docs)
+    cache.save()
+    logger.info(f"parsed-doc cache: hit={cache.hits} parsed={len(misses)}")
+    return results
+
+
+def list_files(topdir: str) -> List[str]:
+    """読み込み対象ファイルをソート済みで列挙"""
+    out: List[str] = []
+    for root, dirs, files in os.walk(topdir):
+        dirs.sort()
+        for f in sorted(files):
+            if os.path.splitext(f)[1].lower() in SUPPORTED:
+                out.append(os.path.join(root, f))
+    return out
+
+
+def log_load_report(results: List[LoadResult]) -> None:
+    """ファイルごとの読み込み時間・失敗を出力"""
+    for r in results:
+        if r.error:
+            logger.warning(f"load failed: {r.path} ({r.error})")
+        else:
+            logger.debug(f"loaded: {r.path} docs={len(r.docs)} {r.seconds * 1000:.1f}ms")
+    slowest = sorted(results, key=lambda r: r.seconds, reverse=True)[:3]
+    if slowest:
+        total = sum(r.seconds for r in results)
+        top = ", ".join(f"{os.path.basename(r.path)}={r.seconds * 1000:.0f}ms" for r in slowest)
+        logger.info(f"load time: files={len(results)} cpu_total={total:.2f}s slowest=[{top}]")
@@ -48,23 +48,24 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# ============================================================
+# 🔵 3.5. チャット入力欄（起動直後から入力できるよう、重い import・初期化より先に描画）
+# ============================================================
+# constants は軽量（ローダー等の重い依存は最初に使うときに読み込む）なので先に読んでよい
+import constants as ct
+# LAZY_STARTUP=False なら従来どおり、初期化と会話ログの表示が終わってから描画する（下の 6.）
+_EARLY_CHAT_INPUT = getattr(ct, "LAZY_STARTUP", True)
+if _EARLY_CHAT_INPUT:
+    chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT)
+
 # ============================================================
 # 🔵 4. ここからは Streamlit と関係ない処理（安全地帯）
 # ============================================================
-import logging, os, sys, traceback, datetime, pathlib
-
-# ログ保存ディレクトリを作成
-pathlib.Path("logs").mkdir(exist_ok=True)
-
-# ログ設定
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[
-        logging.FileHandler("logs/app.log", encoding="utf-8"),
-        logging.StreamHandler(sys.stdout),
-    ],
-)
+import logging, os, traceback, datetime
+
+# ログ設定（logs/app.jsonl に JSON Lines で出力。書き込みは専用スレッドが行う。rerun しても設定は1回だけ）
+import app_logging
+app_logging.setup_logging()
 
 ############################################################
 # 1. ライブラリの読み込み
@@ -79,9 +80,10 @@ from initialize import initialize
 import components as cn
 # （自作）変数（定数）がまとめて定義・管理されているモジュール
 import constants as ct
-
-# 追加：ユーティリティで使用（社員名簿の直接表示）
-from pathlib import Path
+# （自作）社員名簿の読み込み・検索（キャッシュ付き）
+import roster
+# （自作）社員名簿への人数・絞り込み・集計の質問を表から直接答える
+import roster_query
 
 # ★★★★★ ここに追加してください ★★★★★
 os.environ.setdefault("USER_AGENT", "company_inner_search_app/1.0")
@@ -101,9 +103,7 @@ load_dotenv()
 
 # USER_AGENT は直前で setdefault 済み（.env と併用OK）
 
-# ロガー取得（basicConfig はアプリ全体で一度だけ。未設定なら INFO で設定）
-if not logging.getLogger().handlers:
-    logging.basicConfig(level=logging.INFO)
+# ロガー取得（ハンドラは app_logging.setup_logging で設定済み）
 logger = logging.getLogger(getattr(ct, "LOGGER_NAME", "ApplicationLog"))
 
 
@@ -191,6 +191,24 @@ with st.sidebar:
     st.success("質問・要望に対して、社内文書の情報をもとに回答を得られます。")
     st.markdown("**【入力例】**\n人事部に所属している従業員情報を一覧化して")
 
+    # ==== 処理時間の内訳（開発者向け・任意表示） ====
+    _trace_slot = None
+    if getattr(ct, "TRACE_PANEL_ENABLED", True):
+        st.markdown("---")
+        if st.toggle("処理時間の内訳を表示", key="show_trace_panel"):
+            _trace_slot = st.empty()
+
+
+def _render_trace_panel():
+    """サイドバーの内訳を最新の記録で描き直す（回答後にも呼ぶ）"""
+    if _trace_slot is None:
+        return
+    with _trace_slot.container():
+        cn.display_trace_panel(st.session_state.get("traces", []), st.session_state.get("index_build_trace"))
+
+
+_render_trace_panel()
+
 
 ############################################################
 # 5. 会話ログの表示
@@ -213,7 +231,8 @@ except Exception as e:
 ############################################################
 # 6. チャット入力の受け付け
 ############################################################
-chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT)
+if not _EARLY_CHAT_INPUT:
+    chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT)
 
 # 追加：社員名簿を安全に“直接表示”するヘルパー（LLMを通さない）
 def _show_staff_table(dept_query: str | None = None, csv_path: str | None = None):
@@ -221,65 +240,52 @@ def _show_staff_table(dept_query: str | None = None, csv_path: str | None = None
     if csv_path is None:
         csv_path = getattr(ct, "STAFF_CSV", "data/社員名簿.csv")
 
+    # 名簿は roster 側でキャッシュ済み（2回目以降はファイルの stat と部署索引の参照だけ）
     try:
-        import pandas as pd
-    except Exception:
-        st.error(
-            "社員名簿の表示に必要な pandas が見つかりません。ターミナルで `pip install -U pandas` を実行してください。",
-            icon=ct.ERROR_ICON,
-        )
+        staff = roster.get_roster(csv_path)
+    except roster.RosterError as err:
+        st.error(str(err))
         return
-
-    p = Path(csv_path)
-    if not p.exists():
+    if staff is None:
         st.warning(f"社員名簿が見つかりませんでした: {csv_path}")
         return
 
-    # 文字コードの保険（UTF-8/CP932/UTF-8-SIG を順に試す）
-    df = None
-    last_err = None
-    for enc in ("utf-8", "cp932", "utf-8-sig"):
-        try:
-            df = pd.read_csv(p, encoding=enc)
-            break
-        except Exception as err:
-            last_err = err
-            df = None
-    if df is None:
-        st.error(f"社員名簿の読み込みに失敗しました（encoding候補: utf-8, cp932, utf-8-sig）。\n{last_err}")
-        return
-
-    # 列名の候補（環境に合わせて増やしてOK）
-    dept_candidates = ["部署", "部門", "Department", "部署名", "所属部門", "配属", "部"]
-    # 実カラム名（オブジェクト）を取得できるようにマップ化
-    col_map = {str(c): c for c in df.columns}
-    dept_col = None
-    for name in dept_candidates:
-        if name in col_map:
-            dept_col = col_map[name]
-            break
-
     # 部署フィルタ（例：「人事」）
-    if dept_query and dept_col is not None:
-        df = df[df[dept_col].astype(str).str.contains(dept_query, case=False, na=False)]
+    df = staff.filter_dept(dept_query)
 
     st.subheader("従業員一覧（社員名簿）")
     st.caption(f"ソース: {csv_path}")
     st.dataframe(df, use_container_width=True, hide_index=True)
     st.info(f"表示件数: {len(df)} 件")
 
-    # 表の下にダウンロードボタン（CSV/Excel）
-    import io
-    csv_bytes = df.to_csv(index=False).encode("utf-8-sig")
-    st.download_button("CSVでダウンロード", data=csv_bytes, file_name="社員名簿_表示中.csv", mime="text/csv")
-    try:
-        from io import BytesIO
-        bio = BytesIO()
-        with pd.ExcelWriter(bio, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="名簿")
-        st.download_button("Excelでダウンロード", data=bio.getvalue(), file_name="社員名簿_表示中.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    except Exception:
-        pass
+    # 表の下にダウンロードボタン（CSV/Excel）。ファイルは押されたときだけ作る
+    _staff_export_buttons(staff, dept_query)
+
+
+@st.fragment
+def _staff_export_buttons(staff, dept_query: str | None):
+    """
+    ダウンロード用ファイルの作成ボタン。fragment なので押しても画面全体は再実行されない。
+    作ったファイルは roster 側で (名簿の版, 部署, 形式) ごとにキャッシュされる。
+    """
+    cols = st.columns(2)
+    for col, (fmt, label) in zip(cols, (("csv", "CSV"), ("xlsx", "Excel"))):
+        with col:
+            key = f"staff_export_{fmt}_{dept_query or 'all'}"
+            if st.button(f"{label}ファイルを作成", key=key, use_container_width=True):
+                try:
+                    mime, ext = roster.EXPORT_FORMATS[fmt]
+                    st.download_button(
+                        f"{label}でダウンロード",
+                        data=roster.export_bytes(staff, dept_query, fmt),
+                        file_name=f"社員名簿_表示中{ext}",
+                        mime=mime,
+                        key=f"{key}_download",
+                        use_container_width=True,
+                    )
+                except Exception as e:
+                    logger.warning(f"roster export failed: {fmt}: {type(e).__name__}: {e}")
+                    st.error(f"{label}ファイルの作成に失敗しました。")
 
 def _wants_staff_table(q: str) -> bool:
     if not q:
@@ -297,60 +303,8 @@ def _extract_dept(q: str) -> str | None:
 
 # === 追加：社員名簿CSVの自動検出＆アップロード保険 ===
 def _find_staff_csv(default_path: str = "data/社員名簿.csv") -> str | None:
-    from pathlib import Path
-    try:
-        import pandas as pd  # noqa
-    except Exception:
-        return None
-
-    # 1) constants.py に STAFF_CSV があれば最優先
-    if hasattr(ct, "STAFF_CSV"):
-        p = Path(ct.STAFF_CSV)
-        if p.exists():
-            return str(p)
-
-    # 2) 既定パス
-    p = Path(default_path)
-    if p.exists():
-        return str(p)
-
-    # 3) data/ 配下を総当り（列名とファイル名で推定）
-    data_dir = Path(getattr(ct, "DATA_DIR", "data"))
-    if not data_dir.exists():
-        return None
-
-    candidates = list(data_dir.rglob("*.csv"))
-    scored = []
-    for c in candidates:
-        df = None
-        for enc in ("utf-8", "cp932", "utf-8-sig"):
-            try:
-                import pandas as pd
-                df = pd.read_csv(c, nrows=5, encoding=enc)
-                break
-            except Exception:
-                df = None
-        if df is None:
-            continue
-
-        cols = set(map(str, df.columns))
-        pts = 0
-        for k in ("氏名","名前","従業員名","社員名","FullName","Name"):
-            if k in cols: pts += 2
-        for k in ("部署","部門","部署名","Department"):
-            if k in cols: pts += 3
-        for k in ("社員番号","従業員番号","EmployeeID","ID"):
-            if k in cols: pts += 1
-        if any(s in c.stem for s in ("名簿","社員","従業員","staff","employee")):
-            pts += 2
-
-        if pts > 0:
-            scored.append((pts, c))
-
-    if scored:
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return str(scored[0][1])
-    return None
+    # STAFF_CSV → 既定パス → data/ 配下の自動検出（採点結果は roster 側でキャッシュ）
+    return roster.find_staff_csv(default_path)
 
 def _ensure_staff_csv_available() -> str | None:
     """見つからなければアップロードして data/ に保存して使えるようにする"""
@@ -370,6 +324,17 @@ def _ensure_staff_csv_available() -> str | None:
     target.write_bytes(up.getvalue())
     st.success(f"保存しました: {target}")
     return str(target)
+
+def _answer_from_roster(q: str):
+    """社員名簿で答えられる質問なら roster_query の回答を返す（名簿が無い・解釈できない場合は None → RAG）"""
+    if not getattr(ct, "ROSTER_QUERY_ENABLED", True):
+        return None
+    try:
+        path = _find_staff_csv()
+        return roster_query.answer(q, roster.get_roster(path)) if path else None
+    except Exception as e:
+        logger.warning(f"roster query failed; falling back to RAG: {type(e).__name__}: {e}")
+        return None
 # === ここまで追加 ===
 
 # === 追加：LLMレスポンスのデバッグ表示＆フォールバック描画 ===
@@ -504,7 +469,7 @@ if chat_message:
     # 7-1. ユーザーメッセージの表示
     # ==========================================
     # ユーザーメッセージのログ出力（★ ログは現UIモードで記録）
-    logger.info({"message": chat_message, "application_mode": st.session_state.mode})
+    logger.info(app_logging.user_message_event(chat_message, st.session_state.mode))
 
     # ユーザーメッセージを表示
     with st.chat_message("user"):
@@ -524,7 +489,7 @@ if chat_message:
         with st.chat_message("assistant"):
             try:
                 _show_staff_table(dept_query=dept, csv_path=ensured_csv)
-                content = f"社員名簿を表示しました（部署フィルタ: {dept or '指定なし'}）。"
+                content = {"mode": ct.ANSWER_MODE_2, "answer": f"社員名簿を表示しました（部署フィルタ: {dept or '指定なし'}）。"}
             except Exception as e:
                 # エラーログの出力
                 logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}", exc_info=True)
@@ -533,12 +498,28 @@ if chat_message:
                 # 追加：詳細トレースをUIで展開表示
                 with st.expander("詳細エラーメッセージ（開発者向け）"):
                     st.code(traceback.format_exc())
-                content = "社員名簿の表示に失敗しました。"
+                content = {"mode": ct.ANSWER_MODE_2, "answer": "社員名簿の表示に失敗しました。"}
+        logger.info(app_logging.answer_event(content, ct.ANSWER_MODE_2, route="roster_table"))
         # 7-4. 会話ログへの追加（ここで終了）
         st.session_state.messages.append({"role": "user", "content": chat_message})
         st.session_state.messages.append({"role": "assistant", "content": content})
         st.stop()
 
+    # ==========================================
+    # 7-1.6. 社員名簿への人数・絞り込み・集計の質問（LLM・ネットワークを使わず表から回答）
+    # ==========================================
+    roster_answer = _answer_from_roster(chat_message)
+    if roster_answer is not None:
+        with st.chat_message("assistant"):
+            st.markdown(roster_answer.text)
+            if roster_answer.table is not None and len(roster_answer.table):
+                st.dataframe(roster_answer.table, use_container_width=True, hide_index=True)
+        content = {"mode": ct.ANSWER_MODE_2, "answer": roster_answer.text}
+        logger.info(app_logging.answer_event(content, ct.ANSWER_MODE_2, route="roster_query"))
+        st.session_state.messages.append({"role": "user", "content": chat_message})
+        st.session_state.messages.append({"role": "assistant", "content": content})
+        st.stop()
+
     # ==========================================
     # 7-2. LLMからの回答取得
     # ==========================================
@@ -555,10 +536,8 @@ if chat_message:
             # 画面読み込み時に作成したRetrieverを使い、Chainを実行
 
             # ★ 追加: 遅延初期化（429回避・既存ベクターストア優先）
-            llm_response = utils.get_llm_response(chat_message, mode=auto_mode)
-
-            # ★ 追加：生レスポンスのデバッグ表示
-            _debug_dump_llm_response(llm_response)
+            # ★ 検索までをスピナー中に行い、回答本文は下でトークン単位に逐次表示する
+            answer_stream = utils.stream_llm_response(chat_message, mode=auto_mode)
         except Exception as e:
             # エラーログの出力
             logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}", exc_info=True)
@@ -574,26 +553,34 @@ if chat_message:
     # 7-3. LLMからの回答表示
     # ==========================================
     with st.chat_message("assistant"):
+        llm_response = None
         try:
+            # 回答本文をストリーミング表示（読み切った時点で履歴にも追加される）
+            st.write_stream(answer_stream.tokens())
+            llm_response = answer_stream.to_response()
+
+            # ★ 追加：生レスポンスのデバッグ表示
+            _debug_dump_llm_response(llm_response)
+
             # ==========================================
             # モードが「社内文書検索」の場合（★ auto_mode で分岐）
             # ==========================================
             if auto_mode == ct.ANSWER_MODE_1:
                 # 入力内容と関連性が高い社内文書のありかを表示
-                content = cn.display_search_llm_response(llm_response)
+                content = cn.display_search_llm_response(llm_response, render_answer=False)
 
             # ==========================================
             # モードが「社内問い合わせ」の場合
             # ==========================================
             elif auto_mode == ct.ANSWER_MODE_2:
                 # 入力に対しての回答と、参照した文書のありかを表示
-                content = cn.display_contact_llm_response(llm_response)
+                content = cn.display_contact_llm_response(llm_response, render_answer=False)
             else:
                 # 未知値の保険（現状到達しない想定）
                 content = {"mode": st.session_state.mode, "answer": "モード判定に失敗しました。"}
 
-            # AIメッセージのログ出力（★ 実際に処理した auto_mode で記録）
-            logger.info({"message": content, "application_mode": auto_mode})
+            # AIメッセージのログ出力（★ 実際に処理した auto_mode で記録。trace_id で段ごとの記録と突き合わせる）
+            logger.info(app_logging.answer_event(content, auto_mode, route="rag", trace_id=getattr(answer_stream.trace, "id", None)))
         except Exception as e:
             # エラーログの出力
             logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}", exc_info=True)
@@ -604,7 +591,7 @@ if chat_message:
                 st.code(traceback.format_exc())
             # ★ フォールバック描画に切替（components.py 側の想定とズレても最低限は表示）
             st.info("一時的にフォールバック表示（簡易レンダリング）で回答を表示します。")
-            content = _render_fallback(llm_response)
+            content = _render_fallback(llm_response or answer_stream.to_response())
             # ★★★ 追記（ここから）: フォールバックをログ再描画互換の dict 形式にラップ
             if isinstance(content, str):
                 if auto_mode == ct.ANSWER_MODE_1:
@@ -613,7 +600,7 @@ if chat_message:
                     content = {"mode": ct.ANSWER_MODE_2, "answer": content}
             # ★★★ 追記（ここまで） 
             # AIメッセージのログ出力（フォールバック）
-            logger.info({"message": content, "application_mode": auto_mode})
+            logger.info(app_logging.answer_event(content, auto_mode, route="fallback", trace_id=getattr(answer_stream.trace, "id", None)))
             # stop() はしない（以降のログ追加まで進める）
 
 
@@ -624,3 +611,5 @@ if chat_message:
     st.session_state.messages.append({"role": "user", "content": chat_message})
     # 表示用の会話ログにAIメッセージを追加
     st.session_state.messages.append({"role": "assistant", "content": content})
+    # サイドバーの処理時間の内訳を今回のリクエストで更新
+    _render_trace_panel()
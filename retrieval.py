@@ -0,0 +1,331 @@
+"""
+このファイルは、検索（リトリーブ）まわりの部品を定義するファイルです。
+ベクトル検索（Chroma）とキーワード検索（BM25）を同時に実行し、
+Reciprocal Rank Fusion（RRF）で1つの順位に統合するハイブリッド検索を提供します。
+検索全体の締め切りと段ごとの持ち時間（Deadline）もここで扱います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextvars import ContextVar, copy_context
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, TypeVar
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+
+import constants as ct
+import tracing
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# 各リトリーバを並行に呼ぶためのスレッドプール（プロセス共有）
+_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+T = TypeVar("T")
+
+
+############################################################
+# 締め切り・段ごとの持ち時間
+############################################################
+class Deadline:
+    """
+    検索全体の締め切り。各段は min(段の持ち時間, 締め切りまでの残り) だけ待つ。
+    seconds が None / 0 以下なら締め切りなし（段の持ち時間だけが効く）。
+    """
+
+    def __init__(self, seconds: Optional[float] = None, budgets: Optional[Dict[str, float]] = None) -> None:
+        self.expires_at = time.monotonic() + seconds if seconds and seconds > 0 else None
+        self.budgets = dict(budgets or {})
+
+    @classmethod
+    def from_constants(cls) -> "Deadline":
+        return cls(getattr(ct, "RETRIEVAL_DEADLINE_SEC", None), getattr(ct, "RETRIEVAL_STAGE_BUDGETS", None))
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def timeout_for(self, stage: str) -> Optional[float]:
+        """段 stage に使える秒数（None は無制限）"""
+        limits = [t for t in (self.budgets.get(stage), self.remaining()) if t is not None]
+        return min(limits) if limits else None
+
+
+# 実行中のリクエストの締め切り（asyncio のタスクには自動で引き継がれる）
+_CURRENT_DEADLINE: ContextVar[Optional[Deadline]] = ContextVar("retrieval_deadline", default=None)
+
+
+def set_deadline(deadline: Optional[Deadline]):
+    """以降の検索に締め切りを適用する（戻り値のトークンで reset_deadline できる）"""
+    return _CURRENT_DEADLINE.set(deadline)
+
+
+def reset_deadline(token) -> None:
+    _CURRENT_DEADLINE.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _CURRENT_DEADLINE.get()
+
+
+async def run_stage(stage: str, aw: Awaitable[T], default: T, deadline: Optional[Deadline] = None) -> T:
+    """
+    段 aw を持ち時間内だけ待つ。時間切れ・締め切り済みなら取り消して default を返す。
+    （スレッドで動いている同期処理は止められないが、結果を待たずに先へ進む）
+    """
+    deadline = deadline or current_deadline()
+    timeout = deadline.timeout_for(stage) if deadline else None
+    if timeout is not None and timeout <= 0:
+        if asyncio.iscoroutine(aw):
+            aw.close()
+        elif isinstance(aw, asyncio.Future):
+            aw.cancel()
+        logger.info(f"retrieval stage skipped (deadline reached): {stage}")
+        tracing.fallback(f"{stage}_skipped")
+        return default
+    try:
+        return await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"retrieval stage timed out: {stage} ({timeout:.2f}s)")
+        tracing.fallback(f"{stage}_timeout")
+        return default
+
+
+############################################################
+# 順位統合
+############################################################
+def doc_key(d) -> tuple:
+    """同一チャンク判定用のキー（ファイル・ページ・本文）"""
+    meta = getattr(d, "metadata", None) or {}
+    return (meta.get("source"), meta.get("page"), getattr(d, "page_content", str(d)))
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[Sequence[Document]],
+    weights: Sequence[float],
+    *,
+    limit: int,
+    rrf_k: int = 60,
+) -> List[Document]:
+    """
+    score(d) = Σ weight_i / (rrf_k + rank_i(d)) で統合し、上位 limit 件を返す。
+    スコアの尺度が違う検索結果でも順位だけで公平に混ぜられる。
+    """
+    scores: Dict[tuple, float] = {}
+    first_seen: Dict[tuple, Document] = {}
+    for docs, w in zip(ranked_lists, weights):
+        for rank, d in enumerate(docs, start=1):
+            key = doc_key(d)
+            scores[key] = scores.get(key, 0.0) + w / (rrf_k + rank)
+            first_seen.setdefault(key, d)
+    ordered = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [first_seen[key] for key in ordered[:limit]]
+
+
+############################################################
+# 検索条件（呼び出しごとに指定）
+############################################################
+def metadata_matches(meta: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+    """
+    Chroma の where 句と同じ書式のフィルタをメタデータに当てる（キーワード検索側で使用）。
+    対応: 値の一致 / $eq / $ne / $in / $nin / $and / $or
+    """
+    if not flt:
+        return True
+    for key, cond in flt.items():
+        if key == "$and":
+            ok = all(metadata_matches(meta, c) for c in cond)
+        elif key == "$or":
+            ok = any(metadata_matches(meta, c) for c in cond)
+        elif isinstance(cond, dict):
+            value = meta.get(key)
+            ok = all(
+                (op == "$eq" and value == arg)
+                or (op == "$ne" and value != arg)
+                or (op == "$in" and value in arg)
+                or (op == "$nin" and value not in arg)
+                for op, arg in cond.items()
+            )
+        else:
+            ok = meta.get(key) == cond
+        if not ok:
+            return False
+    return True
+
+
+class DenseRetriever(BaseRetriever):
+    """
+    ベクトルストア（Chroma）を引くリトリーバ。
+    k / filter / score_threshold は invoke(query, k=..., filter=...) で呼び出しごとに上書きでき、
+    共有しているインスタンスの設定は書き換えない（複数セッション・スレッドから同時に呼べる）。
+    """
+
+    vectorstore: Any
+    k: int = 5
+    filter: Optional[Dict[str, Any]] = None
+    score_threshold: Optional[float] = None
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        score_threshold: Optional[float] = None,
+    ) -> List[Document]:
+        k = k or self.k
+        flt = self.filter if filter is None else filter
+        threshold = self.score_threshold if score_threshold is None else score_threshold
+        if threshold is None:
+            return self.vectorstore.similarity_search(query, k=k, filter=flt)
+        pairs = self.vectorstore.similarity_search_with_relevance_scores(
+            query, k=k, filter=flt, score_threshold=threshold
+        )
+        return [d for d, _ in pairs]
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        score_threshold: Optional[float] = None,
+    ) -> List[Document]:
+        # Chroma のクライアントは同期のみのため、スレッドで実行する
+        return await run_in_executor(
+            None,
+            self._get_relevant_documents,
+            query,
+            run_manager=run_manager.get_sync(),
+            k=k,
+            filter=filter,
+            score_threshold=score_threshold,
+        )
+
+
+############################################################
+# ハイブリッド検索
+############################################################
+def _safe_invoke(stage: str, retriever, query: str, **kwargs) -> List[Document]:
+    with tracing.span(stage) as sp:
+        try:
+            docs = retriever.invoke(query, **kwargs) or []
+        except Exception as e:
+            logger.warning(f"retriever failed: {type(retriever).__name__}: {type(e).__name__}: {e}")
+            tracing.fallback(f"{stage}_error")
+            docs = []
+        sp.set(chunks=len(docs))
+        return docs
+
+
+async def _asafe_invoke(stage: str, retriever, query: str, **kwargs) -> List[Document]:
+    with tracing.span(stage) as sp:
+        try:
+            docs = await retriever.ainvoke(query, **kwargs) or []
+        except Exception as e:
+            logger.warning(f"retriever failed: {type(retriever).__name__}: {type(e).__name__}: {e}")
+            tracing.fallback(f"{stage}_error")
+            docs = []
+        sp.set(chunks=len(docs))
+        return docs
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    dense（ベクトル）と sparse（キーワード）を同時に検索して RRF で統合する。
+    片方が失敗・0件・持ち時間切れでも、もう片方の結果だけで返す。
+    k / filter / score_threshold は呼び出しごとに指定でき、各リトリーバへそのまま渡す。
+    """
+
+    dense: Optional[Any] = None
+    sparse: Optional[Any] = None
+    k: int = 5
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+    rrf_k: int = 60
+
+    def _members(self) -> List[tuple]:
+        """(段の名前, リトリーバ, 重み)"""
+        sides = (("dense", self.dense, self.dense_weight), ("sparse", self.sparse, self.sparse_weight))
+        return [(name, r, w) for name, r, w in sides if r is not None]
+
+    @staticmethod
+    def _side_kwargs(stage: str, r, k, filter, score_threshold) -> Dict[str, Any]:
+        """
+        呼び出しごとの条件を各リトリーバ向けに変換する。
+        k が候補数より大きいときだけ候補を広げ、score_threshold は尺度が揃う dense 側だけに渡す。
+        """
+        kw: Dict[str, Any] = {}
+        if k is not None:
+            kw["k"] = max(k, getattr(r, "k", 0) or 0)
+        if filter is not None:
+            kw["filter"] = filter
+        if score_threshold is not None and stage == "dense":
+            kw["score_threshold"] = score_threshold
+        return kw
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        score_threshold: Optional[float] = None,
+    ) -> List[Document]:
+        members = self._members()
+        deadline = current_deadline()
+        # スレッドにも呼び出し元のコンテキスト（締め切り・トレース）を引き継ぐ
+        futures = [
+            _EXECUTOR.submit(
+                copy_context().run, _safe_invoke, stage, r, query,
+                **self._side_kwargs(stage, r, k, filter, score_threshold),
+            )
+            for stage, r, _ in members
+        ]
+        # 各段の持ち時間は同時に始まった時点から数える
+        started = time.monotonic()
+        limits = [deadline.timeout_for(stage) if deadline else None for stage, _, _ in members]
+        ranked: List[List[Document]] = []
+        for (stage, _, _), f, limit in zip(members, futures, limits):
+            timeout = None if limit is None else max(0.0, started + limit - time.monotonic())
+            try:
+                ranked.append(f.result(timeout=timeout))
+            except FutureTimeout:
+                logger.warning(f"retrieval stage timed out: {stage} ({timeout:.2f}s)")
+                tracing.fallback(f"{stage}_timeout")
+                ranked.append([])
+        return reciprocal_rank_fusion(ranked, [w for _, _, w in members], limit=k or self.k, rrf_k=self.rrf_k)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None,
+        score_threshold: Optional[float] = None,
+    ) -> List[Document]:
+        # 片方が持ち時間を超えたら、間に合った側の結果だけで統合する
+        members = self._members()
+        ranked = await asyncio.gather(*(
+            run_stage(stage, _asafe_invoke(stage, r, query, **self._side_kwargs(stage, r, k, filter, score_threshold)), [])
+            for stage, r, _ in members
+        ))
+        return reciprocal_rank_fusion(ranked, [w for _, _, w in members], limit=k or self.k, rrf_k=self.rrf_k)
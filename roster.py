@@ -0,0 +1,222 @@
+"""
+このファイルは、社員名簿（STAFF_CSV）の読み込みと検索を担うファイルです。
+- ファイルは1回だけ読み、文字コードもその時に1回だけ判定する
+- 読み込んだ表はファイルの更新時刻をキーにプロセス内でキャッシュ（更新されれば自動で読み直し）
+- 部署 → 行番号の索引を事前に作り、部署での絞り込みは索引引きだけで済ませる
+- ダウンロード用の CSV / Excel は求められたときだけ作り、(名簿の版, 部署) ごとにキャッシュ
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import io
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import constants as ct
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# 部署列の候補（環境に合わせて増やしてOK）
+DEPT_COLUMNS = ("部署", "部門", "Department", "部署名", "所属部門", "配属", "部")
+
+
+class RosterError(RuntimeError):
+    """社員名簿を読み込めないときの例外"""
+
+
+############################################################
+# 文字コード判定
+############################################################
+def detect_encoding(raw: bytes) -> str:
+    """BOM → UTF-8 → chardet の推定 → CP932 の順に判定する"""
+    if raw.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    try:
+        raw.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        import chardet
+
+        guess = (chardet.detect(raw[:65536]) or {}).get("encoding")
+        if guess:
+            raw.decode(guess)
+            return guess
+    except Exception:
+        pass
+    return "cp932"
+
+
+############################################################
+# 名簿
+############################################################
+@dataclass(frozen=True, eq=False)
+class Roster:
+    """読み込み済みの社員名簿（読み取り専用で共有する。同一性＝同じ読み込み結果）"""
+
+    path: str
+    version: Tuple[int, int]  # (更新時刻 ns, サイズ)
+    encoding: str
+    df: pd.DataFrame
+    dept_col: Optional[str]
+    dept_index: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def departments(self) -> List[str]:
+        return list(self.dept_index)
+
+    def rows_for_dept(self, dept_query: Optional[str]) -> np.ndarray:
+        """
+        部署名に dept_query を含む行の位置（大文字小文字は区別しない）。
+        行ではなく部署名の一覧（数件〜数十件）だけを照合する。
+        """
+        if not dept_query or self.dept_col is None:
+            return np.arange(len(self.df))
+        q = dept_query.lower()
+        hits = [rows for name, rows in self.dept_index.items() if q in name.lower()]
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(hits))
+
+    def filter_dept(self, dept_query: Optional[str]) -> pd.DataFrame:
+        if not dept_query or self.dept_col is None:
+            return self.df
+        return self.df.iloc[self.rows_for_dept(dept_query)]
+
+
+def _find_dept_col(df: pd.DataFrame) -> Optional[str]:
+    col_map = {str(c): c for c in df.columns}
+    for name in DEPT_COLUMNS:
+        if name in col_map:
+            return col_map[name]
+    return None
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_roster(path: str, mtime_ns: int, size: int) -> Roster:
+    """
+    (パス, 更新時刻, サイズ) ごとに1回だけ読む。
+    ファイルが更新されるとキーが変わり、古いものは max_entries で追い出される。
+    """
+    raw = Path(path).read_bytes()
+    encoding = detect_encoding(raw)
+    try:
+        df = pd.read_csv(io.BytesIO(raw), encoding=encoding)
+    except Exception as e:
+        raise RosterError(f"社員名簿の読み込みに失敗しました（encoding: {encoding}）。\n{e}") from e
+
+    dept_col = _find_dept_col(df)
+    dept_index: Dict[str, np.ndarray] = {}
+    if dept_col is not None:
+        keys = df[dept_col].astype(str).to_numpy()
+        for name in pd.unique(keys):
+            dept_index[name] = np.flatnonzero(keys == name)
+    logger.info(f"roster loaded: {path} rows={len(df)} encoding={encoding} departments={len(dept_index)}")
+    return Roster(path=path, version=(mtime_ns, size), encoding=encoding, df=df, dept_col=dept_col, dept_index=dept_index)
+
+
+def get_roster(path: Optional[str] = None) -> Optional[Roster]:
+    """
+    社員名簿を返す（2回目以降はファイルの stat だけ）。ファイルが無ければ None。
+    Raises:
+        RosterError: ファイルはあるが読み込めないとき
+    """
+    p = Path(path or getattr(ct, "STAFF_CSV", "data/社員名簿.csv"))
+    try:
+        stat = p.stat()
+    except OSError:
+        return None
+    return _load_roster(str(p), stat.st_mtime_ns, stat.st_size)
+
+
+############################################################
+# ダウンロード用ファイル
+############################################################
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _export_bytes(path: str, version: Tuple[int, int], dept_query: Optional[str], fmt: str) -> bytes:
+    df = _load_roster(path, *version).filter_dept(dept_query)
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8-sig")
+    bio = io.BytesIO()
+    with pd.ExcelWriter(bio, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name="名簿")
+    return bio.getvalue()
+
+
+def export_bytes(staff: Roster, dept_query: Optional[str], fmt: str) -> bytes:
+    """
+    絞り込み結果を CSV（UTF-8 BOM 付き）/ Excel にする。
+    (ファイル, 版, 部署, 形式) ごとにキャッシュするため、同じ名簿・同じ部署なら2回目以降は作り直さない。
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported export format: {fmt}")
+    return _export_bytes(staff.path, staff.version, dept_query or None, fmt)
+
+
+############################################################
+# 名簿ファイルの自動検出
+############################################################
+def _score_csv(path: Path) -> int:
+    """先頭数行の列名とファイル名から、社員名簿らしさを点数化"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(8192)
+        df = pd.read_csv(io.BytesIO(head), nrows=5, encoding=detect_encoding(head))
+    except Exception:
+        return 0
+    cols = set(map(str, df.columns))
+    pts = 0
+    for k in ("氏名", "名前", "従業員名", "社員名", "FullName", "Name"):
+        if k in cols:
+            pts += 2
+    for k in ("部署", "部門", "部署名", "Department"):
+        if k in cols:
+            pts += 3
+    for k in ("社員番号", "従業員番号", "EmployeeID", "ID"):
+        if k in cols:
+            pts += 1
+    if any(s in path.stem for s in ("名簿", "社員", "従業員", "staff", "employee")):
+        pts += 2
+    return pts
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _scan_staff_csv(signature: Tuple[Tuple[str, int], ...]) -> Optional[str]:
+    """data/ 配下の CSV を採点して最も名簿らしいものを返す（CSV の構成が変わるまで再採点しない）"""
+    scored = [(pts, path) for path, _ in signature if (pts := _score_csv(Path(path))) > 0]
+    if not scored:
+        return None
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[0][1]
+
+
+def find_staff_csv(default_path: str = "data/社員名簿.csv") -> Optional[str]:
+    """STAFF_CSV → 既定パス → data/ 配下の自動検出 の順に名簿ファイルを探す"""
+    for candidate in (getattr(ct, "STAFF_CSV", None), default_path):
+        if candidate and Path(candidate).exists():
+            return str(candidate)
+
+    data_dir = Path(getattr(ct, "DATA_DIR", "data"))
+    if not data_dir.exists():
+        return None
+    signature = tuple(sorted((str(c), c.stat().st_mtime_ns) for c in data_dir.rglob("*.csv")))
+    return _scan_staff_csv(signature)
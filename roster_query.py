@@ -0,0 +1,313 @@
+"""
+このファイルは、社員名簿への質問（人数・絞り込み・集計）を LLM を使わずに答えるファイルです。
+- 質問文から「条件（部署・役職・入社時期・年齢・スキルなど）」と「操作（件数/一覧/〇〇ごとの集計）」を読み取る
+- 名簿の実際の値（部署名・役職名・スキル名など）を辞書にして照合するので、名簿が変われば自動で追従
+- 読み取れない質問は None を返し、呼び出し側は通常の RAG に回す
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import constants as ct
+import roster as roster_mod
+
+
+# 単一値の列（照合の優先順。同じ語が複数の列に現れたら、質問で列名に触れている列 → 先の列）
+CATEGORICAL_COLUMNS = ("部署", "役職", "従業員区分", "性別", "大学名", "学部・学科")
+# カンマ区切りで複数の値を持つ列
+MULTI_VALUE_COLUMNS = ("スキルセット", "保有資格")
+JOIN_DATE_COLUMN = "入社日"
+AGE_COLUMN = "年齢"
+# 「〇〇ごと / 〇〇別」の語 → 集計する列
+GROUP_BY_WORDS = {
+    "部署": "部署",
+    "部門": "部署",
+    "役職": "役職",
+    "性別": "性別",
+    "従業員区分": "従業員区分",
+    "雇用形態": "従業員区分",
+    "区分": "従業員区分",
+    "大学": "大学名",
+    "学部": "学部・学科",
+    "入社年": JOIN_DATE_COLUMN,
+}
+# 名簿に関する質問であることを示す語（これが無ければ名簿の質問とみなさない）
+#   「人の」「人は」だけでは主語にしない（「営業部の人の業務内容」は文書の質問）
+_SUBJECT = re.compile(r"社員|従業員|スタッフ|メンバー|何人|何名|人数|誰|だれ|どなた|在籍|所属|入社|名前|氏名")
+_COUNT = re.compile(r"何人|何名|人数|人いる|名いる|件数|いくつ|数は|数を")
+# 一覧は「人」を尋ねているときだけ（一般的な「教えて」だけでは一覧にしない）
+_LIST = re.compile(r"一覧|リスト|誰|だれ|どなた|名前|氏名|メンバー|顔ぶれ")
+# 「社員を表示して」「Python ができる人を教えて」のように、人そのものが目的語のもの
+_SHOW = re.compile(r"(?:社員|従業員|スタッフ|人)(?:たち|達)?(?:を|は)(?:表示|見せて|出して|挙げて|教えて|抽出)")
+_GROUP = re.compile("(" + "|".join(sorted(GROUP_BY_WORDS, key=len, reverse=True)) + r")\s*(?:ごと|毎|別)")
+_JOIN = re.compile(r"(\d{4})\s*年\s*(?:(\d{1,2})\s*月)?\s*(以降|以後|から|より後|よりあと|以前|まで|より前|よりまえ)?")
+_AGE = re.compile(r"(\d{2})\s*(?:歳|才)\s*(以上|以下|未満|より上|より下|超)")
+_AGE_DECADE = re.compile(r"(\d)0\s*代")
+# 役職「スタッフ」のように主語と同じ語は、列名に触れているときだけ条件とみなす
+_SUBJECT_WORDS = ("社員", "従業員", "スタッフ", "メンバー")
+# 名簿の質問に出てくる、条件・操作以外の語（これらと名簿の値・助詞を除いて語が残れば、文書の質問とみなす）
+_FILLER_WORDS = (
+    "社員", "従業員", "スタッフ", "メンバー", "人数", "何人", "何名", "件数", "総数", "合計", "全員", "全部", "全体",
+    "一覧", "リスト", "名前", "氏名", "顔ぶれ", "誰", "在籍", "所属", "入社", "年齢", "以上", "以下", "未満",
+    "以降", "以後", "以前", "現在", "社内", "当社", "弊社", "会社", "出身", "卒業", "卒", "資格", "スキル", "保有",
+    "表示", "抽出", "見せて", "出して", "挙げて",
+    "教えて", "知りたい", "下さい", "人", "名", "方", "者", "達", "数", "歳", "才", "代", "年", "月", "後", "前",
+    "今", "全", "何", "別", "毎", "超", "持", "働", "勤務",
+)
+# 残った文字のうち、内容語とみなすもの（漢字・カタカナ・英字）
+_CONTENT_CHAR = re.compile(r"[一-鿿ァ-ヺーa-z]")
+
+
+############################################################
+# 照合用の辞書
+############################################################
+@dataclass(frozen=True, eq=False)
+class _Vocabulary:
+    categorical: Dict[str, Dict[str, np.ndarray]]   # 列 → 値 → 行位置
+    multi: Dict[str, Dict[str, np.ndarray]]         # 列 → 要素 → 行位置
+    join_dates: Optional[np.ndarray]                # datetime64[D]
+    ages: Optional[np.ndarray]
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", str(text or "")).lower()
+
+
+@lru_cache(maxsize=4)
+def _vocabulary(staff: roster_mod.Roster) -> _Vocabulary:
+    """名簿1つにつき1回だけ作る（Roster は読み込みごとに別オブジェクト）"""
+    df = staff.df
+    categorical: Dict[str, Dict[str, np.ndarray]] = {}
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            keys = df[col].astype(str).to_numpy()
+            categorical[col] = {v: np.flatnonzero(keys == v) for v in pd.unique(keys) if v and v != "nan"}
+    multi: Dict[str, Dict[str, np.ndarray]] = {}
+    for col in MULTI_VALUE_COLUMNS:
+        if col in df.columns:
+            items: Dict[str, List[int]] = {}
+            for i, cell in enumerate(df[col].fillna("").astype(str)):
+                for item in (s.strip() for s in cell.split(",")):
+                    if len(item) >= 2:
+                        items.setdefault(item, []).append(i)
+            multi[col] = {k: np.asarray(v) for k, v in items.items()}
+    join_dates = None
+    if JOIN_DATE_COLUMN in df.columns:
+        join_dates = pd.to_datetime(df[JOIN_DATE_COLUMN], errors="coerce").to_numpy(dtype="datetime64[D]")
+    ages = pd.to_numeric(df[AGE_COLUMN], errors="coerce").to_numpy() if AGE_COLUMN in df.columns else None
+    return _Vocabulary(categorical, multi, join_dates, ages)
+
+
+def _aliases(col: str, value: str) -> List[str]:
+    """「営業部」は「営業」でも当たるようにする"""
+    out = [_normalize(value)]
+    if col == "部署" and value.endswith("部") and len(value) > 2:
+        out.append(_normalize(value[:-1]))
+    return out
+
+
+############################################################
+# 質問の解釈
+############################################################
+@dataclass
+class RosterQuery:
+    """解釈結果。mask は条件に合う行、labels は条件の説明"""
+
+    op: str                                # "count" | "list" | "group"
+    mask: np.ndarray
+    labels: List[str] = field(default_factory=list)
+    group_by: Optional[str] = None
+
+
+def _match_categorical(q: str, vocab: _Vocabulary, n: int) -> Tuple[np.ndarray, List[str]]:
+    # 質問中の語ごとに、どの列の値として扱うかを決める（同じ列の複数の値は OR、列どうしは AND）
+    owner: Dict[str, Tuple[str, str]] = {}
+    for col, values in vocab.categorical.items():
+        col_named = _normalize(col) in q
+        for value in values:
+            if value in _SUBJECT_WORDS and not col_named:
+                continue
+            for alias in _aliases(col, value):
+                if alias in q:
+                    prev = owner.get(alias)
+                    if prev is None or (col_named and _normalize(prev[0]) not in q):
+                        owner[alias] = (col, value)
+                    break
+    by_col: Dict[str, List[str]] = {}
+    for col, value in owner.values():
+        if value not in by_col.setdefault(col, []):
+            by_col[col].append(value)
+
+    mask = np.ones(n, dtype=bool)
+    labels: List[str] = []
+    for col, hits in by_col.items():
+        col_mask = np.zeros(n, dtype=bool)
+        col_mask[np.concatenate([vocab.categorical[col][v] for v in hits])] = True
+        mask &= col_mask
+        labels.append(f"{col}: {'・'.join(hits)}")
+    return mask, labels
+
+
+def _match_multi(q: str, vocab: _Vocabulary, n: int) -> Tuple[np.ndarray, List[str]]:
+    mask = np.ones(n, dtype=bool)
+    labels: List[str] = []
+    for col, items in vocab.multi.items():
+        hits = [item for item in items if _normalize(item) in q]
+        # 「Java」と「JavaScript」のように包含関係にある語は長い方だけ使う
+        hits = [h for h in hits if not any(h != o and _normalize(h) in _normalize(o) for o in hits)]
+        for item in hits:
+            col_mask = np.zeros(n, dtype=bool)
+            col_mask[items[item]] = True
+            mask &= col_mask
+            labels.append(f"{col}: {item}")
+    return mask, labels
+
+
+def _match_join_date(q: str, vocab: _Vocabulary, n: int) -> Tuple[np.ndarray, List[str]]:
+    if vocab.join_dates is None or "入社" not in q:
+        return np.ones(n, dtype=bool), []
+    m = _JOIN.search(q)
+    if not m:
+        return np.ones(n, dtype=bool), []
+    year, month, rel = int(m.group(1)), m.group(2), m.group(3)
+    start = np.datetime64(f"{year:04d}-{int(month):02d}" if month else f"{year:04d}", "D")
+    end = (np.datetime64(f"{year:04d}-{int(month):02d}", "M") + 1 if month else np.datetime64(f"{year + 1:04d}", "Y")).astype("datetime64[D]")
+    dates = vocab.join_dates
+    period = f"{year}年{int(month)}月" if month else f"{year}年"
+    if rel in ("以降", "以後", "から"):
+        return dates >= start, [f"入社: {period}以降"]
+    if rel in ("より後", "よりあと"):
+        return dates >= end, [f"入社: {period}より後"]
+    if rel in ("以前", "まで"):
+        return dates < end, [f"入社: {period}以前"]
+    if rel in ("より前", "よりまえ"):
+        return dates < start, [f"入社: {period}より前"]
+    return (dates >= start) & (dates < end), [f"入社: {period}"]
+
+
+def _match_age(q: str, vocab: _Vocabulary, n: int) -> Tuple[np.ndarray, List[str]]:
+    if vocab.ages is None:
+        return np.ones(n, dtype=bool), []
+    ages = vocab.ages
+    m = _AGE.search(q)
+    if m:
+        x, rel = int(m.group(1)), m.group(2)
+        ops = {"以上": ages >= x, "以下": ages <= x, "未満": ages < x, "より下": ages < x, "より上": ages > x, "超": ages > x}
+        return ops[rel], [f"年齢: {x}歳{rel}"]
+    m = _AGE_DECADE.search(q)
+    if m:
+        lo = int(m.group(1)) * 10
+        return (ages >= lo) & (ages < lo + 10), [f"年齢: {lo}代"]
+    return np.ones(n, dtype=bool), []
+
+
+def _has_residual_content(q: str, vocab: _Vocabulary) -> bool:
+    """
+    名簿の値・列名・条件の表現・名簿の質問で使う語を除いても語（計画・業務・役割など）が残るか。
+    残る場合は、名簿の値を含んでいても文書の内容を尋ねている（「営業部の人の業務内容を教えて」）。
+    """
+    terms = {_normalize(col) for col in (*vocab.categorical, *vocab.multi, JOIN_DATE_COLUMN, AGE_COLUMN)}
+    terms.update(GROUP_BY_WORDS)
+    for col, values in vocab.categorical.items():
+        for value in values:
+            terms.update(a for a in _aliases(col, value) if a in q)
+    for items in vocab.multi.values():
+        terms.update(_normalize(item) for item in items if _normalize(item) in q)
+    terms.update(_FILLER_WORDS)
+    rest = q
+    for pattern in (_JOIN, _AGE, _AGE_DECADE, _GROUP):
+        rest = pattern.sub(" ", rest)
+    for term in sorted((t for t in terms if t), key=len, reverse=True):
+        rest = rest.replace(term, " ")
+    return bool(_CONTENT_CHAR.search(rest))
+
+
+def parse(question: str, staff: roster_mod.Roster) -> Optional[RosterQuery]:
+    """
+    名簿への質問として解釈できれば RosterQuery、できなければ None。
+    文書の内容を尋ねる質問（方針・制度・業務内容など）は名簿の値を含んでいても None にする。
+    """
+    q = _normalize(question)
+    if not q or not (_SUBJECT.search(q) or _SHOW.search(q)):
+        return None
+    if any(w in q for w in getattr(ct, "ROSTER_QUERY_STOPWORDS", ())):
+        return None
+
+    vocab = _vocabulary(staff)
+    n = len(staff.df)
+    mask = np.ones(n, dtype=bool)
+    labels: List[str] = []
+    for matcher in (_match_categorical, _match_multi, _match_join_date, _match_age):
+        m, lab = matcher(q, vocab, n)
+        mask &= m
+        labels += lab
+
+    g = _GROUP.search(q)
+    group_by = GROUP_BY_WORDS[g.group(1)] if g else None
+    if group_by is not None and group_by != JOIN_DATE_COLUMN and group_by not in staff.df.columns:
+        group_by = None
+
+    if group_by is not None:
+        op = "group"
+    elif _COUNT.search(q):
+        op = "count"
+    elif (_LIST.search(q) or _SHOW.search(q)) and labels:
+        op = "list"
+    else:
+        return None
+    if _has_residual_content(q, vocab):
+        return None
+    return RosterQuery(op=op, mask=mask, labels=labels, group_by=group_by)
+
+
+############################################################
+# 実行
+############################################################
+@dataclass(frozen=True)
+class RosterAnswer:
+    text: str
+    table: Optional[pd.DataFrame]
+    query: RosterQuery
+
+
+def execute(query: RosterQuery, staff: roster_mod.Roster) -> RosterAnswer:
+    df = staff.df[query.mask]
+    cond = "、".join(query.labels)
+    subject = f"条件（{cond}）に該当する社員" if cond else "社員"
+
+    if query.op == "group":
+        if query.group_by == JOIN_DATE_COLUMN:
+            key = pd.to_datetime(df[JOIN_DATE_COLUMN], errors="coerce").dt.year.rename("入社年")
+            label = "入社年"
+        else:
+            key, label = df[query.group_by], query.group_by
+        table = key.value_counts().rename_axis(label).reset_index(name="人数")
+        if label == "入社年":
+            table = table.sort_values(label).reset_index(drop=True)
+        text = f"{subject}の{label}ごとの人数です（合計 {len(df)} 人）。"
+        return RosterAnswer(text, table, query)
+
+    if query.op == "count":
+        return RosterAnswer(f"{subject}は {len(df)} 人です。", df, query)
+
+    text = f"{subject}は {len(df)} 人です。一覧を表示します。" if len(df) else f"{subject}は見つかりませんでした。"
+    return RosterAnswer(text, df, query)
+
+
+def answer(question: str, staff: Optional[roster_mod.Roster]) -> Optional[RosterAnswer]:
+    """名簿で答えられる質問なら回答、そうでなければ None（RAG に回す）"""
+    if staff is None:
+        return None
+    query = parse(question, staff)
+    return execute(query, staff) if query is not None else None
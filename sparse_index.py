@@ -0,0 +1,272 @@
+"""
+このファイルは、日本語向けのキーワード検索（疎ベクトル索引）を定義するファイルです。
+- 全角/半角・大文字/小文字を NFKC で正規化し、文字 2-gram / 3-gram に分割（分かち書き不要）
+- 転置リスト（語 × チャンク）を BM25 の重み込みで scipy の CSR 行列として保持
+- 検索はクエリ語の行を取り出して足し合わせるだけ（NumPy のベクトル演算）
+- 索引はディスクに保存し、起動時は mmap で開くだけ（複数プロセスで同じページを共有）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import os
+import re
+import json
+import shutil
+import logging
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import constants as ct
+import retrieval
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+_SPACES = re.compile(r"\s+")
+
+# 保存形式の版（形式を変えたら上げる）
+FORMAT_VERSION = 1
+_CURRENT_FILE = "CURRENT"
+
+
+############################################################
+# 正規化・トークン化
+############################################################
+def normalize_text(text: str) -> str:
+    """全角英数→半角、半角カナ→全角などを NFKC で揃え、小文字化"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text: str, ngram_range: Optional[Tuple[int, int]] = None) -> List[str]:
+    """
+    空白で区切った各区間から文字 n-gram を作る。
+    区間が n より短い場合はその区間全体を1語とする（「IT」「人事」なども拾う）。
+    """
+    lo, hi = ngram_range or getattr(ct, "SPARSE_NGRAM_RANGE", (2, 3))
+    tokens: List[str] = []
+    for run in _SPACES.split(normalize_text(text)):
+        if not run:
+            continue
+        if len(run) < lo:
+            tokens.append(run)
+            continue
+        for n in range(lo, hi + 1):
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+############################################################
+# 索引
+############################################################
+class SparseIndex:
+    """
+    BM25 の重みを事前計算した転置索引。
+    postings は (語数 × チャンク数) の CSR 行列で、行 = 語の転置リスト。
+    """
+
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        postings: sparse.csr_matrix,
+        doc_lengths: np.ndarray,
+        chunk_ids: List[str],
+        docs: List[Document],
+    ) -> None:
+        self.vocab = vocab
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.chunk_ids = chunk_ids
+        self.docs = docs
+
+    @classmethod
+    def build(
+        cls,
+        docs: Sequence[Document],
+        chunk_ids: Optional[Sequence[str]] = None,
+        *,
+        k1: Optional[float] = None,
+        b: Optional[float] = None,
+    ) -> "SparseIndex":
+        k1 = getattr(ct, "SPARSE_BM25_K1", 1.5) if k1 is None else k1
+        b = getattr(ct, "SPARSE_BM25_B", 0.75) if b is None else b
+
+        vocab: Dict[str, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        tfs: List[int] = []
+        lengths = np.zeros(len(docs), dtype=np.float32)
+        for j, d in enumerate(docs):
+            counts = Counter(tokenize(d.page_content))
+            lengths[j] = sum(counts.values())
+            for term, tf in counts.items():
+                rows.append(vocab.setdefault(term, len(vocab)))
+                cols.append(j)
+                tfs.append(tf)
+
+        n_docs = len(docs)
+        tf_arr = np.asarray(tfs, dtype=np.float32)
+        col_arr = np.asarray(cols, dtype=np.int32)
+        row_arr = np.asarray(rows, dtype=np.int32)
+
+        # BM25: idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+        df = np.bincount(row_arr, minlength=len(vocab)).astype(np.float32)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        avgdl = float(lengths.mean()) if n_docs else 0.0
+        norm = k1 * (1 - b + b * lengths[col_arr] / (avgdl or 1.0))
+        weights = idf[row_arr] * tf_arr * (k1 + 1) / (tf_arr + norm)
+
+        postings = sparse.csr_matrix(
+            (weights.astype(np.float32), (row_arr, col_arr)),
+            shape=(len(vocab), n_docs),
+        )
+        ids = list(chunk_ids) if chunk_ids is not None else [str(i) for i in range(n_docs)]
+        return cls(vocab, postings, lengths, ids, list(docs))
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    # ------------------------------------------------------------
+    # 保存・読み込み
+    # ------------------------------------------------------------
+    def save(self, root: str, signature: str) -> Path:
+        """
+        root/<signature 先頭16桁>/ に保存し、CURRENT をその版に向ける。
+        読み込み中の別プロセスがあっても壊れないよう、版ごとに別ディレクトリへ書く。
+        """
+        root_path = Path(root)
+        target = root_path / signature[:16]
+        tmp = root_path / f".{signature[:16]}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        csr = self.postings.tocsr()
+        np.save(tmp / "postings_data.npy", csr.data.astype(np.float32, copy=False))
+        # indices と indptr は scipy が選んだ同じ整数型のまま保存する（読み込み時の型変換コピーを避ける）
+        np.save(tmp / "postings_indices.npy", csr.indices)
+        np.save(tmp / "postings_indptr.npy", csr.indptr)
+        np.save(tmp / "doc_lengths.npy", self.doc_lengths.astype(np.float32, copy=False))
+
+        terms = [""] * len(self.vocab)
+        for term, row in self.vocab.items():
+            terms[row] = term
+        (tmp / "vocab.json").write_text(json.dumps(terms, ensure_ascii=False), encoding="utf-8")
+        with open(tmp / "chunks.jsonl", "w", encoding="utf-8") as f:
+            for cid, d in zip(self.chunk_ids, self.docs):
+                f.write(json.dumps({"id": cid, "text": d.page_content, "metadata": d.metadata}, ensure_ascii=False) + "\n")
+        (tmp / "meta.json").write_text(json.dumps({
+            "version": FORMAT_VERSION,
+            "signature": signature,
+            "shape": list(csr.shape),
+        }), encoding="utf-8")
+
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+        current = root_path / _CURRENT_FILE
+        (root_path / f"{_CURRENT_FILE}.tmp").write_text(target.name, encoding="utf-8")
+        os.replace(root_path / f"{_CURRENT_FILE}.tmp", current)
+
+        # 古い版は消せるものだけ消す（他プロセスが mmap 中なら次回に回す）
+        for old in root_path.iterdir():
+            if old.is_dir() and old.name != target.name and not old.name.startswith("."):
+                shutil.rmtree(old, ignore_errors=True)
+        return target
+
+    @classmethod
+    def load(cls, root: str, signature: str) -> Optional["SparseIndex"]:
+        """signature が一致する保存済み索引を mmap で開く。無い・古い・壊れている場合は None"""
+        root_path = Path(root)
+        try:
+            target = root_path / (root_path / _CURRENT_FILE).read_text(encoding="utf-8").strip()
+            meta = json.loads((target / "meta.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != FORMAT_VERSION or meta.get("signature") != signature:
+            return None
+        try:
+            data = np.load(target / "postings_data.npy", mmap_mode="r")
+            indices = np.load(target / "postings_indices.npy", mmap_mode="r")
+            indptr = np.load(target / "postings_indptr.npy", mmap_mode="r")
+            lengths = np.load(target / "doc_lengths.npy", mmap_mode="r")
+            postings = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]), copy=False)
+
+            terms = json.loads((target / "vocab.json").read_text(encoding="utf-8"))
+            chunk_ids: List[str] = []
+            docs: List[Document] = []
+            with open(target / "chunks.jsonl", encoding="utf-8") as f:
+                for line in f:
+                    rec = json.loads(line)
+                    chunk_ids.append(rec["id"])
+                    docs.append(Document(page_content=rec["text"], metadata=rec.get("metadata") or {}))
+        except Exception as e:
+            logger.warning(f"sparse index unreadable; rebuilding: {type(e).__name__}: {e}")
+            return None
+        return cls({t: i for i, t in enumerate(terms)}, postings, lengths, chunk_ids, docs)
+
+    # ------------------------------------------------------------
+    # 検索
+    # ------------------------------------------------------------
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """(チャンク番号, スコア) を降順で最大 k 件。どの語も一致しなければ空"""
+        counts = Counter(t for t in tokenize(query) if t in self.vocab)
+        if not counts or not len(self):
+            return []
+        rows = np.fromiter((self.vocab[t] for t in counts), dtype=np.int32, count=len(counts))
+        qtf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        scores = np.asarray(self.postings[rows].T @ qtf).ravel()
+
+        hit = np.flatnonzero(scores > 0)
+        if hit.size > k:
+            hit = hit[np.argpartition(scores[hit], -k)[-k:]]
+        hit = hit[np.argsort(-scores[hit], kind="stable")]
+        return [(int(i), float(scores[i])) for i in hit]
+
+
+class SparseRetriever(BaseRetriever):
+    """
+    SparseIndex を LangChain のリトリーバとして使うためのラッパ。
+    k / filter は呼び出しごとに指定できる（索引は読むだけなので複数スレッドから同時に呼べる）。
+    """
+
+    index: SparseIndex
+    k: int = 5
+
+    def _search(self, query: str, k: Optional[int], filter: Optional[Dict[str, Any]]) -> List[Document]:
+        k = k or self.k
+        if not filter:
+            return [self.index.docs[i] for i, _ in self.index.search(query, k)]
+        # フィルタはスコア計算後に当てる（一致した全件から条件に合うものを上位 k 件）
+        docs = (self.index.docs[i] for i, _ in self.index.search(query, len(self.index)))
+        return [d for d in docs if retrieval.metadata_matches(d.metadata, filter)][:k]
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        return self._search(query, k, filter)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        k: Optional[int] = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        # 1ms 未満で終わる CPU 処理なので、スレッドへ逃がさずループ上でそのまま実行する
+        return self._search(query, k, filter)
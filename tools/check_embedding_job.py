@@ -0,0 +1,158 @@
+"""
+埋め込みジョブ（embedding_job）が、レート制限（429）と途中停止から正しく再開できるかを確認します。
+fake_embeddings_server をこのプロセス内で起動し、OpenAIEmbeddings をそこへ向けて2回実行します。
+
+    1回目: ランダムな 429 に加え、一定数成功した後はクォータ切れ（常に 429）にして途中で止める
+    2回目: 429 はランダムなものだけにして、チェックポイントから再開させる
+
+確認すること（どれかが満たされなければ終了コード 1）:
+    - 1回目は EmbeddingJobError で止まり、一部のバッチだけがコミットされている
+    - 2回目はコミット済みのバッチを飛ばし、そのテキストをもう一度サーバーへ送らない
+    - 最後にはすべてのチャンクが Chroma に入り、チェックポイントが消えている
+
+使い方:
+    python tools/check_embedding_job.py
+"""
+
+from __future__ import annotations
+
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from langchain_core.documents import Document  # noqa: E402
+
+import constants as ct  # noqa: E402
+import embedding_job  # noqa: E402
+from tools import fake_embeddings_server as fake  # noqa: E402
+
+
+def _items(batches: int, batch_size: int) -> List[Tuple[str, Document]]:
+    return [
+        (f"doc{b}.pdf#{i}", Document(page_content=f"文書{b}の{i}番目のチャンク", metadata={"source": f"doc{b}.pdf", "page": i}))
+        for b in range(batches)
+        for i in range(batch_size)
+    ]
+
+
+def _server(args: argparse.Namespace):
+    state = fake._State(args)
+    server = fake.ThreadingHTTPServer(("127.0.0.1", 0), fake.make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def _server_args(**overrides) -> argparse.Namespace:
+    args = dict(dim=64, rate_limit_ratio=0.0, rate_limit_first=0, rate_limit_after=None, retry_after=0.01, seed=0, verbose=False)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def _vectordb(persist_dir: str, port: int):
+    from langchain_community.vectorstores import Chroma
+    from langchain_openai import OpenAIEmbeddings
+
+    embeddings = OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        base_url=f"http://127.0.0.1:{port}/v1",
+        api_key="fake",
+        # 429 はジョブ側で再試行する。文字列のまま送る（tiktoken を使わない）
+        max_retries=0,
+        check_embedding_ctx_length=False,
+    )
+    return Chroma(collection_name="embedding_job_check", embedding_function=embeddings, persist_directory=persist_dir)
+
+
+def _run(vectordb, items, checkpoint_dir: str, batch_size: int, max_attempts: int):
+    ct.EMBED_MAX_ATTEMPTS = max_attempts
+    try:
+        return embedding_job.run_embedding_job(vectordb, items, checkpoint_dir, batch_size=batch_size, max_concurrency=2), None
+    except embedding_job.EmbeddingJobError as e:
+        return None, e
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--batches", type=int, default=10)
+    ap.add_argument("--batch-size", type=int, default=8)
+    ap.add_argument("--stop-after", type=int, default=4, help="1回目でクォータ切れにするまでの成功リクエスト数")
+    ap.add_argument("--rate-limit-ratio", type=float, default=0.3)
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+    logging.getLogger("chromadb").setLevel(logging.CRITICAL)
+    ct.EMBED_BACKOFF_BASE_SEC = 0.01
+    ct.EMBED_BACKOFF_MAX_SEC = 0.05
+
+    items = _items(args.batches, args.batch_size)
+    texts = {doc_id: d.page_content for doc_id, d in items}
+    work = tempfile.mkdtemp(prefix="embedding_job_check_")
+    failures: List[str] = []
+    try:
+        # 1回目: 途中でクォータ切れ
+        server, first = _server(_server_args(rate_limit_ratio=args.rate_limit_ratio, rate_limit_after=args.stop_after, seed=1))
+        try:
+            _, error = _run(_vectordb(work, server.server_port), items, work, args.batch_size, max_attempts=3)
+        finally:
+            server.shutdown()
+        committed = set(_vectordb(work, 0).get(include=[])["ids"])
+        checkpoint = json.loads((Path(work) / embedding_job.CHECKPOINT_FILE).read_text(encoding="utf-8"))
+        if error is None:
+            failures.append("first run finished although the quota ran out")
+        if not 0 < len(committed) < len(items):
+            failures.append(f"first run committed {len(committed)}/{len(items)} chunks; expected a partial commit")
+        if len(checkpoint.get("done", [])) * args.batch_size != len(committed):
+            failures.append(f"checkpoint lists {len(checkpoint.get('done', []))} batches but {len(committed)} chunks are stored")
+
+        # 2回目: チェックポイントから再開
+        server, second = _server(_server_args(rate_limit_ratio=args.rate_limit_ratio, seed=2))
+        try:
+            stats, error = _run(_vectordb(work, server.server_port), items, work, args.batch_size, max_attempts=8)
+        finally:
+            server.shutdown()
+        stored = set(_vectordb(work, 0).get(include=[])["ids"])
+        resent = sorted(i for i in committed if json.dumps(texts[i], ensure_ascii=False) in second.inputs)
+        if error is not None:
+            failures.append(f"resumed run failed: {error}")
+        elif stats["skipped"] * args.batch_size != len(committed):
+            failures.append(f"resumed run skipped {stats['skipped']} batches; expected {len(committed) // args.batch_size}")
+        if resent:
+            failures.append(f"resumed run re-embedded {len(resent)} committed chunks (e.g. {resent[0]})")
+        if stored != set(texts):
+            failures.append(f"{len(set(texts) - stored)} chunks missing after resume")
+        if (Path(work) / embedding_job.CHECKPOINT_FILE).exists():
+            failures.append("checkpoint left behind after a complete run")
+        if not (first.rate_limited and second.rate_limited):
+            failures.append("no 429 was injected; raise --rate-limit-ratio")
+
+        print(
+            f"first: committed={len(committed) // args.batch_size}/{args.batches} batches "
+            f"requests={first.requests} rate_limited={first.rate_limited}",
+            file=sys.stderr,
+        )
+        print(
+            f"resume: skipped={stats['skipped'] if stats else '-'} committed={stats['committed'] if stats else '-'} "
+            f"embedded={second.embedded} requests={second.requests} rate_limited={second.rate_limited}",
+            file=sys.stderr,
+        )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    for f in failures:
+        print(f"FAIL: {f}", file=sys.stderr)
+    print("OK" if not failures else f"{len(failures)} check(s) failed", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
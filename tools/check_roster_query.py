@@ -0,0 +1,95 @@
+"""
+社員名簿への質問の解釈（roster_query）が、名簿の質問と文書の質問を取り違えていないかを確認します。
+data/ 配下の社員名簿（roster.find_staff_csv で探す）を使い、LLM・API は使いません。
+
+確認すること（どれかが満たされなければ終了コード 1）:
+    - DOCUMENT_QUESTIONS: 部署名などを含んでいても文書の内容を尋ねる質問は None（RAG に回る）
+    - ROSTER_QUESTIONS: 名簿の質問は期待した操作（count / list / group）で解釈される
+
+使い方:
+    python tools/check_roster_query.py
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import logging
+import argparse
+from pathlib import Path
+from typing import List
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import roster  # noqa: E402
+import roster_query  # noqa: E402
+
+
+# 名簿の値（部署名など）を含むが、文書の内容を尋ねている質問
+DOCUMENT_QUESTIONS = (
+    "人事部の人の採用計画を教えて",
+    "営業部の人の業務内容を教えて",
+    "IT部に所属する人の役割を教えて",
+    "営業部の社員の業務内容を教えて",
+    "IT部の社員のスキルアップ計画について教えて",
+    "営業部の今期のスケジュールを教えて",
+    "人事部の取り組みを教えて",
+    "マーケティング部の人の担当業務は？",
+    "新入社員の研修について",
+    "人事部の評価制度を教えて",
+)
+# 名簿で答える質問と、期待する操作
+ROSTER_QUESTIONS = (
+    ("営業部の社員は何人？", "count"),
+    ("営業部の人は何人いますか", "count"),
+    ("従業員は全部で何名ですか", "count"),
+    ("30代の社員は何人いますか", "count"),
+    ("2020年以降に入社した社員は何人？", "count"),
+    ("簿記2級の資格を持っている社員は何人", "count"),
+    ("人事部の社員一覧", "list"),
+    ("営業部の社員を教えて", "list"),
+    ("IT部のメンバーを教えて", "list"),
+    ("IT部の人の名前を教えて", "list"),
+    ("経理部に所属しているのは誰？", "list"),
+    ("データ分析のスキルがある人を教えて", "list"),
+    ("30歳以上の営業部の社員を一覧で", "list"),
+    ("部署ごとの人数", "group"),
+    ("役職別の社員数を教えて", "group"),
+)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--csv", default=None, help="社員名簿の CSV（既定はアプリと同じ探し方）")
+    args = ap.parse_args(argv)
+
+    # アプリと同じ相対パス（./data）を使う
+    os.chdir(ROOT)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    path = args.csv or roster.find_staff_csv()
+    if not path:
+        print("FAIL: staff roster CSV not found", file=sys.stderr)
+        return 1
+    staff = roster.get_roster(path)
+
+    failures: List[str] = []
+    for question in DOCUMENT_QUESTIONS:
+        query = roster_query.parse(question, staff)
+        if query is not None:
+            failures.append(f"document question taken by the roster ({query.op}, {query.labels}): {question}")
+    for question, op in ROSTER_QUESTIONS:
+        query = roster_query.parse(question, staff)
+        if query is None or query.op != op:
+            failures.append(f"roster question parsed as {query.op if query else None}, expected {op}: {question}")
+
+    for f in failures:
+        print(f"FAIL: {f}", file=sys.stderr)
+    total = len(DOCUMENT_QUESTIONS) + len(ROSTER_QUESTIONS)
+    print("OK" if not failures else f"{len(failures)}/{total} check(s) failed", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+OpenAI 互換の埋め込みAPIをローカルで模擬するサーバーです（埋め込みジョブの動作確認用）。
+入力テキストから決定的なベクトルを返し、指定した割合・回数で 429 を返します。
+
+使い方:
+    python tools/fake_embeddings_server.py --port 8765 --rate-limit-ratio 0.3
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake streamlit run main.py
+
+    GET /stats で受信数・429 を返した回数を確認できます。
+"""
+
+from __future__ import annotations
+
+import sys
+import json
+import math
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_vector(item, dim: int) -> list:
+    """入力（文字列またはトークン列）から単位ベクトルを決定的に作る"""
+    seed = hashlib.sha256(json.dumps(item, ensure_ascii=False).encode("utf-8")).digest()
+    rnd = random.Random(seed)
+    vec = [rnd.uniform(-1.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class _State:
+    def __init__(self, args) -> None:
+        self.args = args
+        self.lock = threading.Lock()
+        self.rnd = random.Random(args.seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.embedded = 0
+        self.succeeded = 0
+        # 埋め込んだ入力ごとの回数（同じテキストを何度送られたかの確認用）
+        self.inputs: Counter = Counter()
+
+    def should_rate_limit(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            hit = (
+                self.requests <= self.args.rate_limit_first
+                or self.rnd.random() < self.args.rate_limit_ratio
+                # 上限に達したあとは常に 429（クォータ切れで途中停止する状況の再現）
+                or (self.args.rate_limit_after is not None and self.succeeded >= self.args.rate_limit_after)
+            )
+            if hit:
+                self.rate_limited += 1
+            else:
+                self.succeeded += 1
+            return hit
+
+
+def make_handler(state: _State):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, body: dict, headers: dict | None = None) -> None:
+            raw = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send(200, {
+                    "requests": state.requests,
+                    "rate_limited": state.rate_limited,
+                    "embedded": state.embedded,
+                })
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self) -> None:
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+
+            if state.should_rate_limit():
+                self._send(
+                    429,
+                    {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+                    {"Retry-After": str(state.args.retry_after)},
+                )
+                return
+
+            inputs = payload.get("input", [])
+            # 文字列1件 / トークン列1件 はリストに揃える
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            data = []
+            for i, item in enumerate(inputs):
+                vec = fake_vector(item, state.args.dim)
+                if payload.get("encoding_format") == "base64":
+                    emb = base64.b64encode(struct.pack(f"<{len(vec)}f", *vec)).decode("ascii")
+                else:
+                    emb = vec
+                data.append({"object": "embedding", "index": i, "embedding": emb})
+            with state.lock:
+                state.embedded += len(inputs)
+                state.inputs.update(json.dumps(item, ensure_ascii=False) for item in inputs)
+            self._send(200, {
+                "object": "list",
+                "data": data,
+                "model": payload.get("model", "fake-embedding"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+        def log_message(self, fmt, *args) -> None:
+            if state.args.verbose:
+                sys.stderr.write(fmt % args + "\n")
+
+    return Handler
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--rate-limit-ratio", type=float, default=0.0, help="429 を返す確率")
+    ap.add_argument("--rate-limit-first", type=int, default=0, help="最初の N リクエストは必ず 429")
+    ap.add_argument("--rate-limit-after", type=int, default=None, help="N リクエスト成功した後は常に 429")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="429 応答の Retry-After（秒）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(_State(args)))
+    print(f"fake embeddings server on http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
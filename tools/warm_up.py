@@ -0,0 +1,274 @@
+"""
+質問ログから頻出質問を集計し、その検索結果（と、指定すれば回答）を事前計算してウォームキャッシュに書き出します。
+アプリ（utils）は会話の1問目がこれらの質問と一致したとき、検索・回答生成を省いてキャッシュから返します。
+クエリの埋め込みも同時に埋め込みキャッシュ（SQLite）へ入るため、言い回しの違う質問の検索も速くなります。
+
+読むログ（logs/ 配下。ローテーション済みのものも含む）:
+    app.jsonl*   app_logging の JSON Lines（event: user_message / answer）
+    app.log*     以前のテキスト形式（ApplicationLog: {'message': '...', 'application_mode': '...'}）
+
+質問は warm_cache.normalize_question で表記ゆれをそろえて数え、モードは直後の回答のモード
+（実際に処理したモード）を使います。社員名簿から答えた質問（LLM を使わない経路）は数えません。
+
+使い方:
+    python tools/warm_up.py --list                       # 集計結果を表示するだけ（API を使わない）
+    python tools/warm_up.py && streamlit run main.py     # デプロイ時: 起動前に検索結果を事前計算
+    python tools/warm_up.py --answers --interval 3600    # 1時間ごとに回答まで事前計算し直す
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import ast
+import sys
+import json
+import time
+import logging
+import argparse
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import constants as ct  # noqa: E402
+import warm_cache  # noqa: E402
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# 以前のテキスト形式のログの1行（ApplicationLog の dict 表現）
+_LEGACY_LINE = re.compile(r"^\S+ \S+ \[\w+\] " + re.escape(ct.LOGGER_NAME) + r": (\{.*\})\s*$")
+# LLM を使わずに答えた経路（事前計算の対象外）
+_NON_RAG_ROUTES = {"roster_table", "roster_query"}
+
+
+############################################################
+# ログの読み込み
+############################################################
+def log_files(log_dir: Path) -> List[Path]:
+    """JSON Lines と以前のテキスト形式のログ（ローテーション済みを含む）"""
+    names = (getattr(ct, "LOG_JSON_FILE", "app.jsonl"), "app.log")
+    files = {p for name in names for p in log_dir.glob(f"{name}*") if p.is_file()}
+    return sorted(files, key=lambda p: (p.stat().st_mtime, p.name))
+
+
+def _legacy_events(lines: Iterable[str]) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+    """以前の形式: 質問は message が文字列、回答は message が dict（mode / answer を含む）"""
+    for line in lines:
+        m = _LEGACY_LINE.match(line)
+        if not m:
+            continue
+        try:
+            data = ast.literal_eval(m.group(1))
+        except (ValueError, SyntaxError):
+            continue
+        if not isinstance(data, dict):
+            continue
+        msg = data.get("message")
+        if isinstance(msg, str):
+            yield None, {"event": "user_message", "message": msg, "mode": data.get("application_mode")}
+        elif isinstance(msg, dict):
+            # 以前の形式には経路が無い。社員名簿の直接表示だけは回答文で見分ける
+            route = "roster_table" if str(msg.get("answer", "")).startswith("社員名簿を表示") else None
+            yield None, {"event": "answer", "mode": msg.get("mode") or data.get("application_mode"), "route": route}
+
+
+def _jsonl_events(lines: Iterable[str]) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get("event") in ("user_message", "answer"):
+            yield record.get("session_id"), record
+
+
+def read_events(path: Path) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+    """(セッションID, イベント) を書かれた順に返す。以前の形式にはセッションIDが無い（None）"""
+    with path.open(encoding="utf-8", errors="replace") as f:
+        if ".jsonl" in path.name:
+            yield from _jsonl_events(f)
+        else:
+            yield from _legacy_events(f)
+
+
+############################################################
+# 集計
+############################################################
+@dataclass
+class FrequentQuestion:
+    key: str
+    mode: str
+    count: int = 0
+    variants: Counter = field(default_factory=Counter)
+
+    @property
+    def question(self) -> str:
+        """代表の質問文（最も多かった書き方）"""
+        return self.variants.most_common(1)[0][0]
+
+
+def mine(paths: Iterable[Path]) -> List[FrequentQuestion]:
+    """
+    正規化した (質問, モード) ごとに回数を数え、多い順に返す。
+    質問のモードは、同じセッションで次に出た回答のモード（無ければ質問時の画面のモード）。
+    """
+    modes = {getattr(ct, "ANSWER_MODE_1", ""), getattr(ct, "ANSWER_MODE_2", "")}
+    found: Dict[Tuple[str, str], FrequentQuestion] = {}
+
+    def count(question: Dict[str, Any], answer: Optional[Dict[str, Any]]) -> None:
+        if answer is not None and answer.get("route") in _NON_RAG_ROUTES:
+            return
+        text = str(question.get("message") or "").strip()
+        key = warm_cache.normalize_question(text)
+        mode = (answer or {}).get("mode") or question.get("mode")
+        if not key or mode not in modes:
+            return
+        item = found.setdefault((key, mode), FrequentQuestion(key, mode))
+        item.count += 1
+        item.variants[text] += 1
+
+    for path in paths:
+        pending: Dict[Optional[str], Dict[str, Any]] = {}
+        for session_id, event in read_events(path):
+            if event["event"] == "user_message":
+                if session_id in pending:
+                    count(pending.pop(session_id), None)
+                pending[session_id] = event
+            elif session_id in pending:
+                count(pending.pop(session_id), event)
+        for question in pending.values():
+            count(question, None)
+    return sorted(found.values(), key=lambda q: (-q.count, q.key, q.mode))
+
+
+############################################################
+# 事前計算
+############################################################
+def _previous_answers(path: Path, fingerprint: str) -> Dict[Tuple[str, str], str]:
+    """前回のキャッシュのうち、今のコーパス・設定で作られた回答（作り直しの LLM 呼び出しを省く）"""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != warm_cache.FORMAT_VERSION or data.get("signature") != warm_cache.signature(fingerprint):
+        return {}
+    return {(e["key"], e.get("mode", "")): e["answer"] for e in data.get("entries") or [] if e.get("answer")}
+
+
+def _query_embedder(retriever) -> Any:
+    """retriever が使っている埋め込み（埋め込みキャッシュ付き）。無ければ None"""
+    vectorstore = getattr(getattr(retriever, "dense", None), "vectorstore", None)
+    return getattr(vectorstore, "embeddings", None)
+
+
+def _degraded(trace) -> bool:
+    """時間切れ・失敗で検索や回答が欠けた結果か（キャッシュに残さない）"""
+    return any(name.endswith(("_timeout", "_skipped", "_error")) for name in trace.fallbacks)
+
+
+def warm_up(
+    questions: List[FrequentQuestion],
+    index,
+    *,
+    answers: bool,
+    previous: Dict[Tuple[str, str], str],
+) -> List[warm_cache.WarmEntry]:
+    """頻出質問ごとにクエリの埋め込み・検索結果・（answers=True なら）回答を計算する"""
+    import tracing
+    import utils
+
+    llm = utils._get_llm()
+    embedder = _query_embedder(index.retriever)
+    docs_by_key: Dict[str, Tuple[Dict[str, Any], ...]] = {}
+    entries: List[warm_cache.WarmEntry] = []
+    for q in questions:
+        # 言い回しの違う書き方も埋め込みキャッシュへ（検索は代表の質問文だけで行う）
+        if embedder is not None:
+            for text in q.variants:
+                try:
+                    embedder.embed_query(text)
+                except Exception as e:
+                    logger.warning(f"warm-up: embed failed: {type(e).__name__}: {e}")
+                    break
+
+        if q.key not in docs_by_key:
+            trace = tracing.Trace("warm_up")
+            docs = utils.run_sync(tracing.within(trace, utils._aprepare_context(llm, index.retriever, q.question, [], None)))
+            if _degraded(trace):
+                logger.warning(f"warm-up: retrieval degraded, skipped: {q.question} {trace.fallbacks}")
+                continue
+            docs_by_key[q.key] = tuple(warm_cache.doc_to_dict(d) for d in docs)
+        entry = warm_cache.WarmEntry(q.key, q.question, q.mode, q.count, docs_by_key[q.key])
+
+        answer = previous.get((q.key, q.mode)) if answers else None
+        if answers and answer is None:
+            trace = tracing.Trace("warm_up")
+            result = utils.run_sync(tracing.within(trace, utils.aget_llm_response(
+                q.question, mode=q.mode, llm=llm, retriever=index.retriever, history=[], warm=entry,
+            )))
+            if _degraded(trace):
+                logger.warning(f"warm-up: answer failed, kept retrieval only: {q.question} {trace.fallbacks}")
+            else:
+                answer = result["answer"]
+        entries.append(warm_cache.WarmEntry(q.key, q.question, q.mode, q.count, entry.docs, answer))
+        logger.info(f"warm-up: {q.count:>4} [{q.mode}] {q.question} docs={len(entry.docs)} answer={answer is not None}")
+    return entries
+
+
+def run_once(args) -> int:
+    import initialize
+
+    questions = mine(log_files(Path(args.logs)))
+    questions = [q for q in questions if q.count >= args.min_count][: args.top]
+    if args.list:
+        for q in questions:
+            print(f"{q.count}\t{q.mode}\t{q.question!r}")
+        return 0
+    if not questions:
+        logger.info("warm-up: no frequent questions in the logs")
+        return 0
+
+    index = initialize.get_rag_index()
+    out = Path(args.out)
+    previous = {} if args.refresh else _previous_answers(out, index.fingerprint)
+    t0 = time.perf_counter()
+    entries = warm_up(questions, index, answers=args.answers, previous=previous)
+    warm_cache.save(entries, index.fingerprint, str(out))
+    logger.info(f"warm-up: wrote {len(entries)} entries to {out} in {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--logs", default=str(ROOT / getattr(ct, "LOG_DIR_PATH", "./logs")), help="ログのディレクトリ")
+    ap.add_argument("--out", default=str(ROOT / getattr(ct, "WARM_CACHE_PATH", "./.cache/warm_cache.json")))
+    ap.add_argument("--top", type=int, default=getattr(ct, "WARM_CACHE_TOP_N", 50), help="事前計算する質問数")
+    ap.add_argument("--min-count", type=int, default=getattr(ct, "WARM_CACHE_MIN_COUNT", 2), help="対象にする最小の回数")
+    ap.add_argument("--answers", action="store_true", help="回答も事前計算する（LLM を呼ぶ）")
+    ap.add_argument("--refresh", action="store_true", help="前回の回答を使い回さずに作り直す")
+    ap.add_argument("--list", action="store_true", help="集計結果を表示するだけ")
+    ap.add_argument("--interval", type=float, default=0.0, help="指定すると、この秒数ごとに繰り返す")
+    args = ap.parse_args(argv)
+
+    # アプリと同じ相対パス（./data, ./chroma_store, ./.cache）を使う
+    os.chdir(ROOT)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("chromadb").setLevel(logging.CRITICAL)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    while True:
+        status = run_once(args)
+        if args.interval <= 0 or args.list:
+            return status
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
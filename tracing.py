@@ -0,0 +1,252 @@
+"""
+このファイルは、1リクエスト内の各段（言い換え・埋め込み・検索・HYDE・生成など）の
+処理時間とトークン数を記録する、軽量なトレースの仕組みを定義するファイルです。
+- Trace: 1リクエスト分の記録。終わったら to_record() の dict を1行ログに出す
+- span("名前"): with で囲んだ区間の時間を記録する。トレースが無いときは何もしない
+- 実行中のトレース・区間は ContextVar で持つので、asyncio のタスクやスレッドプールにも引き継がれる
+- LLM のトークン数は TokenUsageCallback が LLM の応答（usage_metadata）から拾う
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import constants as ct
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 区間・トレース
+############################################################
+class Span:
+    """計測区間。attrs には件数・トークン数など段ごとの情報を入れる"""
+
+    __slots__ = ("name", "parent", "start_ms", "duration_ms", "attrs", "_t0")
+
+    def __init__(self, name: str, parent: Optional[str], start_ms: float, attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.parent = parent
+        self.start_ms = start_ms
+        self.duration_ms: Optional[float] = None
+        self.attrs = attrs
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def add(self, key: str, value: float) -> None:
+        self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        out = {"name": self.name, "start_ms": round(self.start_ms, 1), "ms": round(self.duration_ms or 0.0, 1)}
+        if self.parent:
+            out["parent"] = self.parent
+        out.update(self.attrs)
+        return out
+
+
+class _NullSpan:
+    """トレースが無いときの区間（記録しない）"""
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def add(self, key: str, value: float) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """
+    1リクエスト分の記録。区間はイベントループのスレッドからも追加されるためロックで守る。
+    tokens はリクエスト全体の合計、fallbacks は発動した代替経路（時間切れ・HYDE など）の名前。
+    """
+
+    def __init__(self, name: str, **attrs: Any) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.total_ms: Optional[float] = None
+        self.spans: List[Span] = []
+        self.tokens: Dict[str, int] = {}
+        self.fallbacks: List[str] = []
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def _open(self, name: str, parent: Optional[str], attrs: Dict[str, Any]) -> Span:
+        span = Span(name, parent, self.elapsed_ms(), attrs)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def add_tokens(self, usage: Dict[str, int]) -> None:
+        with self._lock:
+            for key, value in usage.items():
+                self.tokens[key] = self.tokens.get(key, 0) + value
+
+    def fallback(self, name: str) -> None:
+        with self._lock:
+            if name not in self.fallbacks:
+                self.fallbacks.append(name)
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self) -> "Trace":
+        if self.total_ms is None:
+            self.total_ms = self.elapsed_ms()
+        return self
+
+    def to_record(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [s.to_dict() for s in self.spans]
+            tokens = dict(self.tokens)
+            fallbacks = list(self.fallbacks)
+        return {
+            "event": "trace",
+            "trace_id": self.id,
+            "name": self.name,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "total_ms": round(self.total_ms if self.total_ms is not None else self.elapsed_ms(), 1),
+            **self.attrs,
+            "tokens": tokens,
+            "fallbacks": fallbacks,
+            "spans": spans,
+        }
+
+
+_CURRENT_TRACE: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _CURRENT_TRACE.get()
+
+
+@contextmanager
+def activate(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """with の中で trace を実行中のトレースにする（同期コード用）"""
+    token = _CURRENT_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _CURRENT_TRACE.reset(token)
+
+
+async def within(trace: Optional[Trace], coro):
+    """
+    コルーチンを trace の下で実行する。
+    run_sync で別スレッドのイベントループに渡すと ContextVar は引き継がれないため、ループ側で設定し直す。
+    """
+    token = _CURRENT_TRACE.set(trace)
+    try:
+        return await coro
+    finally:
+        _CURRENT_TRACE.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """
+    with で囲んだ区間を記録する。例外で抜けた場合は error に型名（取り消しなら cancelled）を入れる
+    （例外はそのまま送出）。
+    トレースが無ければ何も記録しない。
+    """
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    parent = _CURRENT_SPAN.get()
+    sp = trace._open(name, parent.name if parent else None, attrs)
+    token = _CURRENT_SPAN.set(sp)
+    try:
+        yield sp
+    except asyncio.CancelledError:
+        # 投機実行の取り消し・持ち時間切れ（失敗ではない）
+        sp.set(cancelled=True)
+        raise
+    except BaseException as e:
+        sp.set(error=type(e).__name__)
+        raise
+    finally:
+        sp.duration_ms = (time.perf_counter() - sp._t0) * 1000
+        _CURRENT_SPAN.reset(token)
+
+
+def fallback(name: str) -> None:
+    """代替経路が発動したことを実行中のトレースに記録する"""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.fallback(name)
+
+
+def emit(trace: Trace) -> Dict[str, Any]:
+    """トレースを締めて1行のログに出し、記録（dict）を返す"""
+    record = trace.finish().to_record()
+    logger.info(record)
+    return record
+
+
+############################################################
+# トークン数
+############################################################
+def _usage_from_result(response) -> Dict[str, int]:
+    """LLMResult からトークン数を取り出す（usage_metadata → llm_output.token_usage の順）"""
+    for gens in getattr(response, "generations", None) or []:
+        for gen in gens:
+            usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+            if usage:
+                return {
+                    "prompt_tokens": int(usage.get("input_tokens", 0)),
+                    "completion_tokens": int(usage.get("output_tokens", 0)),
+                }
+    token_usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    if token_usage:
+        return {
+            "prompt_tokens": int(token_usage.get("prompt_tokens", 0)),
+            "completion_tokens": int(token_usage.get("completion_tokens", 0)),
+        }
+    return {}
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """
+    LLM の呼び出しが終わるたびに、トークン数を実行中の区間とトレースに加算する。
+    状態を持たないので、LLM インスタンスに1つ付けておけば全リクエストで共有できる。
+    """
+
+    # 非同期の呼び出しでも同じコンテキスト（= 同じトレース・区間）で実行させる
+    run_inline = True
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        trace = _CURRENT_TRACE.get()
+        if trace is None:
+            return
+        usage = _usage_from_result(response)
+        if not usage:
+            return
+        trace.add_tokens(usage)
+        sp = _CURRENT_SPAN.get()
+        if sp is not None:
+            for key, value in usage.items():
+                sp.add(key, value)
@@ -8,7 +8,9 @@
 from __future__ import annotations
 
 import os
-from typing import Any, Dict, List
+import asyncio
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List
 
 from dotenv import load_dotenv
 import streamlit as st
@@ -18,9 +20,17 @@ from tenacity import retry, wait_exponential, stop_after_attempt
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
 
+if TYPE_CHECKING:
+    # 実体は _get_llm の中で読み込む（openai は重く、起動直後の描画を遅らせるため）
+    from langchain_openai import ChatOpenAI
+
+import chat_memory
 import constants as ct
+import context_packer
+import retrieval
+import tracing
+import warm_cache
 
 
 ############################################################
@@ -35,6 +45,8 @@ def _ensure_session_keys() -> None:
     st.session_state.setdefault("chat_history", [])
     st.session_state.setdefault("retriever", None)
     st.session_state.setdefault("bm25_retriever", None)  # initialize 側で設定されていれば使用
+    st.session_state.setdefault("chat_memory", chat_memory.ChatMemory())  # 履歴の窓と要約
+    st.session_state.setdefault("traces", [])  # 直近リクエストの処理時間の内訳（サイドバー表示用）
 
 
 _ensure_session_keys()
@@ -47,21 +59,28 @@ def _get_llm() -> ChatOpenAI:
     ChatOpenAI のインスタンスをキャッシュ。
     - tenacity 側で指数バックオフするため max_retries=0。
     - constants.MODEL / TEMPERATURE が無ければ安全値を使用。
+    - トークン数をトレースに記録する（ストリーミング時も使用量を受け取る）。
     """
+    from langchain_openai import ChatOpenAI
+
+    callbacks = [tracing.TokenUsageCallback()]
     try:
         model_name = getattr(ct, "MODEL", "gpt-4o-mini")
         temp = getattr(ct, "TEMPERATURE", 0.2)
-        return ChatOpenAI(model=model_name, temperature=temp, max_retries=0)
+        return ChatOpenAI(model=model_name, temperature=temp, max_retries=0, stream_usage=True, callbacks=callbacks)
     except Exception:
-        return ChatOpenAI(model="gpt-4o-mini", temperature=getattr(ct, "TEMPERATURE", 0.2), max_retries=0)
+        return ChatOpenAI(
+            model="gpt-4o-mini", temperature=getattr(ct, "TEMPERATURE", 0.2), max_retries=0,
+            stream_usage=True, callbacks=callbacks,
+        )
 
 
 ############################################################
 # 追加: OpenAI 呼び出しの指数バックオフ（429/一時失敗対策）
 ############################################################
 @retry(wait=wait_exponential(multiplier=1, min=1, max=8), stop=stop_after_attempt(3), reraise=True)
-def _invoke_with_retry(runnable, inputs: dict):
-    return runnable.invoke(inputs)
+async def _ainvoke_with_retry(runnable, inputs: dict):
+    return await runnable.ainvoke(inputs)
 
 
 ############################################################
@@ -78,10 +97,10 @@ def build_error_message(message: str) -> str:
 
 
 def _format_docs(docs) -> str:
-    """取得ドキュメントをプロンプト文脈用に結合"""
+    """取得ドキュメントをプロンプト文脈用に結合（出典付き）"""
     if not docs:
         return ""
-    return "\n\n".join(getattr(d, "page_content", str(d)) for d in docs)
+    return context_packer.format_context(docs)
 
 
 ############################################################
@@ -179,82 +198,172 @@ def infer_mode(q: str, *, current_mode: str) -> str:
     return current_mode
 
 
+############################################################
+# 非同期実行基盤
+############################################################
+# パイプラインは asyncio で書き、プロセスで1つのイベントループ（専用スレッド）上で動かす。
+# リクエストごとに asyncio.run するとループが毎回変わり、ChatOpenAI の非同期クライアント
+# （接続プール）を使い回せないため。Streamlit のスクリプトスレッドは結果を待つだけになる。
+_LOOP: asyncio.AbstractEventLoop | None = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None or _LOOP.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="rag-async", daemon=True).start()
+            _LOOP = loop
+        return _LOOP
+
+
+def run_sync(coro):
+    """コルーチンを共有イベントループで実行し、結果を待って返す（同期コードからの入口）"""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+
 ############################################################
 # LLM応答（RAG）
 ############################################################
-def get_llm_response(chat_message: str, *, mode: str | None = None) -> Dict[str, Any]:
+def _needs_condensation(chat_message: str, history: List[Any]) -> bool:
     """
-    LLMからの回答取得（RunnableベースのRAG）
-    Returns:
-        dict 例: {"answer": str, "context": [...]}
+    履歴を踏まえた言い換え（独立質問の生成）が必要か。
+    履歴が無い、または指示語などを含まず十分な長さがある質問はそのまま使う。
     """
-    use_mode = mode or st.session_state.get("mode", ct.ANSWER_MODE_1)
-    llm = _get_llm()
+    if not history:
+        return False
+    q = (chat_message or "").strip()
+    if len(q) < getattr(ct, "CONDENSE_MIN_SELF_CONTAINED_CHARS", 12):
+        return True
+    return any(m in q for m in getattr(ct, "CONDENSE_CONTEXT_MARKERS", ()))
+
 
-    # 1) 独立質問（履歴を踏まえて要約したクエリ）
+async def _acondense_question(llm, chat_message: str, history: List[Any]) -> str:
+    """履歴と最新の入力から、履歴なしで理解できる独立した質問を生成"""
     qgen_prompt = ChatPromptTemplate.from_messages(
         [("system", ct.SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT),
          MessagesPlaceholder("chat_history"),
          ("human", "{input}")]
     )
     qgen = qgen_prompt | llm | StrOutputParser()
-    try:
-        question_text = _invoke_with_retry(qgen, {"input": chat_message, "chat_history": st.session_state.get("chat_history", [])})
-    except Exception:
-        question_text = chat_message
-
-    # 2) retriever による関連ドキュメント取得
-    retriever = st.session_state.get("retriever", None)
-    if retriever is None:
-        return {"answer": "検索用リトリーバが初期化されていません。initialize を確認してください。", "context": []}
-
-    ctx_docs = []
-    # ② 通常検索
-    try:
-        ctx_docs = retriever.invoke(question_text) or []
-    except Exception:
-        ctx_docs = []
-
-    # ②’ 0件なら k を広げて再検索
-    if not ctx_docs:
+    with tracing.span("condense"):
         try:
-            if hasattr(retriever, "search_kwargs"):
-                current_k = int(retriever.search_kwargs.get("k", 4))
-                retriever.search_kwargs["k"] = max(8, current_k)
+            return (await _ainvoke_with_retry(qgen, {"input": chat_message, "chat_history": history})) or chat_message
         except Exception:
-            pass
-        try:
-            ctx_docs = retriever.invoke(question_text) or []
-        except Exception:
-            ctx_docs = []
+            tracing.fallback("condense_error")
+            return chat_message
+
 
-    # ③ まだ0件なら HYDE でクエリ拡張
-    if not ctx_docs:
+async def _ahyde_text(llm, question_text: str) -> str:
+    """HYDE: 回答がありそうな文書の一部を LLM に書かせ、それを検索クエリにする"""
+    hyde_prompt = (
+        "次の問い合わせに答えるための社内文書の一部のような短い説明を日本語で3〜5文書いてください。"
+        "部署名・方針・施策など、検索にかかりやすい語を自然に含めてください。\n\n"
+        f"問い合わせ: {question_text}"
+    )
+    with tracing.span("hyde"):
         try:
-            hyde_prompt = (
-                "次の問い合わせに答えるための社内文書の一部のような短い説明を日本語で3〜5文書いてください。"
-                "部署名・方針・施策など、検索にかかりやすい語を自然に含めてください。\n\n"
-                f"問い合わせ: {question_text}"
-            )
-            hyde_msg = llm.invoke(hyde_prompt)
-            hyde_text = getattr(hyde_msg, "content", str(hyde_msg))
+            hyde_msg = await llm.ainvoke(hyde_prompt)
+            return getattr(hyde_msg, "content", str(hyde_msg))
         except Exception:
-            hyde_text = question_text
+            tracing.fallback("hyde_error")
+            return question_text
+
+
+async def _aretrieve(
+    retriever,
+    query: str,
+    search_params: Dict[str, Any] | None = None,
+    *,
+    stage: str = "retrieve",
+) -> List[Any]:
+    """search_params（k / filter / score_threshold）はこの呼び出しだけに効く。stage はトレース上の名前"""
+    with tracing.span(stage) as sp:
         try:
-            ctx_docs = retriever.invoke(hyde_text) or []
+            docs = await retriever.ainvoke(query, **(search_params or {})) or []
         except Exception:
-            ctx_docs = []
+            tracing.fallback(f"{stage}_error")
+            docs = []
+        sp.set(chunks=len(docs))
+        return docs
+
+
+def _merge_docs(primary: List[Any], secondary: List[Any], *, limit: int) -> List[Any]:
+    """2つの検索結果を交互に並べ、重複を除いて limit 件にまとめる（primary を優先）"""
+    out: List[Any] = []
+    seen = set()
+    for i in range(max(len(primary), len(secondary))):
+        for docs in (primary, secondary):
+            if i < len(docs) and retrieval.doc_key(docs[i]) not in seen:
+                seen.add(retrieval.doc_key(docs[i]))
+                out.append(docs[i])
+    return out[:limit]
+
+
+async def _aprepare_context(
+    llm,
+    retriever,
+    chat_message: str,
+    history: List[Any],
+    search_params: Dict[str, Any] | None = None,
+) -> List[Any]:
+    """
+    回答の参考にするドキュメントを集める。独立した段は同時に走らせる。
+    - 言い換え（LLM）と、元の質問での検索
+    - 検索が0件なら HYDE で検索し直す（HYDE_SPECULATIVE=True なら検索と同時に生成し、1件でも返れば取り消す）
+    各段は retrieval.Deadline の持ち時間内だけ待ち、超えた段は諦めてそれまでの結果で進む。
+    """
+    deadline = retrieval.Deadline.from_constants()
+    token = retrieval.set_deadline(deadline)
+    condense_task = (
+        asyncio.create_task(_acondense_question(llm, chat_message, history))
+        if _needs_condensation(chat_message, history) else None
+    )
+    raw_task = asyncio.create_task(_aretrieve(retriever, chat_message, search_params))
+    hyde_task: asyncio.Task | None = None
+    try:
+        question_text = chat_message
+        if condense_task is not None:
+            question_text = await retrieval.run_stage("condense", condense_task, chat_message)
 
-    # ④ それでも0件なら BM25 があれば使用
-    if not ctx_docs:
-        bm25 = st.session_state.get("bm25_retriever", None)
-        if bm25 is not None:
-            try:
-                ctx_docs = (bm25.get_relevant_documents(question_text) or [])[: max(5, getattr(ct, "TOP_K", 5))]
-            except Exception:
-                pass
+        if getattr(ct, "HYDE_SPECULATIVE", False):
+            hyde_task = asyncio.create_task(_ahyde_text(llm, question_text))
 
-    # 3) LLM回答生成（モード別システム文）
+        if question_text.strip() == chat_message.strip():
+            ctx_docs = await raw_task
+        else:
+            cond_docs, raw_docs = await asyncio.gather(
+                _aretrieve(retriever, question_text, search_params, stage="retrieve_condensed"), raw_task
+            )
+            limit = (search_params or {}).get("k") or getattr(ct, "TOP_K", 5)
+            ctx_docs = _merge_docs(cond_docs, raw_docs, limit=limit)
+
+        # 0件なら HYDE でクエリ拡張（締め切りまでに生成できなければ諦める）
+        #   （retriever は dense と BM25 を同時に引いて RRF 統合済みのため、k 拡大や BM25 の段は不要）
+        if not ctx_docs:
+            tracing.fallback("hyde")
+            hyde_text = await retrieval.run_stage("hyde", hyde_task or _ahyde_text(llm, question_text), None)
+            if hyde_text and not deadline.expired():
+                ctx_docs = await _aretrieve(retriever, hyde_text, search_params, stage="retrieve_hyde")
+        return ctx_docs
+    finally:
+        for task in (condense_task, raw_task, hyde_task):
+            if task is not None and not task.done():
+                task.cancel()
+        retrieval.reset_deadline(token)
+
+
+def _build_answer_chain(llm, use_mode: str, chat_message: str, history: List[Any], ctx_docs: List[Any]):
+    """
+    LLM回答生成用のプロンプト（モード別システム文）と入力を組み立てる。
+    参考情報は重複除去・隣接結合・トークン上限で詰め直し、実際に渡した分を返す。
+    Returns:
+        (chain, inputs, packed_docs)
+    """
+    with tracing.span("pack", chunks_in=len(ctx_docs)) as sp:
+        ctx_docs = context_packer.pack_context(ctx_docs)
+        sp.set(chunks_out=len(ctx_docs))
     qa_sys = ct.SYSTEM_PROMPT_DOC_SEARCH if use_mode == ct.ANSWER_MODE_1 else ct.SYSTEM_PROMPT_INQUIRY
     qa_prompt = ChatPromptTemplate.from_messages(
         [("system", qa_sys),
@@ -262,24 +371,272 @@ def get_llm_response(chat_message: str, *, mode: str | None = None) -> Dict[str,
          ("human", "{input}"),
          ("system", "参考情報:\n{context}\n\n出力の最後に必ず「参照元: <ファイルパス>（必要ならページ番号）」を列挙してください。")]
     )
+    inputs = {"input": chat_message, "chat_history": history, "context": _format_docs(ctx_docs)}
+    return qa_prompt | llm, inputs, ctx_docs
 
-    ctx_text = _format_docs(ctx_docs)
+
+def _request_state() -> tuple:
+    """
+    st.session_state はスクリプトスレッドでしか読めないため、
+    イベントループへ渡す前に LLM・retriever・履歴をここで取り出しておく。
+    履歴は全件ではなく「古い分の要約 + 直近の数往復」（chat_memory）に絞ったもの。
+    """
+    _ensure_session_keys()
+    history = st.session_state.chat_memory.build(st.session_state.get("chat_history", []))
+    return _get_llm(), st.session_state.get("retriever", None), history
+
+
+def _warm_entry(
+    chat_message: str, mode: str, history: List[Any], search_params: Dict[str, Any] | None
+) -> warm_cache.WarmEntry | None:
+    """
+    頻出質問の事前計算（warm_cache）を引く。会話の1問目で検索条件の指定が無いときだけ使う
+    （履歴があると言い換えで検索結果が変わり、検索条件があると事前計算と条件が合わないため）。
+    """
+    if history or search_params:
+        return None
     try:
-        result_msg = (qa_prompt | llm).invoke({"input": chat_message, "chat_history": st.session_state.get("chat_history", []), "context": ctx_text})
-        answer_text = getattr(result_msg, "content", str(result_msg))
-    except Exception as e:
-        answer_text = f"回答生成に失敗しました。時間をおいて再試行してください。\n詳細: {type(e).__name__}: {e}"
+        return warm_cache.lookup(chat_message, mode, st.session_state.get("index_fingerprint"))
+    except Exception:
+        return None
 
-    # 4) 履歴に追加
+
+async def _asummarize_history(llm, summary: str, messages: List[Any]) -> str:
+    """これまでの要約に、窓から外れたやりとりを畳み込んだ新しい要約を作る"""
+    prompt = ChatPromptTemplate.from_messages(
+        [("system", ct.SYSTEM_PROMPT_SUMMARIZE_HISTORY),
+         ("human", "これまでの要約:\n{summary}"),
+         MessagesPlaceholder("messages")]
+    )
+    chain = prompt | llm | StrOutputParser()
+    return await _ainvoke_with_retry(chain, {"summary": summary or "（なし）", "messages": messages})
+
+
+def _submit_background(coro):
+    """コルーチンを共有ループに投げ、結果を待たずに Future を返す"""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop())
+
+
+def _append_history(chat_message: str, answer_text: str) -> None:
+    """履歴に追加し、窓から外れた分の要約をバックグラウンドで更新する"""
     try:
-        st.session_state["chat_history"] = st.session_state.get("chat_history", [])
-        st.session_state.chat_history.extend([HumanMessage(content=chat_message), AIMessage(content=answer_text)])
+        _ensure_session_keys()
+        history = st.session_state.chat_history
+        history.extend([HumanMessage(content=chat_message), AIMessage(content=answer_text)])
+        memory = st.session_state.chat_memory
+        memory.compact(history)
+        llm = _get_llm()
+        memory.schedule_summary(history, lambda s, m: _asummarize_history(llm, s, m), _submit_background)
     except Exception:
         pass
 
+
+def _answer_error_text(e: Exception) -> str:
+    return f"回答生成に失敗しました。時間をおいて再試行してください。\n詳細: {type(e).__name__}: {e}"
+
+
+_NO_RETRIEVER_TEXT = "検索用リトリーバが初期化されていません。initialize を確認してください。"
+
+
+def _new_trace(name: str, **attrs: Any) -> tracing.Trace | None:
+    """リクエスト1件分のトレースを作る（TRACE_ENABLED=False なら None = 記録しない）"""
+    return tracing.Trace(name, **attrs) if getattr(ct, "TRACE_ENABLED", True) else None
+
+
+def _publish_trace(trace: tracing.Trace | None) -> None:
+    """トレースをログに出し、サイドバー表示用にセッションへ直近分だけ残す（スクリプトスレッドから呼ぶ）"""
+    if trace is None:
+        return
+    try:
+        record = tracing.emit(trace)
+        _ensure_session_keys()
+        traces = st.session_state.traces
+        traces.append(record)
+        del traces[:-getattr(ct, "TRACE_HISTORY_SIZE", 20)]
+    except Exception:
+        pass
+
+
+def _mark_warm(kind: str) -> None:
+    """ウォームキャッシュを使ったことをトレースに残す（answer: 回答まで / context: 検索結果だけ）"""
+    trace = tracing.current_trace()
+    if trace is not None:
+        trace.set(warm=kind)
+
+
+def _pack_warm_docs(warm: warm_cache.WarmEntry) -> List[Any]:
+    """事前計算の回答に添える参照元（回答を作ったときと同じく詰め直した検索結果）"""
+    with tracing.span("pack", chunks_in=len(warm.docs)) as sp:
+        docs = context_packer.pack_context(warm.documents())
+        sp.set(chunks_out=len(docs))
+    return docs
+
+
+async def aget_llm_response(
+    chat_message: str,
+    *,
+    mode: str,
+    llm,
+    retriever,
+    history: List[Any],
+    search_params: Dict[str, Any] | None = None,
+    warm: warm_cache.WarmEntry | None = None,
+) -> Dict[str, Any]:
+    """
+    get_llm_response の非同期版（セッションに触れないので、どのスレッド・ループからでも呼べる）。
+    履歴への追加は呼び出し側で行う。
+    warm: 頻出質問の事前計算。回答があればそのまま返し、検索結果だけなら検索を省く
+    Returns:
+        dict 例: {"answer": str, "context": [...]}
+    """
+    if retriever is None:
+        tracing.fallback("no_retriever")
+        return {"answer": _NO_RETRIEVER_TEXT, "context": []}
+
+    if warm is not None and warm.answer:
+        _mark_warm("answer")
+        return {"answer": warm.answer, "context": _pack_warm_docs(warm)}
+    if warm is not None:
+        _mark_warm("context")
+        ctx_docs = warm.documents()
+    else:
+        ctx_docs = await _aprepare_context(llm, retriever, chat_message, history, search_params)
+    chain, inputs, ctx_docs = _build_answer_chain(llm, mode, chat_message, history, ctx_docs)
+    with tracing.span("generate"):
+        try:
+            result_msg = await chain.ainvoke(inputs)
+            answer_text = getattr(result_msg, "content", str(result_msg))
+        except Exception as e:
+            tracing.fallback("generate_error")
+            answer_text = _answer_error_text(e)
     return {"answer": answer_text, "context": ctx_docs}
 
 
+def get_llm_response(
+    chat_message: str,
+    *,
+    mode: str | None = None,
+    search_params: Dict[str, Any] | None = None,
+) -> Dict[str, Any]:
+    """
+    LLMからの回答取得（RunnableベースのRAG）。aget_llm_response を共有ループで実行する同期ラッパ。
+    search_params: この質問だけに使う検索条件（k / filter / score_threshold）
+    Returns:
+        dict 例: {"answer": str, "context": [...]}
+    """
+    use_mode = mode or st.session_state.get("mode", ct.ANSWER_MODE_1)
+    trace = _new_trace("get_llm_response", mode=use_mode)
+    llm, retriever, history = _request_state()
+    warm = _warm_entry(chat_message, use_mode, history, search_params)
+    result = run_sync(tracing.within(trace, aget_llm_response(
+        chat_message, mode=use_mode, llm=llm, retriever=retriever, history=history, search_params=search_params,
+        warm=warm,
+    )))
+    if trace is not None:
+        trace.set(chunks=len(result["context"]))
+    _publish_trace(trace)
+
+    # 履歴に追加
+    if retriever is not None:
+        _append_history(chat_message, result["answer"])
+    return result
+
+
+class StreamingAnswer:
+    """
+    回答をトークン単位で返すストリーム。
+    tokens() を最後まで読み切ると answer が確定し、履歴に追加される（トレースもここで出力）。
+    chain が None のときは answer をそのまま返す（remember=True なら履歴にも追加する）。
+    to_response() は get_llm_response と同じ形の dict を返す。
+    """
+
+    def __init__(
+        self,
+        chat_message: str,
+        chain,
+        inputs: Dict[str, Any] | None,
+        context: List[Any],
+        answer: str = "",
+        trace: tracing.Trace | None = None,
+        remember: bool = False,
+    ) -> None:
+        self.chat_message = chat_message
+        self.chain = chain
+        self.inputs = inputs
+        self.context = context
+        self.answer = answer
+        self.trace = trace
+        self.remember = remember
+
+    def tokens(self):
+        if self.chain is None:
+            yield self.answer
+            _publish_trace(self.trace)
+            if self.remember:
+                _append_history(self.chat_message, self.answer)
+            return
+        parts: List[str] = []
+        with tracing.activate(self.trace), tracing.span("generate") as sp:
+            try:
+                for chunk in self.chain.stream(self.inputs):
+                    text = getattr(chunk, "content", chunk)
+                    if text:
+                        if not parts:
+                            sp.set(first_token_ms=round(self.trace.elapsed_ms(), 1) if self.trace else None)
+                        parts.append(text)
+                        yield text
+            except Exception as e:
+                tracing.fallback("generate_error")
+                err = _answer_error_text(e)
+                parts.append(("\n\n" if parts else "") + err)
+                yield parts[-1]
+        self.answer = "".join(parts)
+        _publish_trace(self.trace)
+        _append_history(self.chat_message, self.answer)
+
+    def to_response(self) -> Dict[str, Any]:
+        return {"answer": self.answer, "context": self.context}
+
+
+def stream_llm_response(
+    chat_message: str,
+    *,
+    mode: str | None = None,
+    search_params: Dict[str, Any] | None = None,
+) -> StreamingAnswer:
+    """
+    get_llm_response のストリーミング版。
+    検索までを共有ループで済ませ、回答生成は返り値の tokens() を読むときに逐次行う
+    （st.write_stream が同期イテレータを読むため、ここだけ同期の stream を使う）。
+    """
+    use_mode = mode or st.session_state.get("mode", ct.ANSWER_MODE_1)
+    trace = _new_trace("stream_llm_response", mode=use_mode)
+    llm, retriever, history = _request_state()
+    if retriever is None:
+        if trace is not None:
+            trace.fallback("no_retriever")
+        return StreamingAnswer(chat_message, None, None, [], answer=_NO_RETRIEVER_TEXT, trace=trace)
+    warm = _warm_entry(chat_message, use_mode, history, search_params)
+    if warm is not None and warm.answer:
+        with tracing.activate(trace):
+            _mark_warm("answer")
+            ctx_docs = _pack_warm_docs(warm)
+        if trace is not None:
+            trace.set(chunks=len(ctx_docs))
+        return StreamingAnswer(chat_message, None, None, ctx_docs, answer=warm.answer, trace=trace, remember=True)
+    if warm is not None:
+        with tracing.activate(trace):
+            _mark_warm("context")
+        ctx_docs = warm.documents()
+    else:
+        ctx_docs = run_sync(tracing.within(trace, _aprepare_context(llm, retriever, chat_message, history, search_params)))
+    with tracing.activate(trace):
+        chain, inputs, ctx_docs = _build_answer_chain(llm, use_mode, chat_message, history, ctx_docs)
+    if trace is not None:
+        trace.set(chunks=len(ctx_docs))
+    return StreamingAnswer(chat_message, chain, inputs, ctx_docs, trace=trace)
+
+
 __all__ = [
     "get_source_icon",
     "build_error_message",
@@ -287,4 +644,8 @@ __all__ = [
     "render_fallback",
     "infer_mode",
     "get_llm_response",
+    "aget_llm_response",
+    "run_sync",
+    "stream_llm_response",
+    "StreamingAnswer",
 ]
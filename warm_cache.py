@@ -0,0 +1,227 @@
+"""
+このファイルは、よくある質問の検索結果・回答を事前に計算しておく「ウォームキャッシュ」を扱うファイルです。
+- 中身は tools/warm_up.py がログから集計した頻出質問について作る（アプリは読むだけ）
+- 質問は normalize_question で正規化した文字列とモードをキーに引く
+- ファイル全体に署名（コーパスの fingerprint + 検索・回答の設定）を持たせ、
+  データや設定が変わったら使わない（古い検索結果・回答を返さない）
+- ファイルは更新時刻をキーにプロセス内でキャッシュ（書き換えられれば自動で読み直し）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+from __future__ import annotations
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import unicodedata
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import streamlit as st
+from langchain_core.documents import Document
+
+import constants as ct
+
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+FORMAT_VERSION = 1
+
+_SPACES = re.compile(r"\s+")
+# 末尾の句読点・記号と、前後の引用符（ログに '""' のような空の質問も残っているため）
+_TRAILING_PUNCT = "。．.、,!！?？…"
+_QUOTES = "\"'“”‘’「」"
+
+
+############################################################
+# 正規化・署名
+############################################################
+def normalize_question(text: str) -> str:
+    """
+    表記ゆれ（全角/半角・大文字/小文字・空白・末尾の句読点）をそろえた質問文（照合用のキー）。
+    日本語の質問では空白に意味がないことが多いため、空白はすべて除く。
+    空文字になったものはキャッシュの対象外。
+    """
+    s = unicodedata.normalize("NFKC", str(text or ""))
+    s = _SPACES.sub("", s).strip(_QUOTES)
+    s = s.rstrip(_TRAILING_PUNCT)
+    return s.casefold()
+
+
+def signature(fingerprint: str) -> str:
+    """
+    ウォームキャッシュが使えるかを判定する署名（コーパス + 検索・回答の設定）。
+    どれかが変われば、作り直すまでキャッシュは使わない。
+    """
+    params = (
+        FORMAT_VERSION,
+        fingerprint,
+        getattr(ct, "CHUNK_SIZE", 500),
+        getattr(ct, "CHUNK_OVERLAP", 50),
+        getattr(ct, "TOP_K", 5),
+        getattr(ct, "HYBRID_CANDIDATES", 10),
+        getattr(ct, "HYBRID_DENSE_WEIGHT", 1.0),
+        getattr(ct, "HYBRID_SPARSE_WEIGHT", 1.0),
+        getattr(ct, "RRF_K", 60),
+        getattr(ct, "RETRIEVAL_SCORE_THRESHOLD", None),
+        getattr(ct, "CONTEXT_MAX_TOKENS", 3000),
+        getattr(ct, "MODEL", "gpt-4o-mini"),
+        getattr(ct, "TEMPERATURE", 0.2),
+        getattr(ct, "SYSTEM_PROMPT_DOC_SEARCH", ""),
+        getattr(ct, "SYSTEM_PROMPT_INQUIRY", ""),
+    )
+    return hashlib.sha1(repr(params).encode("utf-8")).hexdigest()
+
+
+############################################################
+# エントリ
+############################################################
+@dataclass(frozen=True)
+class WarmEntry:
+    """頻出質問1件分。docs は検索結果（詰め直す前）、answer は事前に作った回答（無ければ None）"""
+    key: str
+    question: str
+    mode: str
+    count: int
+    docs: Tuple[Dict[str, Any], ...]
+    answer: Optional[str] = None
+
+    def documents(self) -> List[Document]:
+        """検索結果を Document にして返す（呼び出しごとに新しいオブジェクト。共有分は書き換えさせない）"""
+        return [Document(page_content=d.get("page_content", ""), metadata=dict(d.get("metadata") or {})) for d in self.docs]
+
+
+def doc_to_dict(doc: Any) -> Dict[str, Any]:
+    metadata = {str(k): v if isinstance(v, (str, int, float, bool)) or v is None else str(v)
+                for k, v in (getattr(doc, "metadata", None) or {}).items()}
+    return {"page_content": getattr(doc, "page_content", str(doc)), "metadata": metadata}
+
+
+@dataclass(frozen=True)
+class WarmCache:
+    signature: str
+    created_at: str
+    by_key_mode: Dict[Tuple[str, str], WarmEntry]
+    by_key: Dict[str, WarmEntry]
+
+    def lookup(self, question: str, mode: str) -> Optional[WarmEntry]:
+        """
+        (質問, モード) が一致すれば回答付きで、質問だけが一致すれば検索結果だけを返す
+        （検索結果はモードに依らないが、回答はモードごとのプロンプトで作るため）。
+        """
+        key = normalize_question(question)
+        if not key:
+            return None
+        entry = self.by_key_mode.get((key, mode))
+        if entry is not None:
+            return entry
+        entry = self.by_key.get(key)
+        if entry is None:
+            return None
+        return replace(entry, mode=mode, answer=None)
+
+
+############################################################
+# 読み込み・書き出し
+############################################################
+def _parse(data: Dict[str, Any]) -> WarmCache:
+    by_key_mode: Dict[Tuple[str, str], WarmEntry] = {}
+    by_key: Dict[str, WarmEntry] = {}
+    for item in data.get("entries") or []:
+        entry = WarmEntry(
+            key=item["key"],
+            question=item.get("question", item["key"]),
+            mode=item.get("mode", ""),
+            count=int(item.get("count", 0)),
+            docs=tuple(item.get("docs") or ()),
+            answer=item.get("answer") or None,
+        )
+        by_key_mode.setdefault((entry.key, entry.mode), entry)
+        by_key.setdefault(entry.key, entry)
+    return WarmCache(
+        signature=data.get("signature", ""),
+        created_at=data.get("created_at", ""),
+        by_key_mode=by_key_mode,
+        by_key=by_key,
+    )
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _load(path: str, mtime_ns: int, size: int) -> Optional[WarmCache]:
+    """(パス, 更新時刻, サイズ) ごとに1回だけ読む。壊れていれば None（キャッシュなしで動く）"""
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("version") != FORMAT_VERSION:
+            logger.warning(f"warm cache ignored: unsupported version {data.get('version')}")
+            return None
+        cache = _parse(data)
+    except Exception as e:
+        logger.warning(f"warm cache ignored: {type(e).__name__}: {e}")
+        return None
+    logger.info(f"warm cache loaded: entries={len(cache.by_key_mode)} created_at={cache.created_at}")
+    return cache
+
+
+def get_cache(fingerprint: Optional[str], path: Optional[str] = None) -> Optional[WarmCache]:
+    """
+    現在のコーパス・設定に対応するウォームキャッシュを返す（2回目以降はファイルの stat だけ）。
+    無効化されている・ファイルが無い・署名が合わない場合は None。
+    """
+    if not fingerprint or not getattr(ct, "WARM_CACHE_ENABLED", True):
+        return None
+    p = Path(path or getattr(ct, "WARM_CACHE_PATH", "./.cache/warm_cache.json"))
+    try:
+        stat = p.stat()
+    except OSError:
+        return None
+    cache = _load(str(p), stat.st_mtime_ns, stat.st_size)
+    if cache is None or cache.signature != signature(fingerprint):
+        return None
+    return cache
+
+
+def lookup(question: str, mode: str, fingerprint: Optional[str]) -> Optional[WarmEntry]:
+    """質問に対応するエントリ（無ければ None）。WARM_CACHE_SERVE_ANSWERS=False なら回答は外す"""
+    cache = get_cache(fingerprint)
+    entry = cache.lookup(question, mode) if cache is not None else None
+    if entry is not None and entry.answer and not getattr(ct, "WARM_CACHE_SERVE_ANSWERS", True):
+        entry = replace(entry, answer=None)
+    return entry
+
+
+def save(entries: List[WarmEntry], fingerprint: str, path: Optional[str] = None) -> Path:
+    """エントリを書き出す（一時ファイルに書いてから置き換えるので、読み込み中のアプリが壊れた中身を読まない）"""
+    p = Path(path or getattr(ct, "WARM_CACHE_PATH", "./.cache/warm_cache.json"))
+    p.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "version": FORMAT_VERSION,
+        "signature": signature(fingerprint),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "entries": [
+            {
+                "key": e.key,
+                "question": e.question,
+                "mode": e.mode,
+                "count": e.count,
+                "docs": list(e.docs),
+                "answer": e.answer,
+            }
+            for e in entries
+        ],
+    }
+    fd, tmp = tempfile.mkstemp(dir=str(p.parent), prefix=p.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, p)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return p